@@ -178,11 +178,59 @@ EMAIL_ACCOUNTS = {
     "support": {
         "EMAIL_HOST_USER": os.getenv('SUPPORT_EMAIL_HOST_USER'),
         "EMAIL_HOST_PASSWORD": os.getenv('SUPPORT_EMAIL_HOST_PASSWORD'),
+        "IMAP_ENABLED": True,
     }
 }
 
+# Extra intake mailboxes, e.g. EMAIL_INTAKE_ACCOUNTS="emea,apac" reads
+# EMEA_EMAIL_HOST_USER / EMEA_EMAIL_HOST_PASSWORD (and optional
+# EMEA_EMAIL_IMAP_HOST / EMEA_EMAIL_IMAP_PORT / EMEA_EMAIL_IMAP_FOLDER)
+for intake_key in filter(None, (k.strip().lower() for k in os.getenv('EMAIL_INTAKE_ACCOUNTS', '').split(','))):
+    env_prefix = intake_key.upper()
+    EMAIL_ACCOUNTS[intake_key] = {
+        "EMAIL_HOST_USER": os.getenv(f'{env_prefix}_EMAIL_HOST_USER'),
+        "EMAIL_HOST_PASSWORD": os.getenv(f'{env_prefix}_EMAIL_HOST_PASSWORD'),
+        "IMAP_ENABLED": True,
+        "IMAP_HOST": os.getenv(f'{env_prefix}_EMAIL_IMAP_HOST'),
+        "IMAP_PORT": os.getenv(f'{env_prefix}_EMAIL_IMAP_PORT'),
+        "IMAP_FOLDER": os.getenv(f'{env_prefix}_EMAIL_IMAP_FOLDER'),
+    }
+
 EMAIL_IMAP_HOST = os.getenv('EMAIL_IMAP_HOST')
 EMAIL_IMAP_PORT = os.getenv('EMAIL_IMAP_PORT')
+EMAIL_IMAP_SSL = os.getenv('EMAIL_IMAP_SSL', 'True').lower() in ('1', 'true', 'yes')
+EMAIL_IMAP_FOLDER = os.getenv('EMAIL_IMAP_FOLDER', 'INBOX')
+# lease (seconds) a mailbox poller holds so two pollers never share a mailbox
+EMAIL_MAILBOX_LOCK_SECONDS = int(os.getenv('EMAIL_MAILBOX_LOCK_SECONDS', 600))
+# "full" downloads the whole RFC822 message, "bodystructure" downloads only the text part
+EMAIL_FETCH_MODE = os.getenv('EMAIL_FETCH_MODE', 'full')
+EMAIL_BODY_MAX_BYTES = int(os.getenv('EMAIL_BODY_MAX_BYTES', 256 * 1024))
+# characters of visible text kept when converting an HTML body
+EMAIL_BODY_MAX_CHARS = int(os.getenv('EMAIL_BODY_MAX_CHARS', 20000))
+# raw email sources are stored compressed: "zlib" or "zstd" (needs the zstandard package)
+EMAIL_RAW_CODEC = os.getenv('EMAIL_RAW_CODEC', 'zlib')
+# number of messages parsed, classified and inserted together
+EMAIL_BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', 50))
+# seconds a resolved sender email -> user id mapping is cached per process
+EMAIL_USER_CACHE_TTL = int(os.getenv('EMAIL_USER_CACHE_TTL', 300))
+# outgoing messages sent per SMTP connection before it is reopened
+EMAIL_SEND_CHUNK_SIZE = int(os.getenv('EMAIL_SEND_CHUNK_SIZE', 100))
+# Outgoing email outbox: rows drained per worker pass, attempts before a row fails,
+# messages per minute per account (EMAIL_ACCOUNTS[key]["SEND_RATE_PER_MINUTE"] wins)
+# and the first retry delay in seconds, doubled on every further attempt
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv('EMAIL_OUTBOX_BATCH_SIZE', 200))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv('EMAIL_OUTBOX_MAX_ATTEMPTS', 5))
+EMAIL_OUTBOX_RATE_PER_MINUTE = int(os.getenv('EMAIL_OUTBOX_RATE_PER_MINUTE', 60))
+EMAIL_OUTBOX_RETRY_SECONDS = int(os.getenv('EMAIL_OUTBOX_RETRY_SECONDS', 60))
+# 'Ticket Created' replies are queued when the ServiceNow ticket is created; the periodic
+# sweeper only picks up emails older than this many seconds that are still unanswered
+EMAIL_REPLY_SWEEP_GRACE_SECONDS = int(os.getenv('EMAIL_REPLY_SWEEP_GRACE_SECONDS', 300))
+
+# Near-duplicate suppression: new email tickets whose embedding is at least this
+# similar to a ticket of the last DUPLICATE_WINDOW_HOURS are linked to it
+DUPLICATE_DETECTION_ENABLED = os.getenv('DUPLICATE_DETECTION_ENABLED', 'True').lower() in ('1', 'true', 'yes')
+DUPLICATE_SIMILARITY_THRESHOLD = float(os.getenv('DUPLICATE_SIMILARITY_THRESHOLD', 0.92))
+DUPLICATE_WINDOW_HOURS = int(os.getenv('DUPLICATE_WINDOW_HOURS', 6))
 
 # Site Configuration
 DEFAULT_SITE_SCHEME=os.getenv('DEFAULT_SITE_SCHEME','http')
@@ -193,6 +241,51 @@ SERVICENOW_INSTANCE = os.getenv('SERVICENOW_INSTANCE')
 SERVICENOW_USERNAME = os.getenv('SERVICENOW_USERNAME')
 SERVICENOW_PASSWORD = os.getenv('SERVICENOW_PASSWORD')
 SERVICENOW_SYSID = os.getenv('SERVICENOW_SYSID')
+# pooled keep-alive session: connections kept per process, retries on 429/5xx
+# (idempotent requests only) with exponential backoff, connect/read timeouts in seconds
+SERVICENOW_POOL_SIZE = int(os.getenv('SERVICENOW_POOL_SIZE', 10))
+SERVICENOW_MAX_RETRIES = int(os.getenv('SERVICENOW_MAX_RETRIES', 3))
+SERVICENOW_BACKOFF_FACTOR = float(os.getenv('SERVICENOW_BACKOFF_FACTOR', 0.5))
+SERVICENOW_CONNECT_TIMEOUT = float(os.getenv('SERVICENOW_CONNECT_TIMEOUT', 5))
+SERVICENOW_READ_TIMEOUT = float(os.getenv('SERVICENOW_READ_TIMEOUT', 30))
+# status sync: sys_ids per sys_idIN query and records per result page
+SERVICENOW_SYNC_CHUNK_SIZE = int(os.getenv('SERVICENOW_SYNC_CHUNK_SIZE', 200))
+SERVICENOW_PAGE_SIZE = int(os.getenv('SERVICENOW_PAGE_SIZE', 1000))
+# incremental sync re-reads incidents updated this many seconds before the watermark
+SERVICENOW_SYNC_OVERLAP_SECONDS = int(os.getenv('SERVICENOW_SYNC_OVERLAP_SECONDS', 120))
+# changed tickets written per bulk_update and transaction
+SERVICENOW_APPLY_BATCH_SIZE = int(os.getenv('SERVICENOW_APPLY_BATCH_SIZE', 500))
+# incident creation: tickets per batch task and concurrent POSTs inside it
+# (keep the concurrency at or below SERVICENOW_POOL_SIZE so connections are reused)
+SERVICENOW_CREATE_BATCH_SIZE = int(os.getenv('SERVICENOW_CREATE_BATCH_SIZE', 50))
+SERVICENOW_CREATE_CONCURRENCY = int(os.getenv('SERVICENOW_CREATE_CONCURRENCY', 8))
+# create incidents through the Batch API (/api/now/v1/batch), this many per HTTP request;
+# failed sub-requests fall back to single POSTs
+SERVICENOW_BATCH_API = os.getenv('SERVICENOW_BATCH_API', 'False').lower() in ('1', 'true', 'yes')
+SERVICENOW_BATCH_SIZE = int(os.getenv('SERVICENOW_BATCH_SIZE', 25))
+# creation retries: a worker's claim on a ticket lasts SERVICENOW_CLAIM_LEASE_SECONDS; failed
+# tickets wait RETRY_BASE_SECONDS, doubled per attempt up to RETRY_MAX_SECONDS, and are given
+# up after SERVICENOW_CREATE_MAX_ATTEMPTS; one retry run claims at most SERVICENOW_RETRY_LIMIT
+SERVICENOW_CLAIM_LEASE_SECONDS = int(os.getenv('SERVICENOW_CLAIM_LEASE_SECONDS', 900))
+SERVICENOW_CREATE_MAX_ATTEMPTS = int(os.getenv('SERVICENOW_CREATE_MAX_ATTEMPTS', 8))
+SERVICENOW_RETRY_BASE_SECONDS = int(os.getenv('SERVICENOW_RETRY_BASE_SECONDS', 60))
+SERVICENOW_RETRY_MAX_SECONDS = int(os.getenv('SERVICENOW_RETRY_MAX_SECONDS', 21600))
+SERVICENOW_RETRY_LIMIT = int(os.getenv('SERVICENOW_RETRY_LIMIT', 500))
+# API calls per second shared by all workers (Redis broker), burst size and the longest
+# a call waits for a slot before giving up
+SERVICENOW_RATE_PER_SECOND = float(os.getenv('SERVICENOW_RATE_PER_SECOND', 10))
+SERVICENOW_RATE_BURST = int(os.getenv('SERVICENOW_RATE_BURST', 20))
+SERVICENOW_RATE_MAX_WAIT = float(os.getenv('SERVICENOW_RATE_MAX_WAIT', 30))
+# circuit breaker: opens for SERVICENOW_BREAKER_OPEN_SECONDS when at least MIN_REQUESTS calls
+# in the last one to two windows failed at ERROR_RATE (429, 5xx, network errors)
+SERVICENOW_BREAKER_WINDOW = int(os.getenv('SERVICENOW_BREAKER_WINDOW', 60))
+SERVICENOW_BREAKER_MIN_REQUESTS = int(os.getenv('SERVICENOW_BREAKER_MIN_REQUESTS', 10))
+SERVICENOW_BREAKER_ERROR_RATE = float(os.getenv('SERVICENOW_BREAKER_ERROR_RATE', 0.5))
+SERVICENOW_BREAKER_OPEN_SECONDS = int(os.getenv('SERVICENOW_BREAKER_OPEN_SECONDS', 60))
+# shared secret of the incident webhook (/service-now/webhook/incident/), empty disables it;
+# with the webhook on, status polling drops to an hourly reconciliation
+SERVICENOW_WEBHOOK_SECRET = os.getenv('SERVICENOW_WEBHOOK_SECRET', '')
+SERVICENOW_WEBHOOK_EVENT_RETENTION_DAYS = int(os.getenv('SERVICENOW_WEBHOOK_EVENT_RETENTION_DAYS', 7))
 
 
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL')
@@ -202,22 +295,35 @@ CELERY_TASK_SERIALIZER = os.getenv('CELERY_TASK_SERIALIZER')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND')
 CELERY_TIMEZONE = TIME_ZONE
 
+# Singleton task locks: "auto" uses Redis when the broker is Redis, else the database
+TASK_LOCK_BACKEND = os.getenv('TASK_LOCK_BACKEND', 'auto')
+TASK_LOCK_DEFAULT_LEASE = int(os.getenv('TASK_LOCK_DEFAULT_LEASE', 900))
+
 
 CELERY_BEAT_SCHEDULE = {
-    "sync-servicenow-ticket-status-every-10-min": {
+    "sync-servicenow-ticket-status": {
         "task": "servicenow.utils.task.sync_servicenow_ticket_statuses",
-        "schedule": crontab(minute="*/10"),  # every 10 minutes
+        # hourly reconciliation when the webhook pushes changes, else every 10 minutes
+        "schedule": crontab(minute="0") if SERVICENOW_WEBHOOK_SECRET else crontab(minute="*/10"),
     },
     "retry-servicenow-ticket-creation-every-10-min": {
         "task": "servicenow.utils.task.servicenow_ticket_retry",
         "schedule": crontab(minute="*/10"),  # every 10 minutes
     },
-    "check-email-replay-status-every-05-min": {
+    "sweep-email-replies-every-15-min": {
         "task": "tickets.utils.task.send_email_replay_with_ticket",
-        "schedule": crontab(minute="*/5"),  # every 5 minutes
+        "schedule": crontab(minute="*/15"),  # every 15 minutes
+    },
+    "send-outbound-emails-every-01-min": {
+        "task": "tickets.utils.task.send_outbound_emails",
+        "schedule": crontab(minute="*/1"),  # every 1 minutes
     },
     "monitor-email-every-01-min": {
         "task": "tickets.utils.emailmonitortask.email_monitoring",
         "schedule": crontab(minute="*/1"),  # every 1 minutes
     },
+    "prune-raw-email-blobs-daily": {
+        "task": "tickets.utils.task.prune_raw_email_blobs_task",
+        "schedule": crontab(hour="3", minute="30"),  # every day at 03:30
+    },
 }
\ No newline at end of file
@@ -1,4 +1,4 @@
-from django.contrib.auth.forms import UserCreationForm
+from django.contrib.auth.forms import UserCreationForm, PasswordResetForm
 from django.contrib.auth.models import User
 from django import forms
 from django.contrib.auth.forms import AuthenticationForm
@@ -108,4 +108,11 @@ class AdminUserUpdateForm(forms.ModelForm):
         email = self.cleaned_data.get('email')
         if User.objects.exclude(pk=self.instance.pk).filter(email=email).exists():
             raise forms.ValidationError("Email already in use.")
-        return email
\ No newline at end of file
+        return email
+
+
+# Password reset form that also covers users provisioned from inbound email,
+# who keep an unusable password until they set one
+class EmailUserPasswordResetForm(PasswordResetForm):
+    def get_users(self, email):
+        return User.objects.filter(email__iexact=email, is_active=True)
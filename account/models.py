@@ -1,10 +1,14 @@
-from django.db import models
+from django.db import models, connections
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.functions import Lower
+from django.db.models.signals import post_init, post_save, post_delete, post_migrate
 from django.dispatch import receiver
 
 """Models for accounts """
 
+USER_EMAIL_INDEX = "account_user_email_lower_idx"
+USER_EMAIL_INDEX_VENDORS = ("postgresql", "sqlite")
+
 # UserProfile model to extend User with email verification status
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="profile")
@@ -17,4 +21,40 @@ class UserProfile(models.Model):
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
-        UserProfile.objects.create(user=instance)
\ No newline at end of file
+        UserProfile.objects.create(user=instance)
+
+# Remember the email a user was loaded with, without loading a deferred field
+@receiver(post_init, sender=User)
+def remember_user_email(sender, instance, **kwargs):
+    instance._loaded_email = instance.__dict__.get("email")
+
+# Drop cached email -> user id entries when a user changes or is deleted,
+# the old address too when it changed
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def evict_user_email_cache(sender, instance, **kwargs):
+    from account.utils.emailuser import evict_cached_user_email
+    evict_cached_user_email(instance.email)
+    previous = getattr(instance, "_loaded_email", None)
+    if previous and previous != instance.email:
+        evict_cached_user_email(previous)
+    instance._loaded_email = instance.email
+
+# Case-insensitive index on auth_user.email used by the email -> user lookup.
+# auth_user belongs to django.contrib.auth, so it is created after every migrate
+# instead of in a migration; only on the databases it was tested with.
+@receiver(post_migrate)
+def create_user_email_index(sender, using="default", **kwargs):
+    if sender.name != "account":
+        return
+    connection = connections[using]
+    if connection.vendor not in USER_EMAIL_INDEX_VENDORS:
+        return
+    if not connection.features.supports_expression_indexes:
+        return
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, User._meta.db_table)
+    if USER_EMAIL_INDEX in constraints:
+        return
+    with connection.schema_editor() as editor:
+        editor.add_index(User, models.Index(Lower("email"), name=USER_EMAIL_INDEX))
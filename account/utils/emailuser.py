@@ -1,15 +1,20 @@
 import re
+import threading
+import time
 from django.contrib.auth import get_user_model
 import secrets
 import string
-from django.db import transaction
+from django.db import IntegrityError, connection, transaction
+from django.db.models.functions import Lower
 from django.utils.http import urlsafe_base64_encode
 from django.urls import reverse
 from django.contrib.auth.tokens import default_token_generator
-from django.template.loader import render_to_string
 from django.conf import settings
 from django.utils.encoding import force_bytes
-from account.utils.mailer import send_mail_from_account
+from account.models import UserProfile
+from tickets.models import OutboundEmail
+from tickets.utils.emailrender import get_email_templates
+from tickets.utils.outbox import enqueue_emails
 import logging
 
 """Utility functions for user management based on email addresses"""
@@ -18,6 +23,10 @@ logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
+# In-process TTL cache of lower-cased email -> user id
+_user_id_cache = {}
+_user_id_cache_lock = threading.Lock()
+
 # Helper function to slugify and limit username length
 def slugify_username(base: str) -> str:
     base = base.lower()
@@ -26,17 +35,21 @@ def slugify_username(base: str) -> str:
     return base[:30] or "user"
 
 # Generate a unique username based on email local part
-def generate_unique_username(email: str) -> str:
+def generate_unique_username(email: str, reserved=None) -> str:
     local_part = email.split("@")[0]
     base = slugify_username(local_part)
-    username = base
-    suffix = 0
-    while User.objects.filter(username=username).exists():
-        suffix += 1
-        username = f"{base}{suffix}"
-        if len(username) > 30:
-            username = username[:28] + str(suffix)  
-    return username
+    # keep room for a numeric suffix within the 30 character limit
+    stem = base[:24]
+    # one prefix query (uses the username index), the numeric suffix is checked here
+    pattern = re.compile(rf"^{re.escape(stem)}(\d+)$")
+    candidates = User.objects.filter(username__startswith=stem).values_list("username", flat=True)
+    taken = {username for username in candidates if username == base or pattern.match(username)}
+    # usernames handed out earlier in the same batch but not saved yet
+    taken.update(reserved or ())
+    if base not in taken:
+        return base
+    suffixes = [int(m.group(1)) for m in map(pattern.match, taken) if m]
+    return f"{stem}{max(suffixes, default=0) + 1}"
 
 # Generate a secure temporary password
 def generate_temporary_password(length=12) -> str:
@@ -51,68 +64,157 @@ def generate_temporary_password(length=12) -> str:
         ):
             return pwd
 
-# Main function to get or create user by email
-def get_or_create_user_by_email(email_address, send_welcome, account_key):
-    logger.debug(f"Attempting to get or create user for email: {email_address}")
-    logger.debug(f"Checking if user with email {email_address} exists.")
-    if User.objects.filter(email__iexact=email_address).exists():
-        user = User.objects.get(email__iexact=email_address)
-        logger.debug(
-            f"User with email {email_address} already exists. User ID: {user.id}"
-        )
-        return user, None
+# Create active, email-verified users for new senders in one transaction.
+# The password is unusable so no hash is computed; the welcome emails with the
+# password setup link go to the outbox in the same transaction.
+def provision_email_users(email_addresses, account_key, send_welcome=True):
+    wanted = {}
+    for email in email_addresses:
+        if email:
+            wanted.setdefault(email.lower(), email)
+    if not wanted:
+        return {}
 
-    logger.debug(f"No existing user found with email {email_address}.")
-    username = generate_unique_username(email_address)
-    temp_password = generate_temporary_password()
-    logger.debug(f"Generated username: {username} and passoword: ******")
+    welcome_account_key = account_key if send_welcome else None
+    try:
+        users = _create_email_users(list(wanted.values()), welcome_account_key)
+    except IntegrityError:
+        # another worker created one of the users or usernames concurrently
+        logger.warning("Bulk user provisioning conflicted, provisioning one by one.")
+        users = []
+        for email in wanted.values():
+            existing = find_users_by_email([email]).get(email.lower())
+            if existing is not None:
+                continue
+            try:
+                users.extend(_create_email_users([email], welcome_account_key))
+            except IntegrityError:
+                logger.warning(f"User for {email} was created concurrently.")
+
+    provisioned = {user.email.lower(): user for user in users}
+    missing = [email for email in wanted if email not in provisioned]
+    if missing:
+        provisioned.update(find_users_by_email(missing))
+    logger.debug(f"Provisioned {len(users)} new user(s) for email senders.")
+    return provisioned
+
+
+def _create_email_users(email_addresses, welcome_account_key=None):
+    users = []
+    reserved = set()
+    for email in email_addresses:
+        username = generate_unique_username(email, reserved=reserved)
+        reserved.add(username)
+        user = User(username=username, email=email, is_active=True)
+        user.set_unusable_password()
+        users.append(user)
 
-    logger.debug(
-        f"Creating new user with email {email_address} and username {username}."
-    )
     with transaction.atomic():
-        user = User.objects.create_user(
-            username=username, email=email_address, password=temp_password
-        )
-    logger.debug(f"User created with ID: {user.id}")
-
-    # Mark email as verified and activate user for email users
-    profile = getattr(user, "profile", None)
-    if profile:
-        profile.email_verified = True
-        profile.save(update_fields=["email_verified"])
-    user.is_active = True
-    user.save(update_fields=["is_active"])
-    
-    # Build a one-time password-change/reset URL (so they can click to set new password)
+        if connection.features.can_return_rows_from_bulk_insert:
+            # bulk_create skips post_save, so the profiles are created here
+            User.objects.bulk_create(users)
+            UserProfile.objects.bulk_create(
+                [UserProfile(user=user, email_verified=True) for user in users]
+            )
+        else:
+            for user in users:
+                user.save()
+            UserProfile.objects.filter(user__in=users).update(email_verified=True)
+        if welcome_account_key:
+            enqueue_emails(build_welcome_emails(users, welcome_account_key))
+    return users
+
+
+# Build a one-time password setup URL for users created from email
+def build_password_setup_url(user):
     uid = urlsafe_base64_encode(force_bytes(user.pk))
     token = default_token_generator.make_token(user)
-
-    # Use your password reset confirm route name or custom change link
     reset_path = reverse(
         "account:password_reset_confirm", kwargs={"uidb64": uid, "token": token}
     )
-    reset_url = f"{settings.DEFAULT_SITE_SCHEME or 'https'}://{settings.DEFAULT_SITE_DOMAIN or settings.ALLOWED_HOSTS[0]}{reset_path}"
-
-    if send_welcome:
-        ctx = {
-            "user": user,
-            "reset_url": reset_url,
-        }
-        subject = render_to_string(
-            "email/new_email_user_subject.txt", ctx
-        ).strip()
-        text_body = render_to_string("email/new_email_user.txt", ctx)
-        html_body = render_to_string("email/new_email_user.html", ctx)
-
-        # send email using your mailer helper
-        logger.debug(f"Sending welcome email to {email_address}.")
-        send_mail_from_account(
+    return f"{settings.DEFAULT_SITE_SCHEME or 'https'}://{settings.DEFAULT_SITE_DOMAIN or settings.ALLOWED_HOSTS[0]}{reset_path}"
+
+
+# Outbox rows for the welcome emails with the password setup link, rendered as one batch
+def build_welcome_emails(users, account_key):
+    templates = get_email_templates(
+        "email/new_email_user_subject.txt", "email/new_email_user.txt", "email/new_email_user.html"
+    )
+    rendered = templates.render_many(
+        {"user": user, "reset_url": build_password_setup_url(user)} for user in users
+    )
+    return [
+        OutboundEmail(
             account_key=account_key,
+            kind="welcome",
+            to_email=user.email,
             subject=subject,
             text_body=text_body,
             html_body=html_body,
-            to_emails=email_address,
+            user=user,
         )
-        logger.debug(f"Welcome email sent to {email_address}.")
-    return user, reset_url
+        for user, (subject, text_body, html_body) in zip(users, rendered)
+    ]
+
+
+# Case-insensitive lookup of many emails with one query on the LOWER(email) index
+def find_users_by_email(email_addresses, fields=None):
+    wanted = {email.lower() for email in email_addresses if email}
+    if not wanted:
+        return {}
+    qs = (
+        User.objects.annotate(email_lower=Lower("email"))
+        .filter(email_lower__in=wanted)
+        .order_by("-id")
+    )
+    if fields:
+        qs = qs.only(*fields)
+    # lowest id wins when several users share an address
+    return {user.email_lower: user for user in qs}
+
+
+def get_user_cache_ttl():
+    return float(getattr(settings, "EMAIL_USER_CACHE_TTL", 300))
+
+
+def evict_cached_user_email(email_address):
+    if email_address:
+        with _user_id_cache_lock:
+            _user_id_cache.pop(email_address.lower(), None)
+
+
+# Resolve sender emails to user ids, creating unknown senders
+def resolve_user_ids_by_email(email_addresses, account_key, send_welcome=True):
+    wanted = {}
+    for email in email_addresses:
+        if email:
+            wanted.setdefault(email.lower(), email)
+    if not wanted:
+        return {}
+
+    resolved = {}
+    now = time.monotonic()
+    with _user_id_cache_lock:
+        for email_lower in wanted:
+            cached = _user_id_cache.get(email_lower)
+            if cached and cached[1] > now:
+                resolved[email_lower] = cached[0]
+
+    misses = [email for email in wanted if email not in resolved]
+    if misses:
+        found = find_users_by_email(misses, fields=["id"])
+        unknown = [wanted[email] for email in misses if email not in found]
+        if unknown:
+            found.update(provision_email_users(unknown, account_key, send_welcome))
+        for email_lower in misses:
+            resolved[email_lower] = found[email_lower].id
+
+        expires_at = time.monotonic() + get_user_cache_ttl()
+        with _user_id_cache_lock:
+            for email_lower in misses:
+                _user_id_cache[email_lower] = (resolved[email_lower], expires_at)
+
+    logger.debug(
+        f"Resolved {len(wanted)} sender(s), {len(wanted) - len(misses)} from cache"
+    )
+    return resolved
@@ -1,35 +1,20 @@
 import logging
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives, get_connection
 from django.urls import reverse
 from django.utils import timezone
-from django.template.loader import render_to_string
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 from django.contrib.auth.tokens import default_token_generator
+from tickets.utils.emailrender import render_email
+from tickets.utils.outbox import enqueue_email
 
-"""Utility functions for sending emails using different email accounts configured in Django settings."""
+"""Utility functions for queueing emails from the different email accounts configured in Django settings.
 
-logger = logging.getLogger(__name__)
-
-# create SMTP connection based on account key
-def get_smtp_connection(account_key):
-    accounts = getattr(settings, "EMAIL_ACCOUNTS", {})
-    if account_key not in accounts:
-        raise ValueError(
-            f"Email account '{account_key}' is not configured in settings.EMAIL_ACCOUNTS"
-        )
-    config = accounts[account_key]
-    return get_connection(
-        host=settings.EMAIL_HOST,
-        port=settings.EMAIL_PORT,
-        username=config["EMAIL_HOST_USER"],
-        password=config["EMAIL_HOST_PASSWORD"],
-        use_tls=settings.EMAIL_USE_TLS,
-        use_ssl=settings.EMAIL_USE_SSL,
-        fail_silently=False,
-    )
+Nothing is sent inline: the messages go to the outbox in the caller's
+transaction and the outbound email worker sends them.
+"""
 
+logger = logging.getLogger(__name__)
 
 # send password reset email
 def send_password_reset_email(
@@ -52,41 +37,30 @@ def send_password_reset_email(
             "token": token,
             "protocol": request.scheme,
         }
-        subject = render_to_string(subject_template, context).strip()
-        text_body = render_to_string(email_template_txt, context)
-        html_body = render_to_string(email_template_html, context)
+        subject, text_body, html_body = render_email(
+            subject_template, email_template_txt, email_template_html, context
+        )
 
-        connection = get_smtp_connection(account_key)
         config = settings.EMAIL_ACCOUNTS[account_key]
-
         from_email = config["EMAIL_HOST_USER"]
 
         logger.info(
-            f"Sending email via [{account_key}] as {from_email} to {user.email}"
-        )
-
-        msg = EmailMultiAlternatives(
-            subject=subject,
-            body=text_body,
-            from_email=from_email,
-            to=[user.email],
-            reply_to=[from_email],
-            connection=connection,
+            f"Queueing email via [{account_key}] as {from_email} to {user.email}"
         )
-
-        # Attach HTML body
-        if html_body:
-            msg.attach_alternative(html_body, "text/html")
-
-        sent_count = msg.send()
-        logger.info(
-            f"Email sent via [{account_key}] to {user.email}. Count={sent_count}"
+        enqueue_email(
+            account_key,
+            "password_reset",
+            user.email,
+            subject,
+            text_body,
+            html_body,
+            headers={"Reply-To": from_email},
+            user=user,
         )
-
         return True
 
     except Exception as e:
-        logger.exception(f"Failed to send email via account '{account_key}': {e}")
+        logger.exception(f"Failed to queue email via account '{account_key}': {e}")
         return False
 
 
@@ -114,52 +88,15 @@ def send_verification_email(
     if account_key not in settings.EMAIL_ACCOUNTS:
         raise ValueError(f"Email account '{account_key}' is not configured.")
 
-    subject = render_to_string(subject_template, context).strip()
-    text_body = render_to_string(email_template_txt, context)
-    html_body = render_to_string(email_template_html, context)
-    cfg = settings.EMAIL_ACCOUNTS[account_key]
-
-    connection = get_smtp_connection(account_key)
-
-    msg = EmailMultiAlternatives(
-        subject, text_body, cfg["EMAIL_HOST_USER"], [user.email], connection=connection
+    subject, text_body, html_body = render_email(
+        subject_template, email_template_txt, email_template_html, context
     )
-    msg.attach_alternative(html_body, "text/html")
-    msg.send(fail_silently=False)
+    enqueue_email(account_key, "verification", user.email, subject, text_body, html_body, user=user)
 
-    # Update the timestamp of when the verification email was sent
+    # Update the timestamp of when the verification email was requested
     try:
         profile = user.profile
         profile.verification_sent_at = timezone.now()
         profile.save(update_fields=["verification_sent_at"])
     except Exception:
         pass
-
-# account creation and password reset email for the email users 
-def send_mail_from_account(account_key, subject, text_body, html_body, to_emails):
-    logger.debug(f"Preparing to send email to {to_emails}")
-    if account_key not in settings.EMAIL_ACCOUNTS:
-        raise ValueError(f"Email account '{account_key}' is not configured.")
-
-    cfg = settings.EMAIL_ACCOUNTS[account_key]
-
-    connection = get_smtp_connection(account_key)
-
-    try:
-        msg = EmailMultiAlternatives(
-            subject,
-            text_body,
-            cfg["EMAIL_HOST_USER"],
-            [to_emails],
-            connection=connection,
-        )
-        msg.attach_alternative(html_body, "text/html")
-        msg.send(fail_silently=False)
-        logger.info(
-            f"Email sent successfully to {to_emails} for the account creation and password reset."
-        )
-    except Exception as e:
-        logger.error(
-            f"Failed to send email to {to_emails} via account '{account_key}': {e}"
-        )
-        raise
@@ -1,7 +1,7 @@
 import logging
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import get_user_model
-from .forms import SignUpForm, CustomLoginForm, UserUpdateForm, AdminUserUpdateForm 
+from .forms import SignUpForm, CustomLoginForm, UserUpdateForm, AdminUserUpdateForm, EmailUserPasswordResetForm
 from django.views import View
 from django.contrib.auth.views import LoginView
 from django.contrib import messages
@@ -17,6 +17,7 @@ from django.contrib.auth import views as auth_views
 from django.http import BadHeaderError
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.decorators.http import require_POST
+from django.db import transaction
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
@@ -43,11 +44,13 @@ class SignUpView(View):
                 user.is_active = False
                 # ensure email stored
                 user.email = form.cleaned_data["email"]
-                user.save()
 
                 try:
-                    logger.info(f"Sending verification email to {user.email}")
-                    send_verification_email("system", request, user)
+                    # the user and the queued verification email commit together
+                    with transaction.atomic():
+                        user.save()
+                        logger.info(f"Queueing verification email to {user.email}")
+                        send_verification_email("system", request, user)
                 except Exception as e:
                     logger.error(f"Error sending verification email: {e}")
                     messages.error(
@@ -198,6 +201,7 @@ class PasswordChangeView(LoginRequiredMixin, auth_views.PasswordChangeView):
 class PasswordResetView(auth_views.PasswordResetView):
     logger.info("Password reset view accessed.")
     # template_name = "email/password_reset_request.html"
+    form_class = EmailUserPasswordResetForm
     email_template_name = "email/password_reset_email_content.txt"
     html_email_template_name = "email/password_reset_email_content.html"
     subject_template_name = "email/password_reset_subject_content.txt"
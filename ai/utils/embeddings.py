@@ -12,4 +12,8 @@ def load_embedding_model():
 
 def get_embedding(text: str) -> np.ndarray:
     model = load_embedding_model()
-    return model.encode(text, normalize_embeddings=True)
\ No newline at end of file
+    return model.encode(text, normalize_embeddings=True)
+
+def get_embeddings(texts, batch_size: int = 32) -> np.ndarray:
+    model = load_embedding_model()
+    return model.encode(list(texts), batch_size=batch_size, normalize_embeddings=True)
@@ -0,0 +1,178 @@
+import logging
+import threading
+from datetime import timedelta, timezone as dt_timezone
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+"""Rolling in-memory index of recent ticket embeddings for near-duplicate lookups."""
+
+logger = logging.getLogger(__name__)
+
+CLOSED_STATUSES = ["Resolved", "Closed", "Canceled"]
+
+
+def get_similarity_threshold():
+    return float(getattr(settings, "DUPLICATE_SIMILARITY_THRESHOLD", 0.92))
+
+
+def get_window_hours():
+    return int(getattr(settings, "DUPLICATE_WINDOW_HOURS", 6))
+
+
+def to_embedding_bytes(vector):
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def from_embedding_bytes(data):
+    return np.frombuffer(bytes(data), dtype=np.float32)
+
+
+class RecentTicketIndex:
+    """
+    Normalized embeddings of the primary (not linked) tickets created in the
+    last `window_hours`, kept as one float32 matrix so a whole chunk of new
+    tickets is scored with a single matrix product.
+    """
+
+    def __init__(self, window_hours=None):
+        self.window_hours = window_hours or get_window_hours()
+        self.ids = np.empty(0, dtype=np.int64)
+        self.created = np.empty(0, dtype="datetime64[us]")
+        self.matrix = None
+        self.last_id = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    # Append vectors; rows must be L2 normalized
+    def add(self, ids, vectors, created_at):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(ids):
+            return
+        with self.lock:
+            self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+            self.created = np.concatenate(
+                [self.created, np.asarray([_to_datetime64(at) for at in created_at])]
+            )
+            self.matrix = vectors if self.matrix is None else np.vstack([self.matrix, vectors])
+            self.last_id = max(self.last_id, int(max(ids)))
+
+    # Drop entries that left the time window
+    def evict(self, now=None):
+        cutoff = _to_datetime64((now or timezone.now()) - timedelta(hours=self.window_hours))
+        with self.lock:
+            keep = self.created >= cutoff
+            if keep.all():
+                return
+            self.ids = self.ids[keep]
+            self.created = self.created[keep]
+            self.matrix = self.matrix[keep] if keep.any() else None
+
+    # Load primary email tickets created since the last refresh
+    def refresh(self):
+        from tickets.models import Ticket
+
+        self.evict()
+        since = timezone.now() - timedelta(hours=self.window_hours)
+        rows = list(
+            Ticket.objects.filter(
+                id__gt=self.last_id,
+                created_at__gte=since,
+                duplicate_of__isnull=True,
+                embedding__isnull=False,
+            )
+            .order_by("id")
+            .values_list("id", "embedding", "created_at")
+        )
+        if rows:
+            self.add(
+                [row[0] for row in rows],
+                np.vstack([from_embedding_bytes(row[1]) for row in rows]),
+                [row[2] for row in rows],
+            )
+            logger.debug(f"Similarity index loaded {len(rows)} ticket(s), size {len(self)}")
+
+    # Up to k (ticket id, score) pairs per query vector, best first
+    def top_k(self, vectors, k=1):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self.lock:
+            if self.matrix is None or not len(vectors):
+                return [[] for _ in range(len(vectors))]
+            scores = vectors @ self.matrix.T
+            ids = self.ids
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in enumerate(top):
+            ordered = candidates[np.argsort(-scores[row, candidates])]
+            results.append([(int(ids[i]), float(scores[row, i])) for i in ordered])
+        return results
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+# Per-process index, created on first use
+def get_recent_ticket_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = RecentTicketIndex()
+        return _index
+
+
+# Parent per new embedding, or None for a new incident: {"ticket_id", "batch_row", "score"}.
+# A row may also match an earlier primary row of the same batch (batch_row).
+def find_duplicates(vectors, threshold=None, k=3):
+    from tickets.models import Ticket
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not len(vectors):
+        return []
+    threshold = get_similarity_threshold() if threshold is None else threshold
+
+    index = get_recent_ticket_index()
+    index.refresh()
+    candidates = index.top_k(vectors, k=k)
+
+    # parents must still be open and not linked themselves
+    candidate_ids = {ticket_id for row in candidates for ticket_id, score in row if score >= threshold}
+    open_ids = set()
+    if candidate_ids:
+        open_ids = set(
+            Ticket.objects.filter(id__in=candidate_ids, duplicate_of__isnull=True)
+            .exclude(servicenow_ticket_status__in=CLOSED_STATUSES)
+            .values_list("id", flat=True)
+        )
+
+    # similarity between the new tickets themselves, for storms inside one chunk
+    batch_scores = vectors @ vectors.T
+
+    matches = []
+    primaries = []
+    for row, row_candidates in enumerate(candidates):
+        match = next(
+            (
+                {"ticket_id": ticket_id, "batch_row": None, "score": score}
+                for ticket_id, score in row_candidates
+                if score >= threshold and ticket_id in open_ids
+            ),
+            None,
+        )
+        if match is None and primaries:
+            best = max(primaries, key=lambda other: batch_scores[row, other])
+            if batch_scores[row, best] >= threshold:
+                match = {"ticket_id": None, "batch_row": best, "score": float(batch_scores[row, best])}
+        if match is None:
+            primaries.append(row)
+        matches.append(match)
+    return matches
+
+
+def _to_datetime64(value):
+    if timezone.is_aware(value):
+        value = timezone.make_naive(value, dt_timezone.utc)
+    return np.datetime64(value, "us")
@@ -1,6 +1,6 @@
 import joblib
 from pathlib import Path
-from ai.utils.embeddings import get_embedding
+from ai.utils.embeddings import get_embedding, get_embeddings
 from django.conf import settings
 
 AI_MODEL_PATH  = settings.BASE_DIR / "static" / "data"
@@ -45,3 +45,30 @@ def predict_priority_confidence(text: str):
     probs = model.predict_proba([embedding])[0]
     idx = probs.argmax()
     return float(probs[idx])
+
+def predict_ticket_batch(texts, embeddings=None):
+    """
+    Predict category and priority with confidences for many texts,
+    embedding all of them in one batched inference call.
+    """
+    if len(texts) == 0:
+        return []
+    if embeddings is None:
+        embeddings = get_embeddings(texts)
+
+    category_clf = load_category_model()
+    priority_clf = load_priority_model()
+    categories = category_clf.predict(embeddings)
+    category_probs = category_clf.predict_proba(embeddings).max(axis=1)
+    priorities = priority_clf.predict(embeddings)
+    priority_probs = priority_clf.predict_proba(embeddings).max(axis=1)
+
+    return [
+        {
+            "category": str(categories[i]),
+            "category_confidence": float(category_probs[i]),
+            "priority": str(priorities[i]),
+            "priority_confidence": float(priority_probs[i]),
+        }
+        for i in range(len(texts))
+    ]
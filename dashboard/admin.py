@@ -1,3 +1,22 @@
 from django.contrib import admin
+from dashboard.models import TaskLock, TaskRunStat
 
-# Register your models here.
+
+@admin.register(TaskRunStat)
+class TaskRunStatAdmin(admin.ModelAdmin):
+    list_display = (
+        "name",
+        "total_runs",
+        "skipped_runs",
+        "overlapped_runs",
+        "last_started_at",
+        "last_finished_at",
+        "last_duration_ms",
+    )
+    search_fields = ("name",)
+
+
+@admin.register(TaskLock)
+class TaskLockAdmin(admin.ModelAdmin):
+    list_display = ("name", "owner", "expires_at")
+    search_fields = ("name",)
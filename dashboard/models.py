@@ -1,3 +1,34 @@
 from django.db import models
 
-# Create your models here.
+"""Models for background job health shown on the admin dashboard"""
+
+# Database-backed lease used by singleton tasks when Redis is not available
+class TaskLock(models.Model):
+    name = models.CharField(max_length=200, unique=True)
+    owner = models.CharField(max_length=200, blank=True, default="")
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} held by {self.owner or '-'} until {self.expires_at or '-'}"
+
+
+# Run counters of a singleton task (one row per lock key)
+class TaskRunStat(models.Model):
+    name = models.CharField(max_length=200, unique=True)
+    total_runs = models.PositiveIntegerField(default=0)
+    skipped_runs = models.PositiveIntegerField(
+        default=0, help_text="Runs skipped because a previous run still held the lock"
+    )
+    overlapped_runs = models.PositiveIntegerField(
+        default=0, help_text="Runs that outlived their lease, so a later run could overlap"
+    )
+    last_started_at = models.DateTimeField(null=True, blank=True)
+    last_finished_at = models.DateTimeField(null=True, blank=True)
+    last_skipped_at = models.DateTimeField(null=True, blank=True)
+    last_duration_ms = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["name"]
+
+    def __str__(self):
+        return f"{self.name}: {self.total_runs} runs, {self.skipped_runs} skipped, {self.overlapped_runs} overlapped"
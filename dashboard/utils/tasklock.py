@@ -0,0 +1,231 @@
+import functools
+import inspect
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from dashboard.models import TaskLock, TaskRunStat
+
+"""Singleton locking for periodic Celery tasks, backed by Redis or the database."""
+
+logger = logging.getLogger(__name__)
+
+_redis_client = None
+_redis_lock = threading.Lock()
+_local = threading.local()
+
+# compare-and-delete / compare-and-expire so a worker never touches a lock it lost
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+_EXTEND_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+# Shared Redis client on the Celery broker (None when the broker is not Redis)
+def get_redis_client():
+    global _redis_client
+    broker_url = getattr(settings, "CELERY_BROKER_URL", None) or ""
+    if not broker_url.startswith(("redis://", "rediss://", "unix://")):
+        return None
+    if _redis_client is None:
+        with _redis_lock:
+            if _redis_client is None:
+                import redis
+
+                _redis_client = redis.Redis.from_url(
+                    broker_url, socket_timeout=5, socket_connect_timeout=5
+                )
+    return _redis_client
+
+
+class RedisLockBackend:
+    prefix = "tasklock:"
+
+    def __init__(self, client):
+        self.client = client
+
+    def acquire(self, key, owner, lease):
+        return bool(self.client.set(self.prefix + key, owner, nx=True, px=int(lease * 1000)))
+
+    def extend(self, key, owner, lease):
+        return bool(self.client.eval(_EXTEND_SCRIPT, 1, self.prefix + key, owner, int(lease * 1000)))
+
+    def release(self, key, owner):
+        return bool(self.client.eval(_RELEASE_SCRIPT, 1, self.prefix + key, owner))
+
+
+class DatabaseLockBackend:
+    def acquire(self, key, owner, lease):
+        TaskLock.objects.get_or_create(name=key)
+        now = timezone.now()
+        return bool(
+            TaskLock.objects.filter(
+                Q(expires_at__isnull=True) | Q(expires_at__lt=now), name=key
+            ).update(owner=owner, expires_at=now + timedelta(seconds=lease))
+        )
+
+    def extend(self, key, owner, lease):
+        now = timezone.now()
+        return bool(
+            TaskLock.objects.filter(name=key, owner=owner, expires_at__gte=now).update(
+                expires_at=now + timedelta(seconds=lease)
+            )
+        )
+
+    def release(self, key, owner):
+        # True only when the lease was still valid, i.e. nobody could have overlapped
+        held = TaskLock.objects.filter(
+            name=key, owner=owner, expires_at__gte=timezone.now()
+        ).exists()
+        TaskLock.objects.filter(name=key, owner=owner).update(owner="", expires_at=None)
+        return held
+
+
+def get_lock_backend():
+    backend = getattr(settings, "TASK_LOCK_BACKEND", "auto")
+    if backend in ("auto", "redis"):
+        client = get_redis_client()
+        if client is not None:
+            return RedisLockBackend(client)
+        if backend == "redis":
+            logger.warning("TASK_LOCK_BACKEND is redis but the broker is not Redis, using the database.")
+    return DatabaseLockBackend()
+
+
+def get_default_lease():
+    return int(getattr(settings, "TASK_LOCK_DEFAULT_LEASE", 900))
+
+
+# Handle of a held lock, used to extend the lease from long running loops
+class LockHandle:
+    def __init__(self, key, lease, backend):
+        self.key = key
+        self.lease = lease
+        self.backend = backend
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        self.acquired = False
+
+    def acquire(self):
+        try:
+            self.acquired = self.backend.acquire(self.key, self.owner, self.lease)
+        except Exception as e:
+            if isinstance(self.backend, DatabaseLockBackend):
+                raise
+            logger.warning(f"Lock backend failed for {self.key} ({e}), using the database.")
+            self.backend = DatabaseLockBackend()
+            self.acquired = self.backend.acquire(self.key, self.owner, self.lease)
+        return self.acquired
+
+    def extend(self):
+        if self.acquired:
+            return self.backend.extend(self.key, self.owner, self.lease)
+        return False
+
+    def release(self):
+        if not self.acquired:
+            return False
+        self.acquired = False
+        return self.backend.release(self.key, self.owner)
+
+
+# Extend the lease of the innermost lock held by this thread
+def extend_current_lock():
+    stack = getattr(_local, "stack", None)
+    if stack:
+        return stack[-1].extend()
+    return False
+
+
+# Context manager holding a named lock; yields the handle (handle.acquired tells if held)
+@contextmanager
+def task_lock(key, lease=None):
+    handle = LockHandle(key, lease or get_default_lease(), get_lock_backend())
+    if not handle.acquire():
+        _record_skipped(key)
+        logger.info(f"Task lock '{key}' is held by another run, skipping.")
+        yield handle
+        return
+
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(handle)
+    started = time.monotonic()
+    _record_started(key)
+    try:
+        yield handle
+    finally:
+        stack.remove(handle)
+        duration_ms = (time.monotonic() - started) * 1000
+        held = True
+        try:
+            held = handle.release()
+        except Exception as e:
+            logger.error(f"Failed to release task lock '{key}': {e}")
+        if not held:
+            logger.warning(f"Task '{key}' outlived its {handle.lease}s lease, runs may have overlapped.")
+        _record_finished(key, duration_ms, overlapped=not held)
+
+
+# Decorator making a task skip when another run with the same key is in progress.
+# `key` may reference the task arguments, e.g. "monitor_mailbox:{account_key}".
+# `lease` may be a callable, it is then resolved each time the task runs.
+def singleton_task(name=None, key=None, lease=None):
+    def decorator(func):
+        lock_name = name or f"{func.__module__}.{func.__name__}"
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            lock_key = lock_name
+            if key:
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                lock_key = key.format(**bound.arguments)
+            lock_lease = lease() if callable(lease) else lease
+            with task_lock(lock_key, lock_lease) as handle:
+                if not handle.acquired:
+                    return None
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _update_stats(key, **changes):
+    try:
+        TaskRunStat.objects.get_or_create(name=key)
+        TaskRunStat.objects.filter(name=key).update(**changes)
+    except Exception as e:
+        logger.error(f"Failed to record task stats for '{key}': {e}")
+
+
+def _record_skipped(key):
+    _update_stats(key, skipped_runs=F("skipped_runs") + 1, last_skipped_at=timezone.now())
+
+
+def _record_started(key):
+    _update_stats(key, total_runs=F("total_runs") + 1, last_started_at=timezone.now())
+
+
+def _record_finished(key, duration_ms, overlapped=False):
+    changes = {"last_finished_at": timezone.now(), "last_duration_ms": round(duration_ms, 2)}
+    if overlapped:
+        changes["overlapped_runs"] = F("overlapped_runs") + 1
+    _update_stats(key, **changes)
@@ -3,6 +3,8 @@ import json
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from tickets.models import Ticket
+from dashboard.models import TaskRunStat
+from servicenow.utils.throttle import breaker_status
 from django.utils import timezone
 from django.core.paginator import Paginator
 from datetime import timedelta
@@ -134,6 +136,8 @@ def admin_dashboard(request):
 
         snow_last_sync = last_sync_obj.last_sync_attempt if last_sync_obj else None
 
+        # Background job health (singleton task runs)
+        task_stats = TaskRunStat.objects.all()
 
 
         # Context
@@ -148,6 +152,8 @@ def admin_dashboard(request):
             "email_tickets":email_tickets,
             "snow_success_rate":snow_success_rate,
             "snow_last_sync":snow_last_sync,
+            "task_stats": task_stats,
+            "snow_breaker": breaker_status(),
             "last_updated": timezone.now(),
             "category_model_accuracy":category_model_accuracy,
             "priority_model_accuracy":priority_model_accuracy,
@@ -1,8 +1,22 @@
 from django.contrib import admin
-from servicenow.models import AssignmentGroup
+from servicenow.models import AssignmentGroup, ServiceNowSyncState, ServiceNowWebhookEvent
 # from tickets.models import Ticket
 
 @admin.register(AssignmentGroup)
 class AssignmentGroupAdmin(admin.ModelAdmin):
     list_display = ('name', 'category', 'servicenow_group_id')
     search_fields = ('name', 'category')
+
+
+@admin.register(ServiceNowSyncState)
+class ServiceNowSyncStateAdmin(admin.ModelAdmin):
+    list_display = ('instance', 'last_updated_on', 'last_run_at', 'last_fetched', 'last_changed', 'last_unchanged')
+    readonly_fields = ('last_run_at', 'last_fetched', 'last_changed', 'last_unchanged')
+
+
+@admin.register(ServiceNowWebhookEvent)
+class ServiceNowWebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('number', 'sys_id', 'state', 'sys_updated_on', 'applied', 'received_at')
+    list_filter = ('applied',)
+    search_fields = ('number', 'sys_id')
+
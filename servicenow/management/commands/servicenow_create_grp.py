@@ -1,6 +1,5 @@
 from django.core.management.base import BaseCommand
-import requests
-from django.conf import settings
+from servicenow.utils.client import get_servicenow_client
 
 class Command(BaseCommand):
     help = 'Create Service-now group'
@@ -9,12 +8,8 @@ class Command(BaseCommand):
 
         self.stdout.write("Loading config...")
 
-        servicenow_instance = settings.SERVICENOW_INSTANCE
-        servicenow_username = settings.SERVICENOW_USERNAME
-        servicenow_password = settings.SERVICENOW_PASSWORD
-
-        url = f"https://{servicenow_instance}.service-now.com/api/now/table/sys_user_group"
-        AUTH = (servicenow_username, servicenow_password)
+        client = get_servicenow_client()
+        url = client.table_url("sys_user_group")
 
         self.stdout.write("Assigning the group names...")
         groups = [
@@ -41,11 +36,7 @@ class Command(BaseCommand):
                 "description": f"{group} assignment group"
             }
 
-            response = requests.post(
-                url,
-                auth=AUTH,
-                json=payload
-            )
+            response = client.post(url, json=payload)
 
             if response.status_code == 201:
                 self.stdout.write(f"Created group: {group}")
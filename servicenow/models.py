@@ -32,4 +32,45 @@ class AssignmentGroup(models.Model):
     is_active = models.BooleanField(default=True)
 
     def __str__(self):
-        return f"{self.name}" 
\ No newline at end of file
+        return f"{self.name}"
+
+
+class ServiceNowSyncState(models.Model):
+    """
+    Watermark of the incremental status sync, one row per ServiceNow instance.
+    """
+    instance = models.CharField(max_length=100, unique=True)
+    last_updated_on = models.DateTimeField(
+        null=True, blank=True, help_text="Newest incident sys_updated_on applied, empty forces a full sync"
+    )
+    last_run_at = models.DateTimeField(null=True, blank=True)
+    last_fetched = models.PositiveIntegerField(default=0, help_text="Incidents read by the last run")
+    last_changed = models.PositiveIntegerField(default=0, help_text="Tickets whose status the last run changed")
+    last_unchanged = models.PositiveIntegerField(default=0, help_text="Tickets the last run left as they were")
+
+    def __str__(self):
+        return f"{self.instance} @ {self.last_updated_on}"
+
+
+class ServiceNowWebhookEvent(models.Model):
+    """
+    Incident update received on the webhook, unique per incident and update time
+    so redelivered notifications are applied once.
+    """
+    sys_id = models.CharField(max_length=100)
+    sys_updated_on = models.DateTimeField()
+    state = models.CharField(max_length=20, blank=True, default="")
+    number = models.CharField(max_length=100, blank=True, default="")
+    applied = models.BooleanField(default=False, help_text="False when a newer update had already arrived")
+    received_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ["-received_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["sys_id", "sys_updated_on"], name="unique_servicenow_event"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.number or self.sys_id} @ {self.sys_updated_on}"
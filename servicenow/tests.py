@@ -1,3 +1,250 @@
-from django.test import TestCase
+import base64
+import hashlib
+import hmac
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from servicenow.models import ServiceNowWebhookEvent
+from servicenow.utils.claims import claim_tickets, get_retry_delay, release_claims
+from servicenow.utils import throttle
+from servicenow.utils.statussync import apply_servicenow_states
+from servicenow.utils.throttle import CLOSED, HALF_OPEN, OPEN, ServiceNowUnavailable
+from servicenow.utils.webhook import handle_incident_events, verify_signature
+from tickets.models import Ticket
 
-# Create your tests here.
+SECRET = "webhook-secret"
+BODY = b'{"sys_id": "abc", "state": "6", "sys_updated_on": "2026-01-05 10:00:00"}'
+
+
+@override_settings(SERVICENOW_WEBHOOK_SECRET=SECRET)
+class VerifySignatureTests(SimpleTestCase):
+    def digest(self, body=BODY):
+        return hmac.new(SECRET.encode("utf-8"), body, hashlib.sha256).digest()
+
+    def test_hex(self):
+        self.assertTrue(verify_signature(BODY, self.digest().hex()))
+        self.assertTrue(verify_signature(BODY, self.digest().hex().upper()))
+
+    def test_base64(self):
+        self.assertTrue(verify_signature(BODY, base64.b64encode(self.digest()).decode("ascii")))
+
+    def test_sha256_prefix(self):
+        self.assertTrue(verify_signature(BODY, f"sha256={self.digest().hex()}"))
+        self.assertTrue(verify_signature(BODY, f"sha256={base64.b64encode(self.digest()).decode('ascii')}"))
+
+    def test_rejects_other_body_or_missing_signature(self):
+        self.assertFalse(verify_signature(BODY + b" ", self.digest().hex()))
+        self.assertFalse(verify_signature(BODY, ""))
+        self.assertFalse(verify_signature(BODY, None))
+
+    @override_settings(SERVICENOW_WEBHOOK_SECRET="")
+    def test_rejects_everything_without_a_secret(self):
+        self.assertFalse(verify_signature(BODY, self.digest().hex()))
+
+
+class HandleIncidentEventsTests(TestCase):
+    def setUp(self):
+        self.ticket = Ticket.objects.create(
+            title="VPN down", description="d", category="network", priority="high",
+            servicenow_sys_id="abc", servicenow_ticket_number="INC0001",
+            servicenow_ticket_status="New",
+        )
+
+    def event(self, state, updated_on, sys_id="abc"):
+        return {"sys_id": sys_id, "number": "INC0001", "state": state, "sys_updated_on": updated_on}
+
+    def status(self):
+        self.ticket.refresh_from_db()
+        return self.ticket.servicenow_ticket_status
+
+    def test_applies_an_update(self):
+        counts = handle_incident_events([self.event("2", "2026-01-05 10:00:00")])
+        self.assertEqual(counts["applied"], 1)
+        self.assertEqual(self.status(), "In-Progress")
+
+    def test_redelivered_event_is_a_duplicate(self):
+        handle_incident_events([self.event("2", "2026-01-05 10:00:00")])
+        counts = handle_incident_events([self.event("2", "2026-01-05 10:00:00")])
+        self.assertEqual(counts["duplicate"], 1)
+        self.assertEqual(counts["applied"], 0)
+        self.assertEqual(ServiceNowWebhookEvent.objects.count(), 1)
+
+    def test_older_update_is_stale_and_not_applied(self):
+        handle_incident_events([self.event("6", "2026-01-05 11:00:00")])
+        counts = handle_incident_events([self.event("2", "2026-01-05 10:00:00")])
+        self.assertEqual(counts["stale"], 1)
+        self.assertEqual(self.status(), "Resolved")
+        self.assertFalse(ServiceNowWebhookEvent.objects.get(state="2").applied)
+
+    def test_out_of_order_within_one_delivery(self):
+        counts = handle_incident_events([
+            self.event("7", "2026-01-05 12:00:00"),
+            self.event("6", "2026-01-05 11:00:00"),
+        ])
+        self.assertEqual((counts["applied"], counts["stale"]), (1, 1))
+        self.assertEqual(self.status(), "Closed")
+
+    def test_older_webhook_after_a_newer_poll_is_stale(self):
+        apply_servicenow_states([self.ticket], {"abc": {"state": "7", "sys_updated_on": "2026-01-05 12:00:00"}})
+        self.assertEqual(self.status(), "Closed")
+        counts = handle_incident_events([self.event("2", "2026-01-05 10:00:00")])
+        self.assertEqual(counts["stale"], 1)
+        self.assertEqual(self.status(), "Closed")
+        self.assertFalse(ServiceNowWebhookEvent.objects.get().applied)
+
+    def test_older_poll_after_a_newer_webhook_is_stale(self):
+        handle_incident_events([self.event("6", "2026-01-05 11:00:00")])
+        counts = apply_servicenow_states([self.ticket], {"abc": {"state": "2", "sys_updated_on": "2026-01-05 10:00:00"}})
+        self.assertEqual(counts["stale"], 1)
+        self.assertEqual(self.status(), "Resolved")
+
+    def test_stale_even_after_the_events_were_pruned(self):
+        handle_incident_events([self.event("6", "2026-01-05 11:00:00")])
+        ServiceNowWebhookEvent.objects.all().delete()
+        counts = handle_incident_events([self.event("2", "2026-01-05 10:00:00")])
+        self.assertEqual(counts["stale"], 1)
+        self.assertEqual(self.status(), "Resolved")
+
+    def test_invalid_records_are_counted(self):
+        counts = handle_incident_events([{"state": "2"}, self.event("2", "yesterday")])
+        self.assertEqual(counts["invalid"], 2)
+        self.assertEqual(self.status(), "New")
+
+
+@override_settings(
+    SERVICENOW_CREATE_MAX_ATTEMPTS=3,
+    SERVICENOW_RETRY_BASE_SECONDS=60,
+    SERVICENOW_RETRY_MAX_SECONDS=300,
+)
+class ClaimTicketsTests(TestCase):
+    def create_ticket(self, **fields):
+        fields.setdefault("ticket_creation_status", "pending")
+        return Ticket.objects.create(
+            title="VPN down", description="d", category="network", priority="high", **fields
+        )
+
+    def test_claimed_ticket_is_not_claimed_twice(self):
+        ticket = self.create_ticket()
+        token, claimed = claim_tickets([ticket.id])
+        self.assertEqual(claimed, [ticket.id])
+        self.assertEqual(claim_tickets([ticket.id])[1], [])
+        self.assertEqual(claim_tickets()[1], [])
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.sync_claimed_by, token)
+
+    def test_expired_lease_can_be_claimed(self):
+        ticket = self.create_ticket()
+        first, _ = claim_tickets([ticket.id])
+        Ticket.objects.filter(id=ticket.id).update(sync_claimed_until=timezone.now() - timedelta(seconds=1))
+        second, claimed = claim_tickets([ticket.id])
+        self.assertEqual(claimed, [ticket.id])
+        self.assertNotEqual(first, second)
+        # the expired holder can no longer release it
+        self.assertEqual(release_claims([ticket.id], first), 0)
+
+    def test_release_makes_the_ticket_claimable(self):
+        ticket = self.create_ticket()
+        token, _ = claim_tickets([ticket.id])
+        later = timezone.now() + timedelta(minutes=5)
+        self.assertEqual(release_claims([ticket.id], token, next_attempt_at=later), 1)
+        ticket.refresh_from_db()
+        self.assertEqual((ticket.sync_claimed_by, ticket.sync_claimed_until), ("", None))
+        self.assertEqual(ticket.next_sync_attempt_at, later)
+        # explicit ids ignore the backoff, the retry job does not
+        self.assertEqual(claim_tickets()[1], [])
+        self.assertEqual(claim_tickets([ticket.id])[1], [ticket.id])
+
+    def test_created_tickets_are_not_claimed(self):
+        ticket = self.create_ticket(ticket_creation_status="created")
+        self.assertEqual(claim_tickets([ticket.id])[1], [])
+
+    def test_retry_claims_only_due_tickets_below_the_cap(self):
+        now = timezone.now()
+        due = self.create_ticket(ticket_creation_status="failed", sync_attempts=1, next_sync_attempt_at=now)
+        new = self.create_ticket()
+        self.create_ticket(ticket_creation_status="failed", sync_attempts=1,
+                           next_sync_attempt_at=now + timedelta(minutes=1))
+        self.create_ticket(ticket_creation_status="failed", sync_attempts=3, next_sync_attempt_at=now)
+        self.assertEqual(sorted(claim_tickets()[1]), sorted([due.id, new.id]))
+
+    def test_retry_limit(self):
+        tickets = [self.create_ticket() for _ in range(3)]
+        self.assertEqual(len(claim_tickets(limit=2)[1]), 2)
+        self.assertEqual(claim_tickets(limit=2)[1], [tickets[-1].id])
+
+    def test_retry_delay_doubles_up_to_the_cap(self):
+        delays = [get_retry_delay(attempts).total_seconds() for attempts in range(1, 6)]
+        self.assertEqual(delays, [60, 120, 240, 300, 300])
+
+
+def http_response(status):
+    return SimpleNamespace(status_code=status, headers={})
+
+
+@override_settings(
+    SERVICENOW_BREAKER_MIN_REQUESTS=4,
+    SERVICENOW_BREAKER_ERROR_RATE=0.5,
+    SERVICENOW_RATE_BURST=100,
+    SERVICENOW_RATE_MAX_WAIT=0,
+)
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.backend = throttle.LocalGuardBackend()
+        patcher = mock.patch.object(throttle, "get_guard_backend", return_value=self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def state(self):
+        return throttle.breaker_state(self.backend)
+
+    def trip(self):
+        for status in (200, 500, 500, 500):
+            self.assertFalse(throttle.before_request())
+            throttle.after_response(response=http_response(status))
+        self.assertEqual(self.state(), OPEN)
+
+    # skip the cool-down
+    def cool_down(self):
+        self.backend.open_until = 0.0
+        self.assertEqual(self.state(), HALF_OPEN)
+
+    def test_opens_on_the_error_rate_and_fails_fast(self):
+        self.trip()
+        with self.assertRaises(ServiceNowUnavailable):
+            throttle.before_request()
+
+    def test_successful_probe_closes_the_circuit(self):
+        self.trip()
+        self.cool_down()
+        self.assertTrue(throttle.before_request())
+        throttle.after_response(response=http_response(200), probe=True)
+        self.assertEqual(self.state(), CLOSED)
+        self.assertEqual(self.backend.counts(throttle.get_breaker_window()), (0, 0))
+
+    def test_failed_probe_re_opens_the_circuit(self):
+        self.trip()
+        self.cool_down()
+        self.assertTrue(throttle.before_request())
+        throttle.after_response(error=ConnectionError("reset"), probe=True)
+        self.assertEqual(self.state(), OPEN)
+
+    def test_only_the_probe_decides(self):
+        self.trip()
+        self.cool_down()
+        self.assertTrue(throttle.before_request())
+        with self.assertRaises(ServiceNowUnavailable):
+            throttle.before_request()
+        # a request that was in flight before the circuit opened
+        throttle.after_response(response=http_response(200))
+        self.assertEqual(self.state(), HALF_OPEN)
+
+    def test_probe_is_released_when_the_rate_limit_gives_up(self):
+        self.trip()
+        self.cool_down()
+        self.backend.pause(60)
+        with self.assertRaises(ServiceNowUnavailable):
+            throttle.before_request()
+        self.backend.pause_until = 0.0
+        self.assertTrue(throttle.before_request())
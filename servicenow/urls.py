@@ -10,4 +10,5 @@ urlpatterns = [
     path("admin/assignment-groups/add/", views.assignment_group_create, name="assignment_group_create"),
     path("admin/assignment-groups/<int:pk>/edit/", views.assignment_group_update, name="assignment_group_update"),
     path("admin/assignment-groups/<int:pk>/delete/", views.assignment_group_delete, name="assignment_group_delete"),
+    path("webhook/incident/", views.servicenow_webhook, name="servicenow_webhook"),
 ]
\ No newline at end of file
@@ -0,0 +1,81 @@
+import logging
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from tickets.models import Ticket
+
+"""Lease based claiming of tickets for ServiceNow incident creation.
+
+A worker claims tickets by writing its token and a lease expiry; only the
+holder of a live claim creates their incidents, so the retry job and the
+dispatch path never work on the same ticket at once. A crashed worker's
+claims simply expire.
+"""
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = ("pending", "failed")
+
+
+def get_claim_lease():
+    return max(60, int(getattr(settings, "SERVICENOW_CLAIM_LEASE_SECONDS", 900)))
+
+
+def get_max_attempts():
+    return max(1, int(getattr(settings, "SERVICENOW_CREATE_MAX_ATTEMPTS", 8)))
+
+
+# 1, 2, 4 ... minutes after each failed attempt, capped at SERVICENOW_RETRY_MAX_SECONDS
+def get_retry_delay(attempts):
+    base = int(getattr(settings, "SERVICENOW_RETRY_BASE_SECONDS", 60))
+    cap = int(getattr(settings, "SERVICENOW_RETRY_MAX_SECONDS", 6 * 3600))
+    return timedelta(seconds=min(base * 2 ** max(0, attempts - 1), cap))
+
+
+def _unclaimed(now):
+    return Q(sync_claimed_until__isnull=True) | Q(sync_claimed_until__lt=now)
+
+
+def claim_tickets(ticket_ids=None, limit=None):
+    """
+    Claim retryable tickets for one worker, either the given ids or the due
+    ones (next_sync_attempt_at passed, attempts below the cap), oldest first.
+    Returns (claim token, claimed ids).
+    """
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    candidates = Ticket.objects.filter(_unclaimed(now), ticket_creation_status__in=RETRYABLE_STATUSES)
+    if ticket_ids is not None:
+        candidates = candidates.filter(id__in=list(ticket_ids))
+    else:
+        candidates = candidates.filter(
+            Q(next_sync_attempt_at__isnull=True) | Q(next_sync_attempt_at__lte=now),
+            sync_attempts__lt=get_max_attempts(),
+        ).order_by("next_sync_attempt_at", "id")
+
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            # rows another worker is claiming right now are skipped, not waited for
+            candidates = candidates.select_for_update(skip_locked=True)
+        ids = candidates.values_list("id", flat=True)
+        ids = list(ids[:limit] if limit else ids)
+        if not ids:
+            return token, []
+        # the conditional update is the claim itself, also on backends without row locks
+        Ticket.objects.filter(_unclaimed(now), id__in=ids).update(
+            sync_claimed_by=token, sync_claimed_until=now + timedelta(seconds=get_claim_lease())
+        )
+    claimed = list(Ticket.objects.filter(sync_claimed_by=token).values_list("id", flat=True))
+    logger.debug(f"Claimed tickets {claimed} ({token})")
+    return token, claimed
+
+
+# Give claimed tickets back, optionally not to be retried before next_attempt_at
+def release_claims(ticket_ids, token, next_attempt_at=None):
+    changes = {"sync_claimed_by": "", "sync_claimed_until": None}
+    if next_attempt_at is not None:
+        changes["next_sync_attempt_at"] = next_attempt_at
+    return Ticket.objects.filter(id__in=list(ticket_ids), sync_claimed_by=token).update(**changes)
@@ -0,0 +1,154 @@
+import base64
+import json
+import logging
+import os
+import threading
+import uuid
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from servicenow.utils.throttle import after_response, before_request
+
+"""Pooled HTTP client for the ServiceNow REST API.
+
+One requests.Session per process keeps TLS connections to the instance alive
+and owns authentication, retries, timeouts, rate limiting and circuit breaking
+for every ServiceNow call.
+"""
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+class ServiceNowClient:
+    def __init__(
+        self,
+        instance=None,
+        username=None,
+        password=None,
+        pool_size=None,
+        max_retries=None,
+        backoff_factor=None,
+        connect_timeout=None,
+        read_timeout=None,
+    ):
+        self.instance = instance or settings.SERVICENOW_INSTANCE
+        self.base_url = f"https://{self.instance}.service-now.com"
+        pool_size = pool_size or getattr(settings, "SERVICENOW_POOL_SIZE", 10)
+        max_retries = getattr(settings, "SERVICENOW_MAX_RETRIES", 3) if max_retries is None else max_retries
+        backoff_factor = (
+            getattr(settings, "SERVICENOW_BACKOFF_FACTOR", 0.5) if backoff_factor is None else backoff_factor
+        )
+        self.timeout = (
+            connect_timeout or getattr(settings, "SERVICENOW_CONNECT_TIMEOUT", 5),
+            read_timeout or getattr(settings, "SERVICENOW_READ_TIMEOUT", 30),
+        )
+
+        # POST and PATCH are not retried on a response: the instance may already have applied them
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 502, 503, 504),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.auth = (
+            username or settings.SERVICENOW_USERNAME,
+            password or settings.SERVICENOW_PASSWORD,
+        )
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+        })
+
+    # /api/now/table/<table>[/<sys_id>]
+    def table_url(self, table, sys_id=None):
+        url = f"{self.base_url}/api/now/table/{table}"
+        return f"{url}/{sys_id}" if sys_id else url
+
+    # shared rate limit and circuit breaker around every call, see throttle.py
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        if not url.startswith("http"):
+            url = f"{self.base_url}{url}"
+        probe = before_request()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            after_response(error=e, probe=probe)
+            raise
+        after_response(response, probe=probe)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def batch(self, sub_requests):
+        """
+        Send REST sub-requests in one call to the Batch API (/api/now/v1/batch).
+        `sub_requests` are {"id", "method", "url", "body"} dicts with a JSON
+        serialisable body; returns {id: (status code, decoded body)} for the
+        serviced ones, unserviced ids are missing from the result.
+        """
+        rest_requests = [
+            {
+                "id": str(item["id"]),
+                "method": item["method"],
+                "url": item["url"],
+                "headers": [
+                    {"name": "Content-Type", "value": "application/json"},
+                    {"name": "Accept", "value": "application/json"},
+                ],
+                "body": base64.b64encode(json.dumps(item.get("body") or {}).encode("utf-8")).decode("ascii"),
+            }
+            for item in sub_requests
+        ]
+        response = self.post(
+            "/api/now/v1/batch",
+            json={"batch_request_id": uuid.uuid4().hex, "rest_requests": rest_requests},
+        )
+        response.raise_for_status()
+        data = response.json()
+
+        results = {}
+        for serviced in data.get("serviced_requests", []):
+            body = serviced.get("body") or ""
+            try:
+                decoded = json.loads(base64.b64decode(body)) if body else {}
+            except ValueError:
+                decoded = {}
+            results[serviced["id"]] = (int(serviced.get("status_code") or 0), decoded)
+        if data.get("unserviced_requests"):
+            logger.warning(f"ServiceNow batch left {len(data['unserviced_requests'])} sub-request(s) unserviced")
+        return results
+
+    def close(self):
+        self.session.close()
+
+
+# Per-process client; a forked worker builds its own instead of sharing the parent's sockets
+def get_servicenow_client():
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = ServiceNowClient()
+                _client_pid = pid
+                logger.debug(f"ServiceNow client created for process {pid}")
+    return _client
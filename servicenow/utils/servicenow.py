@@ -1,19 +1,30 @@
 import logging
+import uuid
 import requests
+from datetime import datetime, timedelta, timezone as dt_timezone
 from django.conf import settings 
 from django.utils import timezone
+from servicenow.utils.claims import get_claim_lease
+from servicenow.utils.client import get_servicenow_client
 
 logger = logging.getLogger(__name__)
 
-servicenow_instance = settings.SERVICENOW_INSTANCE
-servicenow_username = settings.SERVICENOW_USERNAME
-servicenow_password = settings.SERVICENOW_PASSWORD
 servicenow_sys_id = settings.SERVICENOW_SYSID
 
+SERVICENOW_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
 
-def create_servicenow_ticket(ticket):
+# incident field carrying our ticket's correlation id
+CORRELATION_FIELD = "correlation_id"
+
+
+# Same id for a ticket on every attempt, different per ServiceNow instance
+def incident_correlation_id(ticket_id, instance=None):
+    instance = instance or settings.SERVICENOW_INSTANCE
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"https://{instance}.service-now.com/ticket/{ticket_id}"))
 
-    url = f"https://{servicenow_instance}.service-now.com/api/now/table/incident"
+
+# incident fields for a local ticket
+def build_incident_payload(ticket):
     assignment_group_sys_id =None
     
     if ticket.assigned_team:
@@ -32,10 +43,10 @@ def create_servicenow_ticket(ticket):
         impact = 2
         urgency =3
 
-    print(f"impact: {impact}, urgency: {urgency}")
+    logger.debug(f"Ticket {ticket.id} impact: {impact}, urgency: {urgency}")
 
 
-    payload = {
+    return {
         "short_description": ticket.title,
         "description": ticket.description,
         "category": ticket.category,
@@ -44,58 +55,28 @@ def create_servicenow_ticket(ticket):
         "urgency": urgency,
         "assignment_group": assignment_group_sys_id,
         "contact_type":"virtual_agent",
+        CORRELATION_FIELD: incident_correlation_id(ticket.id),
     }
 
 
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
-
-
+# POST one incident and return its record; no database access, safe to call from threads
+def post_incident(payload, ticket_id):
+    client = get_servicenow_client()
     try:
-        logger.info(f"Attempting ServiceNow sync for ticket {ticket.id}")
+        logger.info(f"Attempting ServiceNow sync for ticket {ticket_id}")
 
 
-        response = requests.post(
-            url,
-            json=payload,
-            auth=(servicenow_username, servicenow_password),
-            timeout=30,
-            headers=headers,
-        )
+        response = client.post(client.table_url("incident"), json=payload)
 
         # FORCE HTTP errors to raise exception
         response.raise_for_status()
 
-        data = response.json()
-
-        ticket.servicenow_ticket_number = data.get("result", {}).get("number")
-        ticket.servicenow_sys_id = data.get("result", {}).get("sys_id")
-        ticket.ticket_creation_status = "created"
-        ticket.error_message = None
-        ticket.last_sync_attempt = timezone.now()
-        ticket.save(update_fields=[
-            "servicenow_ticket_number",
-            "servicenow_sys_id",
-            "ticket_creation_status",
-            "error_message",
-            "last_sync_attempt"
-        ])
-
-
-        logger.info(
-            f"ServiceNow ticket created successfully "
-            f"(Ticket ID={ticket.id}, SN={ticket.servicenow_ticket_number})"
-        )
-
-
-        return True
+        return response.json().get("result", {})
 
 
     except requests.exceptions.HTTPError:
         logger.error(
-            f"ServiceNow HTTP error for ticket {ticket.id} | "
+            f"ServiceNow HTTP error for ticket {ticket_id} | "
             f"Status={response.status_code} | Response={response.text}"
         )
         raise
@@ -103,7 +84,7 @@ def create_servicenow_ticket(ticket):
 
     except requests.exceptions.RequestException:
         logger.error(
-            f"Network error while calling ServiceNow for ticket {ticket.id}"
+            f"Network error while calling ServiceNow for ticket {ticket_id}"
         )
         raise
 
@@ -111,33 +92,227 @@ def create_servicenow_ticket(ticket):
     except Exception:
         logger.error(
             f"Unexpected error while creating ServiceNow ticket "
-            f"(ticket_id={ticket.id})"
+            f"(ticket_id={ticket_id})"
         )
         raise
 
 
-def fetch_servicenow_ticket_status(sys_id: str) -> str | None:
+# store the created incident on the ticket and its linked duplicates
+def apply_incident_result(ticket, result):
+    ticket.servicenow_ticket_number = result.get("number")
+    ticket.servicenow_sys_id = result.get("sys_id")
+    ticket.ticket_creation_status = "created"
+    ticket.error_message = None
+    ticket.last_sync_attempt = timezone.now()
+    ticket.sync_claimed_by = ""
+    ticket.sync_claimed_until = None
+    ticket.next_sync_attempt_at = None
+    ticket.save(update_fields=[
+        "servicenow_ticket_number",
+        "servicenow_sys_id",
+        "ticket_creation_status",
+        "error_message",
+        "last_sync_attempt",
+        "sync_claimed_by",
+        "sync_claimed_until",
+        "next_sync_attempt_at",
+    ])
+    # linked near-duplicates share the incident number
+    ticket.duplicates.update(
+        servicenow_ticket_number=ticket.servicenow_ticket_number,
+        servicenow_ticket_status=ticket.servicenow_ticket_status,
+    )
+
+
+    logger.info(
+        f"ServiceNow ticket created successfully "
+        f"(Ticket ID={ticket.id}, SN={ticket.servicenow_ticket_number})"
+    )
+
+
+def use_batch_api():
+    return bool(getattr(settings, "SERVICENOW_BATCH_API", False))
+
+
+def get_batch_size():
+    return max(1, int(getattr(settings, "SERVICENOW_BATCH_SIZE", 25)))
+
+
+def post_incidents_batch(payloads):
     """
-    Fetch latest ServiceNow incident state using sys_id
+    Create many incidents through the Batch API, SERVICENOW_BATCH_SIZE per
+    HTTP request. `payloads` maps ticket id -> incident payload; returns
+    ticket id -> the created incident record, or the error for sub-requests
+    that failed, were not serviced or whose batch call failed.
     """
-    url = f"https://{servicenow_instance}.service-now.com/api/now/table/incident/{sys_id}"
+    client = get_servicenow_client()
+    # sub-request urls are relative to the instance
+    url = "/api/now/table/incident"
+    ticket_ids = list(payloads)
+    outcomes = {}
+    for start in range(0, len(ticket_ids), get_batch_size()):
+        chunk = ticket_ids[start:start + get_batch_size()]
+        try:
+            serviced = client.batch(
+                {"id": ticket_id, "method": "POST", "url": url, "body": payloads[ticket_id]}
+                for ticket_id in chunk
+            )
+        except Exception as e:
+            logger.error(f"ServiceNow batch create failed for tickets {chunk}: {e}")
+            for ticket_id in chunk:
+                outcomes[ticket_id] = e
+            continue
+
+        for ticket_id in chunk:
+            status_code, body = serviced.get(str(ticket_id), (None, {}))
+            result = body.get("result") if isinstance(body, dict) else None
+            if status_code is not None and 200 <= status_code < 300 and result:
+                outcomes[ticket_id] = result
+            else:
+                outcomes[ticket_id] = RuntimeError(
+                    f"batch sub-request {'not serviced' if status_code is None else f'returned {status_code}'}"
+                )
+    return outcomes
+
+
+# A failed attempt or a lost worker may have created the incident without us recording it
+def may_have_incident(ticket):
+    if ticket.sync_attempts > 0:
+        return True
+    return ticket.created_at is not None and ticket.created_at < timezone.now() - timedelta(seconds=get_claim_lease())
 
-    headers = {
-        "Accept": "application/json"
-    }
 
-    try:
-        response = requests.get(
+def find_incidents_by_correlation(correlation_ids) -> dict:
+    """
+    Look up incidents already created for the given correlation ids, one
+    correlation_idIN query per chunk. Returns correlation id -> {sys_id, number}.
+    """
+    client = get_servicenow_client()
+    correlation_ids = list(dict.fromkeys(correlation_ids))
+    chunk_size = get_sync_chunk_size()
+    found = {}
+    for start in range(0, len(correlation_ids), chunk_size):
+        chunk = correlation_ids[start:start + chunk_size]
+        query = f"{CORRELATION_FIELD}IN{','.join(chunk)}^ORDERBYsys_created_on"
+        for record in _fetch_incidents(client, query, fields=f"sys_id,number,{CORRELATION_FIELD}"):
+            # the oldest one wins should an earlier retry have left duplicates
+            found.setdefault(record.get(CORRELATION_FIELD), record)
+    return found
+
+
+def create_servicenow_ticket(ticket):
+    payload = build_incident_payload(ticket)
+    result = None
+    if may_have_incident(ticket):
+        result = find_incidents_by_correlation([payload[CORRELATION_FIELD]]).get(payload[CORRELATION_FIELD])
+        if result:
+            logger.info(f"ServiceNow incident {result.get('number')} already exists for ticket {ticket.id}")
+    if not result:
+        result = post_incident(payload, ticket.id)
+    apply_incident_result(ticket, result)
+    return True
+
+
+def get_sync_chunk_size():
+    return max(1, int(getattr(settings, "SERVICENOW_SYNC_CHUNK_SIZE", 200)))
+
+
+def get_page_size():
+    return max(1, int(getattr(settings, "SERVICENOW_PAGE_SIZE", 1000)))
+
+
+# Records of an encoded incident query, page by page
+def _fetch_incidents(client, query, fields="sys_id,state,sys_updated_on"):
+    url = client.table_url("incident")
+    page_size = get_page_size()
+    offset = 0
+    while True:
+        response = client.get(
             url,
-            auth=(servicenow_username, servicenow_password),
-            timeout=30,
-            headers=headers,
+            params={
+                "sysparm_query": query,
+                "sysparm_fields": fields,
+                "sysparm_exclude_reference_link": "true",
+                "sysparm_limit": page_size,
+                "sysparm_offset": offset,
+            },
         )
         response.raise_for_status()
+        records = response.json().get("result", [])
+        yield from records
+        if len(records) < page_size:
+            break
+        offset += page_size
 
-        data = response.json()
-        return data["result"].get("state")
 
-    except Exception:
-        logger.exception(f"Failed to fetch ServiceNow status for sys_id={sys_id}")
-        return None
\ No newline at end of file
+def _state_record(record):
+    return {
+        "state": record.get("state"),
+        "sys_updated_on": record.get("sys_updated_on"),
+    }
+
+
+def fetch_servicenow_ticket_states(sys_ids, chunk_size=None) -> dict:
+    """
+    Fetch state and sys_updated_on of many incidents, keyed by sys_id.
+    One sys_idIN query per chunk of ids, paginated, only the needed fields.
+    """
+    client = get_servicenow_client()
+    chunk_size = chunk_size or get_sync_chunk_size()
+    sys_ids = list(dict.fromkeys(sys_id for sys_id in sys_ids if sys_id))
+    states = {}
+
+    for start in range(0, len(sys_ids), chunk_size):
+        chunk = sys_ids[start:start + chunk_size]
+        # stable order so offset pages neither skip nor repeat records
+        for record in _fetch_incidents(client, f"sys_idIN{','.join(chunk)}^ORDERBYsys_id"):
+            states[record["sys_id"]] = _state_record(record)
+
+    logger.debug(f"Fetched {len(states)} of {len(sys_ids)} ServiceNow incident states")
+    return states
+
+
+def fetch_updated_servicenow_incidents(since, caller_sys_id=None, group_sys_ids=()) -> dict:
+    """
+    Fetch state and sys_updated_on of the incidents updated at or after `since`
+    that belong to our caller or one of our assignment groups, keyed by sys_id.
+    """
+    client = get_servicenow_client()
+    scope = []
+    if caller_sys_id:
+        scope.append(f"caller_id={caller_sys_id}")
+    if group_sys_ids:
+        scope.append(f"assignment_groupIN{','.join(group_sys_ids)}")
+    # A^ORB^C is (A or B) and C; stored dates are compared in UTC
+    query = "^OR".join(scope)
+    since_value = since.astimezone(dt_timezone.utc).strftime(SERVICENOW_DATETIME_FORMAT)
+    query = f"{query}^sys_updated_on>={since_value}" if query else f"sys_updated_on>={since_value}"
+    # ordered by update time so records changed while paging land on later pages
+    query += "^ORDERBYsys_updated_on"
+
+    states = {}
+    for record in _fetch_incidents(client, query):
+        states[record["sys_id"]] = _state_record(record)
+    logger.debug(f"Fetched {len(states)} ServiceNow incident(s) updated since {since_value}")
+    return states
+
+
+def parse_servicenow_datetime(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, SERVICENOW_DATETIME_FORMAT).replace(tzinfo=dt_timezone.utc)
+    except ValueError:
+        logger.warning(f"Unexpected ServiceNow date '{value}'")
+        return None
+
+
+def add_servicenow_comment(sys_id: str, comment: str) -> bool:
+    """
+    Append an additional comment to the journal of a ServiceNow incident
+    """
+    client = get_servicenow_client()
+    response = client.patch(client.table_url("incident", sys_id), json={"comments": comment})
+    response.raise_for_status()
+    logger.info(f"Comment added to ServiceNow incident sys_id={sys_id}")
+    return True
@@ -0,0 +1,96 @@
+import logging
+from django.conf import settings
+from django.db import transaction
+from servicenow.utils.servicenow import parse_servicenow_datetime
+from tickets.models import Ticket
+
+"""Applies fetched ServiceNow incident states to the local tickets."""
+
+logger = logging.getLogger(__name__)
+
+# ServiceNow incident state -> servicenow_ticket_status
+SN_STATE_CHOICES = {
+    "1": "New",
+    "2": "In-Progress",
+    "3": "On-Hold",
+    "6": "Resolved",
+    "7": "Closed",
+    "8": "Canceled",
+}
+
+
+def get_apply_batch_size():
+    return max(1, int(getattr(settings, "SERVICENOW_APPLY_BATCH_SIZE", 500)))
+
+
+# Local status for a fetched incident record, None when it is missing or unknown
+def map_servicenow_state(sn_record):
+    if not sn_record or not sn_record.get("state"):
+        return None
+    return SN_STATE_CHOICES.get(str(sn_record["state"]).strip().lower())
+
+
+APPLY_FIELDS = ("id", "servicenow_ticket_number", "servicenow_ticket_status", "servicenow_updated_on")
+
+
+def apply_servicenow_states(tickets, sn_states, batch_size=None):
+    """
+    Write the fetched states of `tickets` (keyed by servicenow_sys_id in
+    `sn_states`) back to the database. The rows are re-read under
+    select_for_update, one transaction per batch, and a state older than the
+    sys_updated_on already applied is stale and skipped, whichever path (poll
+    or webhook) applied the newer one. Only changed rows are written with one
+    bulk_update; their linked duplicates follow with one update per status.
+    Returns the counts of changed, unchanged, stale and unmatched tickets.
+    """
+    batch_size = batch_size or get_apply_batch_size()
+    counts = {"changed": 0, "unchanged": 0, "stale": 0, "unmatched": 0}
+    sys_ids = {ticket.id: ticket.servicenow_sys_id for ticket in tickets}
+    ids = list(sys_ids)
+
+    for start in range(0, len(ids), batch_size):
+        with transaction.atomic():
+            locked = (
+                Ticket.objects.select_for_update()
+                .filter(id__in=ids[start:start + batch_size])
+                .only(*APPLY_FIELDS)
+            )
+            dirty = []
+            by_status = {}
+            for ticket in locked:
+                record = sn_states.get(sys_ids[ticket.id])
+                new_status = map_servicenow_state(record)
+                if new_status is None:
+                    counts["unmatched"] += 1
+                    continue
+                updated_on = parse_servicenow_datetime(record.get("sys_updated_on"))
+                if updated_on and ticket.servicenow_updated_on and updated_on < ticket.servicenow_updated_on:
+                    logger.debug(
+                        f"Stale ServiceNow state {new_status} ({updated_on}) for ticket "
+                        f"{ticket.servicenow_ticket_number}, {ticket.servicenow_updated_on} already applied"
+                    )
+                    counts["stale"] += 1
+                    continue
+                newer = updated_on is not None and updated_on != ticket.servicenow_updated_on
+                if updated_on:
+                    ticket.servicenow_updated_on = updated_on
+                if new_status == ticket.servicenow_ticket_status:
+                    counts["unchanged"] += 1
+                    if newer:
+                        dirty.append(ticket)
+                    continue
+                logger.debug(
+                    f"ServiceNow State: {ticket.servicenow_ticket_status} -> {new_status} "
+                    f"for ticket - {ticket.servicenow_ticket_number}"
+                )
+                ticket.servicenow_ticket_status = new_status
+                counts["changed"] += 1
+                dirty.append(ticket)
+                by_status.setdefault(new_status, []).append(ticket.id)
+
+            if dirty:
+                Ticket.objects.bulk_update(dirty, ["servicenow_ticket_status", "servicenow_updated_on"])
+            for status, changed_ids in by_status.items():
+                Ticket.objects.filter(duplicate_of_id__in=changed_ids).update(servicenow_ticket_status=status)
+
+    return counts
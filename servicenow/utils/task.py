@@ -1,21 +1,55 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
 from celery import shared_task
+from django.conf import settings
 from django.utils import timezone
-from tickets.models import Ticket
+from tickets.models import Ticket, TicketComment
+from servicenow.models import AssignmentGroup, ServiceNowSyncState
+from servicenow.utils.claims import (
+    RETRYABLE_STATUSES,
+    claim_tickets,
+    get_max_attempts,
+    get_retry_delay,
+    release_claims,
+)
 from servicenow.utils.servicenow import (
+    add_servicenow_comment,
+    apply_incident_result,
+    CORRELATION_FIELD,
+    build_incident_payload,
     create_servicenow_ticket,
-    fetch_servicenow_ticket_status,
+    fetch_servicenow_ticket_states,
+    fetch_updated_servicenow_incidents,
+    find_incidents_by_correlation,
+    may_have_incident,
+    parse_servicenow_datetime,
+    post_incident,
+    post_incidents_batch,
+    use_batch_api,
 )
+from servicenow.utils.statussync import apply_servicenow_states
+from servicenow.utils.throttle import ServiceNowUnavailable, is_servicenow_available
+from servicenow.utils.webhook import prune_webhook_events
 from django.db.models import Q
+from dashboard.utils.tasklock import singleton_task
+from tickets.utils.task import send_ticket_replies
 
 logger = logging.getLogger(__name__)
 
+# the status sync only reads and writes these
+SYNC_FIELDS = ("id", "servicenow_sys_id", "servicenow_ticket_number", "servicenow_ticket_status")
+
 
 @shared_task(bind=True,)
 def process_ticket_task(self, ticket_id):
     """
     Celery task to sync ticket with ServiceNow.
     """
+    token, claimed = claim_tickets([ticket_id])
+    if not claimed:
+        logger.info(f"Ticket {ticket_id} is already created or claimed by another worker, skipping")
+        return
     ticket = Ticket.objects.get(id=ticket_id)
 
     try:
@@ -23,73 +57,326 @@ def process_ticket_task(self, ticket_id):
 
         create_servicenow_ticket(ticket)
 
-    except Exception as e:
-        ticket.ticket_creation_status = "failed"
-        ticket.sync_attempts += 1
-        ticket.last_sync_attempt = timezone.now()
-        ticket.error_message = str(e)
-        ticket.save(
-            update_fields=[
-                "ticket_creation_status",
-                "sync_attempts",
-                "last_sync_attempt",
-                "error_message",
-            ]
-        )
+    except ServiceNowUnavailable as e:
+        # not the ticket's fault, the retry job picks it up once ServiceNow recovers
+        logger.warning(f"ServiceNow unavailable, ticket {ticket.id} left {ticket.ticket_creation_status}: {e}")
+        release_claims([ticket.id], token)
+        return
 
+    except Exception as e:
+        _record_creation_failure(ticket, e)
         logger.exception(f"Celery failed for ticket {ticket.id}")
         raise
 
+    # the ticket has its number now, reply to its email (and linked duplicates) right away
+    try:
+        send_ticket_replies.delay([ticket.id])
+    except Exception as e:
+        # the reply sweeper picks it up
+        logger.error(f"Could not queue the email reply for ticket {ticket.id}: {e}")
 
-@shared_task(bind=True,)
-def sync_servicenow_ticket_statuses(self):
+
+def _record_creation_failure(ticket, error):
+    ticket.ticket_creation_status = "failed"
+    ticket.sync_attempts += 1
+    ticket.last_sync_attempt = timezone.now()
+    ticket.error_message = str(error)
+    # exponential backoff, the claim is released for the retry job
+    ticket.next_sync_attempt_at = ticket.last_sync_attempt + get_retry_delay(ticket.sync_attempts)
+    ticket.sync_claimed_by = ""
+    ticket.sync_claimed_until = None
+    ticket.save(
+        update_fields=[
+            "ticket_creation_status",
+            "sync_attempts",
+            "last_sync_attempt",
+            "error_message",
+            "next_sync_attempt_at",
+            "sync_claimed_by",
+            "sync_claimed_until",
+        ]
+    )
+    if ticket.sync_attempts >= get_max_attempts():
+        logger.error(
+            f"Ticket {ticket.id} failed {ticket.sync_attempts} ServiceNow creation attempts, giving up: {error}"
+        )
+
+
+def get_create_concurrency():
+    return max(1, int(getattr(settings, "SERVICENOW_CREATE_CONCURRENCY", 8)))
+
+
+def get_create_batch_size():
+    return max(1, int(getattr(settings, "SERVICENOW_CREATE_BATCH_SIZE", 50)))
+
+
+def create_servicenow_tickets(tickets, concurrency=None):
+    """
+    Create the incidents of many tickets from one worker. With SERVICENOW_BATCH_API
+    they are first sent through the Batch API; the remaining POSTs run in a
+    thread pool of at most `concurrency` requests. The database writes stay on
+    the calling thread. Returns {ticket id: None when created, else the error}.
+    """
+    concurrency = concurrency or get_create_concurrency()
+    by_id = {ticket.id: ticket for ticket in tickets}
+    results = {}
+    payloads = {}
+    for ticket in tickets:
+        try:
+            payloads[ticket.id] = build_incident_payload(ticket)
+        except Exception as e:
+            _record_creation_failure(ticket, e)
+            results[ticket.id] = str(e)
+    _apply_existing_incidents(by_id, payloads, results)
+    if use_batch_api() and len(payloads) > 1:
+        for ticket_id, outcome in post_incidents_batch(payloads).items():
+            if isinstance(outcome, Exception):
+                # retried below with a single request
+                logger.warning(f"Batch create failed for ticket {ticket_id}, falling back: {outcome}")
+                continue
+            try:
+                apply_incident_result(by_id[ticket_id], outcome)
+                results[ticket_id] = None
+            except Exception as e:
+                _record_creation_failure(by_id[ticket_id], e)
+                results[ticket_id] = str(e)
+            del payloads[ticket_id]
+    if not payloads:
+        return results
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(payloads)), thread_name_prefix="servicenow") as pool:
+        futures = {
+            pool.submit(post_incident, payload, ticket_id): ticket_id
+            for ticket_id, payload in payloads.items()
+        }
+        for future in as_completed(futures):
+            ticket = by_id[futures[future]]
+            try:
+                apply_incident_result(ticket, future.result())
+                results[ticket.id] = None
+            except ServiceNowUnavailable as e:
+                # left as it is for the next retry run
+                release_claims([ticket.id], ticket.sync_claimed_by)
+                results[ticket.id] = str(e)
+            except Exception as e:
+                _record_creation_failure(ticket, e)
+                results[ticket.id] = str(e)
+    return results
+
+
+# Retried tickets whose incident already exists are applied and dropped from `payloads`
+def _apply_existing_incidents(by_id, payloads, results):
+    retried = [ticket_id for ticket_id in payloads if may_have_incident(by_id[ticket_id])]
+    if not retried:
+        return
+    try:
+        existing = find_incidents_by_correlation(payloads[ticket_id][CORRELATION_FIELD] for ticket_id in retried)
+    except ServiceNowUnavailable as e:
+        for ticket_id in retried:
+            release_claims([ticket_id], by_id[ticket_id].sync_claimed_by)
+            results[ticket_id] = str(e)
+            del payloads[ticket_id]
+        return
+    except Exception as e:
+        # never POST blindly when we could not check
+        logger.error(f"ServiceNow correlation lookup failed for tickets {retried}: {e}")
+        for ticket_id in retried:
+            _record_creation_failure(by_id[ticket_id], e)
+            results[ticket_id] = str(e)
+            del payloads[ticket_id]
+        return
+
+    for ticket_id in retried:
+        record = existing.get(payloads[ticket_id][CORRELATION_FIELD])
+        if not record:
+            continue
+        logger.info(f"ServiceNow incident {record.get('number')} already exists for ticket {ticket_id}")
+        try:
+            apply_incident_result(by_id[ticket_id], record)
+            results[ticket_id] = None
+        except Exception as e:
+            _record_creation_failure(by_id[ticket_id], e)
+            results[ticket_id] = str(e)
+        del payloads[ticket_id]
+
+
+@shared_task
+def create_servicenow_tickets_task(ticket_ids, claim_token=None):
     """
-    Periodically sync ServiceNow ticket status into local DB
+    Celery task to create the ServiceNow incidents of a batch of tickets concurrently.
+    Only tickets still claimed with `claim_token` are processed; without a token
+    the task claims them itself.
     """
-    tickets = Ticket.objects.exclude(
-        Q(servicenow_sys_id__isnull=True)
-        | Q(servicenow_ticket_status__in=["Resolved", "Closed", "Canceled"])
+    if claim_token is None:
+        claim_token, ticket_ids = claim_tickets(ticket_ids)
+    if not is_servicenow_available():
+        logger.warning(f"ServiceNow circuit is open, {len(ticket_ids)} ticket(s) left for the retry job")
+        release_claims(ticket_ids, claim_token)
+        return {}
+    tickets = list(
+        Ticket.objects.filter(
+            id__in=ticket_ids,
+            ticket_creation_status__in=RETRYABLE_STATUSES,
+            sync_claimed_by=claim_token,
+            sync_claimed_until__gte=timezone.now(),
+        ).select_related("assigned_team")
     )
+    results = create_servicenow_tickets(tickets)
+    created = [ticket_id for ticket_id, error in results.items() if error is None]
+    logger.info(f"Created {len(created)} of {len(tickets)} ServiceNow incident(s)")
 
-    logger.info(f"Starting ServiceNow status sync for {tickets.count()} tickets")
+    if created:
+        try:
+            send_ticket_replies.delay(created)
+        except Exception as e:
+            logger.error(f"Could not queue the email replies for tickets {created}: {e}")
+    # JSON result backends need string keys
+    return {str(ticket_id): error for ticket_id, error in results.items()}
 
+
+# Claim tickets and queue their creation, one batch task per SERVICENOW_CREATE_BATCH_SIZE.
+# With no ids the due tickets are claimed, up to SERVICENOW_RETRY_LIMIT per run.
+def queue_servicenow_creation(ticket_ids=None):
+    batch_size = get_create_batch_size()
+    limit = None if ticket_ids is not None else max(batch_size, int(getattr(settings, "SERVICENOW_RETRY_LIMIT", 500)))
+    token, claimed = claim_tickets(ticket_ids, limit=limit)
+    for start in range(0, len(claimed), batch_size):
+        create_servicenow_tickets_task.delay(claimed[start:start + batch_size], token)
+    return claimed
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def push_ticket_comment_task(self, comment_id):
+    """
+    Celery task to add a ticket comment to its ServiceNow incident.
+    """
+    comment = TicketComment.objects.select_related(
+        "ticket", "ticket__duplicate_of", "author", "email_record"
+    ).get(id=comment_id)
+    if comment.servicenow_synced:
+        return
+    # comments on a linked duplicate go to the shared incident
+    incident = comment.ticket.duplicate_of or comment.ticket
+    if not incident.servicenow_sys_id:
+        # picked up by servicenow_ticket_retry once the incident exists
+        logger.debug(f"Ticket #{comment.ticket_id} has no ServiceNow incident yet, comment {comment.id} deferred")
+        return
+
+    author = (
+        (comment.email_record.sender if comment.email_record else None)
+        or (comment.author.email if comment.author else None)
+        or "unknown sender"
+    )
     try:
-        for ticket in tickets:
-            sn_state = fetch_servicenow_ticket_status(ticket.servicenow_sys_id)
-            if not sn_state:
-                continue
-            sn_state_normalized = sn_state.strip().lower()
-
-            sn_state_choices = {
-                "1": "New",
-                "2": "In-Progress",
-                "3": "On-Hold",
-                "6": "Resolved",
-                "7": "Closed",
-                "8": "Canceled",
-            }
-            ticket.servicenow_ticket_status = sn_state_choices[str(sn_state_normalized)]
-            logger.debug(
-                f"ServiceNow State: {ticket.servicenow_ticket_status} for ticket - {ticket.servicenow_ticket_number}"
+        add_servicenow_comment(
+            incident.servicenow_sys_id,
+            f"{comment.get_source_display()} reply from {author}:\n\n{comment.body}",
+        )
+    except Exception as e:
+        logger.error(f"Failed to add comment {comment.id} to ServiceNow: {e}")
+        raise self.retry(exc=e)
+
+    TicketComment.objects.filter(id=comment.id).update(servicenow_synced=True)
+
+
+@shared_task(bind=True,)
+@singleton_task(name="sync_servicenow_ticket_statuses", lease=1200)
+def sync_servicenow_ticket_statuses(self):
+    """
+    Periodically sync ServiceNow ticket status into local DB. With the webhook
+    configured this is only a reconciliation for missed notifications.
+    Only incidents updated since the stored watermark are read; the first run
+    (or one after the watermark was cleared) reads every open ticket.
+    """
+    if not is_servicenow_available():
+        logger.warning("ServiceNow circuit is open, status sync skipped")
+        return None
+    sync_state, _ = ServiceNowSyncState.objects.get_or_create(instance=settings.SERVICENOW_INSTANCE or "")
+    started_at = timezone.now()
+
+    try:
+        if sync_state.last_updated_on is None:
+            tickets = list(Ticket.objects.exclude(
+                Q(servicenow_sys_id__isnull=True)
+                | Q(servicenow_ticket_status__in=["Resolved", "Closed", "Canceled"])
+            ).only(*SYNC_FIELDS))
+            logger.info(f"Starting full ServiceNow status sync for {len(tickets)} tickets")
+            # a few bulk queries instead of one GET per ticket
+            sn_states = fetch_servicenow_ticket_states(ticket.servicenow_sys_id for ticket in tickets)
+        else:
+            # re-read a margin before the watermark for clock skew and late commits
+            since = sync_state.last_updated_on - timedelta(seconds=get_sync_overlap())
+            sn_states = fetch_updated_servicenow_incidents(
+                since,
+                caller_sys_id=settings.SERVICENOW_SYSID,
+                group_sys_ids=list(
+                    AssignmentGroup.objects.filter(is_active=True).values_list("servicenow_group_id", flat=True)
+                ),
             )
-            ticket.save()
+            # closed tickets too, an incident may have been reopened
+            tickets = list(Ticket.objects.filter(servicenow_sys_id__in=list(sn_states)).only(*SYNC_FIELDS))
+            logger.info(
+                f"Starting incremental ServiceNow status sync: {len(sn_states)} incident(s) "
+                f"updated since {since}, {len(tickets)} local ticket(s)"
+            )
+
+        counts = apply_servicenow_states(tickets, sn_states)
 
-        logger.info("ServiceNow status sync completed")
+        _advance_watermark(sync_state, sn_states, started_at, counts)
+        prune_webhook_events(started_at)
+        logger.info(
+            f"ServiceNow status sync completed: {counts['changed']} changed, "
+            f"{counts['unchanged']} unchanged, {counts['stale']} stale, "
+            f"{counts['unmatched']} without a known state"
+        )
+        return counts
     except Exception as e:
         logger.exception(f"Status update failed: {e}")
         raise
 
 
+def get_sync_overlap():
+    return max(0, int(getattr(settings, "SERVICENOW_SYNC_OVERLAP_SECONDS", 120)))
+
+
+# Newest sys_updated_on seen (ServiceNow's clock), or the run start after a full sync
+def _advance_watermark(sync_state, sn_states, started_at, counts):
+    updated = [parse_servicenow_datetime(record["sys_updated_on"]) for record in sn_states.values()]
+    updated = [value for value in updated if value]
+    if sync_state.last_updated_on is None:
+        sync_state.last_updated_on = max(updated + [started_at])
+    elif updated:
+        sync_state.last_updated_on = max(updated + [sync_state.last_updated_on])
+    sync_state.last_run_at = timezone.now()
+    sync_state.last_fetched = len(sn_states)
+    sync_state.last_changed = counts["changed"]
+    sync_state.last_unchanged = counts["unchanged"]
+    sync_state.save(
+        update_fields=["last_updated_on", "last_run_at", "last_fetched", "last_changed", "last_unchanged"]
+    )
+
+
 @shared_task
+@singleton_task(name="servicenow_ticket_retry", lease=1200)
 def servicenow_ticket_retry():
-    tickets = Ticket.objects.filter(
-        ticket_creation_status__in=["pending","failed"]
-    )
-    if tickets:
-        logger.info("Servicenow sheduled retry started...")
-        for ticket in tickets:
-            process_ticket_task.delay(ticket.id)
-            logger.debug(f"Creating servicenow ticket #{ticket.id}")
-        logger.info("Servicenow sheduled retry completed")
+    if not is_servicenow_available():
+        logger.warning("ServiceNow circuit is open, ticket creation retry postponed")
     else:
-        logger.info("No pending or failed request to create the servicenow ticket")
\ No newline at end of file
+        # only due, unclaimed tickets: in-flight ones and those backing off are left alone
+        ticket_ids = queue_servicenow_creation()
+        if ticket_ids:
+            logger.info(f"Servicenow sheduled retry queued {len(ticket_ids)} ticket(s)")
+        else:
+            logger.info("No due pending or failed request to create the servicenow ticket")
+
+    comment_ids = list(
+        TicketComment.objects.filter(
+            Q(ticket__servicenow_sys_id__isnull=False)
+            | Q(ticket__duplicate_of__servicenow_sys_id__isnull=False),
+            servicenow_synced=False,
+        ).values_list("id", flat=True)
+    )
+    for comment_id in comment_ids:
+        push_ticket_comment_task.delay(comment_id)
+    if comment_ids:
+        logger.info(f"Queued {len(comment_ids)} deferred ticket comment(s) for ServiceNow")
\ No newline at end of file
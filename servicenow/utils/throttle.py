@@ -0,0 +1,357 @@
+import logging
+import math
+import threading
+import time
+from django.conf import settings
+from dashboard.utils.tasklock import get_redis_client
+
+"""Shared rate limiting and circuit breaking for ServiceNow API calls.
+
+Every request takes a token from a bucket shared by all workers (Redis, or
+per process without a Redis broker) and waits while ServiceNow asked us to
+back off with Retry-After. Failures are counted per window; when the error
+rate is too high the circuit opens, calls fail fast with
+ServiceNowUnavailable and, after a cool-down, a single probe request decides
+whether it closes again.
+"""
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+# refill by elapsed time on the Redis clock, take one token or return the wait in ms
+_TOKEN_SCRIPT = """
+local now_parts = redis.call('time')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local data = redis.call('hmget', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]) or burst
+local ts = tonumber(data[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate / 1000)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call('hset', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('pexpire', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return wait
+"""
+
+
+class ServiceNowUnavailable(Exception):
+    """Raised instead of calling ServiceNow while the circuit is open or we are throttled."""
+
+
+def get_rate_per_second():
+    return max(0.1, float(getattr(settings, "SERVICENOW_RATE_PER_SECOND", 10)))
+
+
+def get_rate_burst():
+    return max(1, int(getattr(settings, "SERVICENOW_RATE_BURST", 20)))
+
+
+def get_max_wait():
+    return max(0.0, float(getattr(settings, "SERVICENOW_RATE_MAX_WAIT", 30)))
+
+
+def get_breaker_window():
+    return max(1, int(getattr(settings, "SERVICENOW_BREAKER_WINDOW", 60)))
+
+
+def get_breaker_min_requests():
+    return max(1, int(getattr(settings, "SERVICENOW_BREAKER_MIN_REQUESTS", 10)))
+
+
+def get_breaker_error_rate():
+    return float(getattr(settings, "SERVICENOW_BREAKER_ERROR_RATE", 0.5))
+
+
+def get_breaker_open_seconds():
+    return max(1, int(getattr(settings, "SERVICENOW_BREAKER_OPEN_SECONDS", 60)))
+
+
+class RedisGuardBackend:
+    prefix = "servicenow:"
+
+    def __init__(self, client):
+        self.client = client
+
+    def take_token(self, rate, burst):
+        return int(self.client.eval(_TOKEN_SCRIPT, 1, self.prefix + "bucket", rate, burst)) / 1000
+
+    def pause(self, seconds):
+        key = self.prefix + "pause"
+        # never shorten a longer pause another worker already set
+        if self.paused_for() < seconds:
+            self.client.set(key, 1, px=int(seconds * 1000))
+
+    def paused_for(self):
+        return max(0, self.client.pttl(self.prefix + "pause")) / 1000
+
+    def record(self, failed, window):
+        key = f"{self.prefix}breaker:{int(time.time() // window)}"
+        pipe = self.client.pipeline()
+        pipe.hincrby(key, "err" if failed else "ok", 1)
+        pipe.expire(key, window * 2)
+        pipe.execute()
+
+    # requests and errors of the current and the previous window
+    def counts(self, window):
+        current = int(time.time() // window)
+        ok = err = 0
+        for index in (current - 1, current):
+            values = self.client.hgetall(f"{self.prefix}breaker:{index}")
+            ok += int(values.get(b"ok", 0))
+            err += int(values.get(b"err", 0))
+        return ok + err, err
+
+    def reset_counts(self, window):
+        current = int(time.time() // window)
+        self.client.delete(f"{self.prefix}breaker:{current - 1}", f"{self.prefix}breaker:{current}")
+
+    def open(self, seconds):
+        self.client.set(self.prefix + "breaker:open", 1, px=int(seconds * 1000))
+        self.client.set(self.prefix + "breaker:tripped", 1)
+        self.client.delete(self.prefix + "breaker:probe")
+
+    def open_for(self):
+        return max(0, self.client.pttl(self.prefix + "breaker:open")) / 1000
+
+    def tripped(self):
+        return bool(self.client.exists(self.prefix + "breaker:tripped"))
+
+    def try_probe(self, lease):
+        return bool(self.client.set(self.prefix + "breaker:probe", 1, nx=True, px=int(lease * 1000)))
+
+    def release_probe(self):
+        self.client.delete(self.prefix + "breaker:probe")
+
+    def close(self):
+        self.client.delete(
+            self.prefix + "breaker:open", self.prefix + "breaker:tripped", self.prefix + "breaker:probe"
+        )
+
+
+class LocalGuardBackend:
+    """Same state in process memory, only used without a Redis broker."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = None
+        self.updated = time.monotonic()
+        self.pause_until = 0.0
+        self.windows = {}
+        self.open_until = 0.0
+        self.is_tripped = False
+        self.probe_until = 0.0
+
+    def take_token(self, rate, burst):
+        with self.lock:
+            now = time.monotonic()
+            tokens = burst if self.tokens is None else self.tokens
+            tokens = min(burst, tokens + (now - self.updated) * rate)
+            self.updated = now
+            if tokens >= 1:
+                self.tokens = tokens - 1
+                return 0
+            self.tokens = tokens
+            return (1 - tokens) / rate
+
+    def pause(self, seconds):
+        with self.lock:
+            self.pause_until = max(self.pause_until, time.monotonic() + seconds)
+
+    def paused_for(self):
+        return max(0.0, self.pause_until - time.monotonic())
+
+    def record(self, failed, window):
+        index = int(time.time() // window)
+        with self.lock:
+            counts = self.windows.setdefault(index, [0, 0])
+            counts[1 if failed else 0] += 1
+            for old in [key for key in self.windows if key < index - 1]:
+                del self.windows[old]
+
+    def counts(self, window):
+        current = int(time.time() // window)
+        with self.lock:
+            ok = sum(self.windows.get(index, [0, 0])[0] for index in (current - 1, current))
+            err = sum(self.windows.get(index, [0, 0])[1] for index in (current - 1, current))
+        return ok + err, err
+
+    def reset_counts(self, window):
+        with self.lock:
+            self.windows.clear()
+
+    def open(self, seconds):
+        with self.lock:
+            self.open_until = time.monotonic() + seconds
+            self.is_tripped = True
+            self.probe_until = 0.0
+
+    def open_for(self):
+        return max(0.0, self.open_until - time.monotonic())
+
+    def tripped(self):
+        return self.is_tripped
+
+    def try_probe(self, lease):
+        with self.lock:
+            now = time.monotonic()
+            if self.probe_until > now:
+                return False
+            self.probe_until = now + lease
+            return True
+
+    def release_probe(self):
+        with self.lock:
+            self.probe_until = 0.0
+
+    def close(self):
+        with self.lock:
+            self.open_until = 0.0
+            self.is_tripped = False
+            self.probe_until = 0.0
+
+
+_local_backend = LocalGuardBackend()
+
+
+def get_guard_backend():
+    client = get_redis_client()
+    if client is not None:
+        return RedisGuardBackend(client)
+    return _local_backend
+
+
+def breaker_state(backend=None):
+    backend = backend or get_guard_backend()
+    if backend.open_for() > 0:
+        return OPEN
+    if backend.tripped():
+        return HALF_OPEN
+    return CLOSED
+
+
+def is_servicenow_available():
+    try:
+        return breaker_state() != OPEN
+    except Exception as e:
+        logger.warning(f"ServiceNow circuit state unavailable: {e}")
+        return True
+
+
+# Called by the client before every request: fail fast, or wait for a token.
+# Returns True when this request is the half-open probe.
+def before_request():
+    try:
+        backend = get_guard_backend()
+        state = breaker_state(backend)
+        if state == OPEN:
+            raise ServiceNowUnavailable(f"ServiceNow circuit is open for {backend.open_for():.0f}s")
+        # half-open: one probe request at a time decides
+        probe = False
+        if state == HALF_OPEN:
+            if not backend.try_probe(getattr(settings, "SERVICENOW_READ_TIMEOUT", 30)):
+                raise ServiceNowUnavailable("ServiceNow circuit is half-open, probe in progress")
+            probe = True
+
+        try:
+            _wait_for_token(backend)
+        except Exception:
+            # the probe was never sent, let the next request take it
+            if probe:
+                backend.release_probe()
+            raise
+        return probe
+    except ServiceNowUnavailable:
+        raise
+    except Exception as e:
+        # the guard must never take ServiceNow calls down with it
+        logger.warning(f"ServiceNow rate limiter unavailable, calling without it: {e}")
+        return False
+
+
+# Wait while paused or out of tokens, give up after SERVICENOW_RATE_MAX_WAIT
+def _wait_for_token(backend):
+    deadline = time.monotonic() + get_max_wait()
+    while True:
+        wait = backend.paused_for() or backend.take_token(get_rate_per_second(), get_rate_burst())
+        if not wait:
+            return
+        if time.monotonic() + wait > deadline:
+            raise ServiceNowUnavailable(f"ServiceNow rate limit, next slot in {wait:.1f}s")
+        time.sleep(wait)
+
+
+# Called by the client with the final response (after adapter retries) or the error;
+# only the request that holds the probe (`probe`) closes or re-opens a half-open circuit
+def after_response(response=None, error=None, probe=False):
+    status = response.status_code if response is not None else None
+    failed = error is not None or status == 429 or (status is not None and status >= 500)
+    try:
+        backend = get_guard_backend()
+        retry_after = _retry_after(response)
+        if retry_after:
+            logger.warning(f"ServiceNow asked to back off for {retry_after:.0f}s (HTTP {status})")
+            backend.pause(retry_after)
+
+        state = breaker_state(backend)
+        if state == HALF_OPEN and probe:
+            if failed:
+                backend.open(get_breaker_open_seconds())
+                logger.error("ServiceNow probe request failed, circuit re-opened")
+            else:
+                backend.close()
+                backend.reset_counts(get_breaker_window())
+                logger.info("ServiceNow probe request succeeded, circuit closed")
+            return
+
+        window = get_breaker_window()
+        backend.record(failed, window)
+        if failed and state == CLOSED:
+            total, errors = backend.counts(window)
+            if total >= get_breaker_min_requests() and errors / total >= get_breaker_error_rate():
+                backend.open(get_breaker_open_seconds())
+                logger.error(
+                    f"ServiceNow circuit opened: {errors} of {total} requests failed, "
+                    f"pausing calls for {get_breaker_open_seconds()}s"
+                )
+    except Exception as e:
+        logger.warning(f"ServiceNow circuit breaker unavailable: {e}")
+
+
+def _retry_after(response):
+    if response is None or response.status_code not in (429, 503):
+        return None
+    value = response.headers.get("Retry-After")
+    if not value:
+        return 1.0 if response.status_code == 429 else None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+# State for the admin dashboard
+def breaker_status():
+    try:
+        backend = get_guard_backend()
+        total, errors = backend.counts(get_breaker_window())
+        return {
+            "state": breaker_state(backend),
+            "requests": total,
+            "errors": errors,
+            "error_rate": round(errors / total * 100, 1) if total else 0,
+            "open_for": math.ceil(backend.open_for()),
+            "paused_for": math.ceil(backend.paused_for()),
+            "shared": isinstance(backend, RedisGuardBackend),
+        }
+    except Exception as e:
+        logger.warning(f"ServiceNow circuit state unavailable: {e}")
+        return None
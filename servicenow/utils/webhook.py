@@ -0,0 +1,91 @@
+import base64
+import hashlib
+import hmac
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from tickets.models import Ticket
+from servicenow.models import ServiceNowWebhookEvent
+from servicenow.utils.servicenow import parse_servicenow_datetime
+from servicenow.utils.statussync import apply_servicenow_states
+
+"""Verification and application of incident notifications pushed by ServiceNow."""
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = "HTTP_X_SERVICENOW_SIGNATURE"
+
+
+def get_webhook_secret():
+    return getattr(settings, "SERVICENOW_WEBHOOK_SECRET", None) or ""
+
+
+# HMAC-SHA256 of the raw body, hex or base64 (GlideCertificateEncryption.generateMac),
+# optionally prefixed with "sha256="
+def verify_signature(body, signature):
+    secret = get_webhook_secret()
+    if not secret or not signature:
+        return False
+    signature = signature.strip()
+    if signature.startswith("sha256="):
+        signature = signature[len("sha256="):]
+    digest = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).digest()
+    return hmac.compare_digest(digest.hex(), signature.lower()) or hmac.compare_digest(
+        base64.b64encode(digest).decode("ascii"), signature
+    )
+
+
+def handle_incident_events(records):
+    """
+    Record and apply incident updates ({"sys_id", "state", "sys_updated_on",
+    "number"}). An update already received is a duplicate; one older than the
+    sys_updated_on already applied to the ticket (by the webhook or the poll)
+    is stale and not applied.
+    Returns the counts per outcome.
+    """
+    counts = {"applied": 0, "duplicate": 0, "stale": 0, "invalid": 0}
+    for record in records:
+        sys_id = str(record.get("sys_id") or "").strip()
+        updated_on = parse_servicenow_datetime(record.get("sys_updated_on"))
+        if not sys_id or updated_on is None:
+            counts["invalid"] += 1
+            continue
+
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    event = ServiceNowWebhookEvent.objects.create(
+                        sys_id=sys_id,
+                        sys_updated_on=updated_on,
+                        state=str(record.get("state") or ""),
+                        number=str(record.get("number") or ""),
+                        applied=True,
+                    )
+            except IntegrityError:
+                counts["duplicate"] += 1
+                continue
+
+            # compared with the sys_updated_on stored on the locked tickets, which the poll sets too
+            tickets = list(Ticket.objects.filter(servicenow_sys_id=sys_id).only("id", "servicenow_sys_id"))
+            applied = apply_servicenow_states(
+                tickets, {sys_id: {"state": record.get("state"), "sys_updated_on": record.get("sys_updated_on")}}
+            )
+            if applied["stale"]:
+                ServiceNowWebhookEvent.objects.filter(pk=event.pk).update(applied=False)
+                counts["stale"] += 1
+                continue
+            counts["applied"] += 1
+
+    logger.info(
+        f"ServiceNow webhook: {counts['applied']} applied, {counts['duplicate']} duplicate, "
+        f"{counts['stale']} stale, {counts['invalid']} invalid"
+    )
+    return counts
+
+
+# Events older than SERVICENOW_WEBHOOK_EVENT_RETENTION_DAYS are only needed for dedupe
+def prune_webhook_events(now):
+    days = int(getattr(settings, "SERVICENOW_WEBHOOK_EVENT_RETENTION_DAYS", 7))
+    deleted, _ = ServiceNowWebhookEvent.objects.filter(received_at__lt=now - timedelta(days=days)).delete()
+    return deleted
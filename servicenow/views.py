@@ -2,8 +2,16 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
+import json
+import logging
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from .models import AssignmentGroup
 from .forms import AssignmentGroupForm
+from .utils.webhook import SIGNATURE_HEADER, get_webhook_secret, handle_incident_events, verify_signature
+
+logger = logging.getLogger(__name__)
 
 @staff_member_required
 def assignment_group_list(request):
@@ -54,3 +62,27 @@ def assignment_group_delete(request, pk):
     group.delete()
     messages.success(request, "Assignment group deleted.")
     return redirect("servicenow:assignment_group_list")
+
+
+# Incident update notifications from a ServiceNow Business Rule / Outbound REST message.
+# Body: one {"sys_id", "state", "sys_updated_on", "number"} object or {"records": [...]},
+# signed with X-ServiceNow-Signature: HMAC-SHA256(SERVICENOW_WEBHOOK_SECRET, body) in hex.
+@csrf_exempt
+@require_POST
+def servicenow_webhook(request):
+    if not get_webhook_secret():
+        return JsonResponse({"error": "webhook disabled"}, status=404)
+    if not verify_signature(request.body, request.META.get(SIGNATURE_HEADER, "")):
+        logger.warning(f"Rejected ServiceNow webhook with a bad signature from {request.META.get('REMOTE_ADDR')}")
+        return JsonResponse({"error": "invalid signature"}, status=403)
+
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({"error": "invalid json"}, status=400)
+    records = payload.get("records", [payload]) if isinstance(payload, dict) else payload
+    if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        return JsonResponse({"error": "unexpected payload"}, status=400)
+
+    return JsonResponse(handle_incident_events(records))
+
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Ticket, EmailTicket
+from django.utils.html import format_html
+from .models import Ticket, EmailTicket, RawEmailBlob, TicketComment, MailboxState, OutboundEmail
 
 """Admin configuration for Ticket and EmailTicket models."""
 
@@ -26,10 +27,61 @@ class TicketAdmin(admin.ModelAdmin):
         "ticket_creation_status",
         "servicenow_ticket_number",
     )
+    raw_id_fields = ("duplicate_of",)
+    readonly_fields = ("sync_claimed_by", "sync_claimed_until", "next_sync_attempt_at")
 
 
 @admin.register(EmailTicket)
 class EmailTicketAdmin(admin.ModelAdmin):
-    list_display = ("uid", "sender", "subject", "received_at", "reply_sent", "ticket")
-    search_fields = ("uid", "sender", "subject")
+    list_display = ("uid", "account_key", "sender", "subject", "received_at", "reply_sent", "ticket")
+    list_filter = ("account_key", "reply_sent")
+    search_fields = ("uid", "sender", "subject", "message_id")
     raw_id_fields = ("ticket",)
+    exclude = ("raw_email", "raw_blob")
+    readonly_fields = ("raw_source",)
+
+    def get_queryset(self, request):
+        # the raw source is only loaded on the change page
+        return super().get_queryset(request).defer("raw_email", "body")
+
+    @admin.display(description="Raw email")
+    def raw_source(self, obj):
+        if obj.pk is None:
+            return "-"
+        return format_html(
+            '<pre style="max-height: 30em; overflow: auto;">{}</pre>', obj.get_raw_email()
+        )
+
+
+@admin.register(RawEmailBlob)
+class RawEmailBlobAdmin(admin.ModelAdmin):
+    list_display = ("digest", "codec", "size", "compressed_size", "created_at")
+    list_filter = ("codec",)
+    search_fields = ("digest",)
+    exclude = ("data",)
+    readonly_fields = ("digest", "codec", "size", "compressed_size")
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer("data")
+
+
+@admin.register(TicketComment)
+class TicketCommentAdmin(admin.ModelAdmin):
+    list_display = ("id", "ticket", "author", "source", "servicenow_synced", "created_at")
+    list_filter = ("source", "servicenow_synced")
+    search_fields = ("body", "ticket__servicenow_ticket_number")
+    raw_id_fields = ("ticket", "author", "email_record")
+
+
+@admin.register(MailboxState)
+class MailboxStateAdmin(admin.ModelAdmin):
+    list_display = ("account_key", "last_uid", "uid_validity", "last_polled_at")
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ("id", "account_key", "kind", "to_email", "status", "attempts", "next_attempt_at", "sent_at")
+    list_filter = ("status", "kind", "account_key")
+    search_fields = ("to_email", "subject")
+    raw_id_fields = ("email_ticket", "user")
+    readonly_fields = ("attempts", "last_error", "created_at", "sent_at")
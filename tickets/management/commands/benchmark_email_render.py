@@ -0,0 +1,100 @@
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from tickets.utils.emailrender import EmailTemplates
+
+TEMPLATE_SETS = {
+    "reply": (
+        "email/replay_email_subject.txt",
+        "email/replay_email.txt",
+        "email/replay_email.html",
+    ),
+    "verification": (
+        "email/verify_email_subject.txt",
+        "email/verify_email.txt",
+        "email/verify_email.html",
+    ),
+    "welcome": (
+        "email/new_email_user_subject.txt",
+        "email/new_email_user.txt",
+        "email/new_email_user.html",
+    ),
+}
+
+
+# Contexts carrying every variable the three template sets use
+def build_contexts(count):
+    return [
+        {
+            "ticket_number": f"INC{index:07d}",
+            "subject": f"Re: Printer on floor {index % 7} - Ticket Created: INC{index:07d}",
+            "user": {"username": f"user{index}", "email": f"user{index}@example.com"},
+            "verify_url": f"https://helpdesk.example.com/account/verify/{index}/token/",
+            "reset_url": f"https://helpdesk.example.com/account/reset/{index}/token/",
+            "domain": "helpdesk.example.com",
+            "protocol": "https",
+        }
+        for index in range(count)
+    ]
+
+
+class Command(BaseCommand):
+    help = "Benchmark per-message email rendering: render_to_string against the compiled email templates"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=1000, help="Messages rendered per run.")
+        parser.add_argument("--iterations", type=int, default=5)
+        parser.add_argument(
+            "--set",
+            choices=sorted(TEMPLATE_SETS),
+            action="append",
+            dest="sets",
+            help="Template set to benchmark (repeatable). Default: all.",
+        )
+
+    def handle(self, *args, **options):
+        contexts = build_contexts(max(1, options["count"]))
+        self.stdout.write(f"{len(contexts)} message(s) per run, iterations: {options['iterations']}")
+
+        for name in options["sets"] or sorted(TEMPLATE_SETS):
+            subject_template, text_template, html_template = TEMPLATE_SETS[name]
+
+            def legacy():
+                return [
+                    (
+                        render_to_string(subject_template, context).strip(),
+                        render_to_string(text_template, context),
+                        render_to_string(html_template, context),
+                    )
+                    for context in contexts
+                ]
+
+            templates = EmailTemplates(subject_template, text_template, html_template)
+            legacy_us, legacy_out = self.measure(legacy, len(contexts), options["iterations"])
+            single_us, _ = self.measure(
+                lambda: [templates.render(context) for context in contexts],
+                len(contexts),
+                options["iterations"],
+            )
+            batch_us, batch_out = self.measure(
+                lambda: templates.render_many(contexts), len(contexts), options["iterations"]
+            )
+            self.stdout.write(
+                f"{name}: render_to_string {legacy_us:.1f} us/msg, "
+                f"compiled {single_us:.1f} us/msg, "
+                f"batch {batch_us:.1f} us/msg "
+                f"({legacy_us / batch_us if batch_us else 0:.1f}x)"
+            )
+            if legacy_out != batch_out:
+                self.stdout.write(self.style.WARNING(f"{name}: rendered output differs"))
+
+    # Median microseconds per message over the iterations
+    def measure(self, func, count, iterations):
+        timings = []
+        result = None
+        for _ in range(max(1, iterations)):
+            started = time.perf_counter()
+            result = func()
+            timings.append((time.perf_counter() - started) * 1_000_000 / count)
+        return statistics.median(timings), result
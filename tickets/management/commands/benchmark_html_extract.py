@@ -0,0 +1,128 @@
+import re
+import statistics
+import time
+from email import message_from_bytes
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from tickets.utils.extractmail import get_body_max_chars, strip_html_tags
+
+OUTLOOK_STYLE = """
+<style><!--
+/* Font Definitions */
+@font-face {font-family:"Cambria Math"; panose-1:2 4 5 3 5 4 6 3 2 4;}
+@font-face {font-family:Calibri; panose-1:2 15 5 2 2 2 4 3 2 4;}
+p.MsoNormal, li.MsoNormal, div.MsoNormal {margin:0cm; font-size:11.0pt; font-family:"Calibri",sans-serif;}
+a:link, span.MsoHyperlink {mso-style-priority:99; color:#0563C1; text-decoration:underline;}
+span.EmailStyle17 {mso-style-type:personal-compose; font-family:"Calibri",sans-serif; color:windowtext;}
+.MsoChpDefault {mso-style-type:export-only; font-family:"Calibri",sans-serif;}
+@page WordSection1 {size:612.0pt 792.0pt; margin:72.0pt 72.0pt 72.0pt 72.0pt;}
+div.WordSection1 {page:WordSection1;}
+--></style>
+"""
+
+OUTLOOK_SCRIPT = "<script>var tracking = {id: 'abc', events: []};" + "function t(){return 1;}" * 200 + "</script>"
+
+OUTLOOK_PARAGRAPH = (
+    '<p class="MsoNormal"><span style="font-size:11.0pt;font-family:&quot;Calibri&quot;,sans-serif;'
+    'color:#1F497D">Hi team,<o:p></o:p></span></p>'
+    '<p class="MsoNormal"><span style="font-size:11.0pt">Since this morning the VPN client disconnects '
+    'every few minutes and I cannot reach the <b>finance</b> share. Error code&nbsp;809 is shown.'
+    '<o:p></o:p></span></p>'
+    '<table class="MsoNormalTable" border="0" cellspacing="0" cellpadding="0"><tr>'
+    '<td style="padding:0cm 5.4pt 0cm 5.4pt"><p class="MsoNormal">Host</p></td>'
+    '<td style="padding:0cm 5.4pt 0cm 5.4pt"><p class="MsoNormal">vpn-gw-01</p></td></tr></table>'
+    '<!--[if gte mso 9]><xml><o:shapedefaults v:ext="edit" spidmax="1026" /></xml><![endif]-->'
+)
+
+LEGACY_TAG_RE = re.compile("<.*?>")
+
+
+# Outlook style HTML mail of roughly size_kb kilobytes
+def build_outlook_html(size_kb):
+    head = f"<html><head><meta charset='utf-8'>{OUTLOOK_STYLE * 20}</head><body lang=EN-US>"
+    paragraphs = []
+    length = len(head)
+    while length < size_kb * 1024:
+        paragraphs.append(OUTLOOK_PARAGRAPH)
+        length += len(OUTLOOK_PARAGRAPH)
+    return head + OUTLOOK_SCRIPT + "".join(paragraphs) + "</body></html>"
+
+
+# The previous regex based implementation, kept for comparison
+def legacy_strip_html_tags(html):
+    text = re.sub(LEGACY_TAG_RE, "", html)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+# HTML part of an .eml file, or the file itself for .html files
+def load_html(path):
+    data = Path(path).read_bytes()
+    if path.endswith(".eml"):
+        msg = message_from_bytes(data)
+        for part in msg.walk():
+            if part.get_content_type() == "text/html":
+                return part.get_payload(decode=True).decode(
+                    part.get_content_charset() or "utf-8", errors="ignore"
+                )
+        raise CommandError(f"{path} has no text/html part")
+    return data.decode("utf-8", errors="ignore")
+
+
+class Command(BaseCommand):
+    help = "Benchmark HTML to text extraction of email bodies against the legacy regex version"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size-kb",
+            type=int,
+            action="append",
+            dest="sizes",
+            help="Size of a generated Outlook style mail (repeatable). Default: 50, 500, 2000.",
+        )
+        parser.add_argument(
+            "--file",
+            action="append",
+            dest="files",
+            default=[],
+            help="Real .html or .eml file to benchmark (repeatable).",
+        )
+        parser.add_argument("--iterations", type=int, default=10)
+        parser.add_argument(
+            "--max-chars",
+            type=int,
+            default=None,
+            help="Character budget, defaults to EMAIL_BODY_MAX_CHARS.",
+        )
+
+    def handle(self, *args, **options):
+        max_chars = options["max_chars"] or get_body_max_chars()
+        samples = [(path, load_html(path)) for path in options["files"]]
+        if not samples or options["sizes"]:
+            samples += [
+                (f"generated {size} KB", build_outlook_html(size))
+                for size in options["sizes"] or [50, 500, 2000]
+            ]
+
+        self.stdout.write(f"Character budget: {max_chars}, iterations: {options['iterations']}")
+        for name, html in samples:
+            legacy_ms, legacy_text = self.measure(legacy_strip_html_tags, html, options["iterations"])
+            new_ms, new_text = self.measure(
+                lambda value: strip_html_tags(value, max_chars=max_chars), html, options["iterations"]
+            )
+            self.stdout.write(
+                f"{name} ({len(html) // 1024} KB): "
+                f"regex {legacy_ms:.2f} ms -> {len(legacy_text)} chars, "
+                f"parser {new_ms:.2f} ms -> {len(new_text)} chars "
+                f"({legacy_ms / new_ms if new_ms else 0:.1f}x)"
+            )
+            if "mso-style" in new_text or "function t()" in new_text:
+                self.stdout.write(self.style.WARNING(f"{name}: style or script text leaked"))
+
+    def measure(self, func, html, iterations):
+        timings = []
+        result = ""
+        for _ in range(max(1, iterations)):
+            started = time.perf_counter()
+            result = func(html)
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings), result
@@ -0,0 +1,192 @@
+import csv
+import itertools
+import random
+import time
+from email.message import EmailMessage
+from email.utils import make_msgid
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from AI_Powered_IT_Ticket_System.celery_app import app
+from tickets.models import EmailTicket, MailboxState, OutboundEmail, RawEmailBlob, Ticket
+from tickets.utils.emailmonitortask import email_monitoring
+from tickets.utils.localmail import LocalIMAPServer, LocalMailbox, LocalSMTPServer
+from tickets.utils.task import send_ticket_replies
+
+ACCOUNT_KEY = "loadtest"
+SENDER_DOMAIN = "loadtest.example.com"
+
+
+class Command(BaseCommand):
+    help = (
+        "Flood a local IMAP stand-in with synthetic emails from ai_training_data.csv and "
+        "measure ingestion throughput through email_monitoring"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=500, help="Number of emails to generate.")
+        parser.add_argument("--senders", type=int, default=50, help="Number of distinct senders.")
+        parser.add_argument("--batch-size", type=int, default=None, help="Overrides EMAIL_BATCH_SIZE.")
+        parser.add_argument(
+            "--fetch-mode",
+            choices=["full", "bodystructure"],
+            default=None,
+            help="Overrides EMAIL_FETCH_MODE.",
+        )
+        parser.add_argument(
+            "--csv",
+            default=str(settings.BASE_DIR / "static" / "data" / "ai_training_data.csv"),
+            help="CSV with description, category and priority columns.",
+        )
+        parser.add_argument(
+            "--replies",
+            action="store_true",
+            help="Also send the 'Ticket Created' replies through the SMTP sink.",
+        )
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            help="Keep the generated tickets, emails and users instead of deleting them.",
+        )
+
+    def handle(self, *args, **options):
+        if EmailTicket.objects.filter(account_key=ACCOUNT_KEY).exists():
+            raise CommandError(
+                f"Emails of account '{ACCOUNT_KEY}' already exist, remove them or use a fresh database."
+            )
+
+        messages = self.build_messages(options)
+        mailbox = LocalMailbox()
+        for raw in messages:
+            mailbox.append(raw)
+
+        imap_server = LocalIMAPServer(mailbox)
+        smtp_server = LocalSMTPServer()
+        imap_server.start()
+        smtp_server.start()
+        self.stdout.write(
+            f"Local IMAP on port {imap_server.port}, SMTP on port {smtp_server.port}, "
+            f"{len(messages)} message(s) queued"
+        )
+
+        overrides = {
+            "EMAIL_ACCOUNTS": {
+                ACCOUNT_KEY: {
+                    "EMAIL_HOST_USER": f"support@{SENDER_DOMAIN}",
+                    "EMAIL_HOST_PASSWORD": "loadtest",
+                    "IMAP_ENABLED": True,
+                    "IMAP_HOST": "127.0.0.1",
+                    "IMAP_PORT": imap_server.port,
+                    "IMAP_SSL": False,
+                },
+            },
+            "EMAIL_BACKEND": "django.core.mail.backends.smtp.EmailBackend",
+            "EMAIL_HOST": "127.0.0.1",
+            "EMAIL_PORT": smtp_server.port,
+            "EMAIL_USE_TLS": False,
+            "EMAIL_USE_SSL": False,
+            # the outbox worker must not throttle the measurement
+            "EMAIL_OUTBOX_RATE_PER_MINUTE": 1_000_000,
+        }
+        if options["batch_size"]:
+            overrides["EMAIL_BATCH_SIZE"] = options["batch_size"]
+        if options["fetch_mode"]:
+            overrides["EMAIL_FETCH_MODE"] = options["fetch_mode"]
+
+        always_eager = app.conf.task_always_eager
+        # tasks queued by the pipeline run inline, ServiceNow dispatch is skipped; the
+        # outbox kicks only drain the load-test account, queued production mail is untouched
+        app.conf.task_always_eager = True
+        try:
+            with override_settings(**overrides):
+                self.run_ingestion(mailbox, len(messages), smtp_server)
+                if options["replies"]:
+                    self.run_replies(smtp_server)
+        finally:
+            app.conf.task_always_eager = always_eager
+            imap_server.stop()
+            smtp_server.stop()
+            if not options["keep"]:
+                self.cleanup()
+
+    # Synthetic RFC822 messages built from the training data rows
+    def build_messages(self, options):
+        try:
+            with open(options["csv"], newline="", encoding="utf-8") as handle:
+                rows = [row for row in csv.DictReader(handle) if row.get("description")]
+        except OSError as e:
+            raise CommandError(f"Cannot read {options['csv']}: {e}")
+        if not rows:
+            raise CommandError(f"No rows with a description in {options['csv']}")
+
+        rng = random.Random(options["seed"])
+        rng.shuffle(rows)
+        messages = []
+        for index, row in zip(range(options["count"]), itertools.cycle(rows)):
+            msg = EmailMessage()
+            msg["Subject"] = row["description"][:80]
+            msg["From"] = f"user{index % max(1, options['senders'])}@{SENDER_DOMAIN}"
+            msg["To"] = f"support@{SENDER_DOMAIN}"
+            msg["Message-ID"] = make_msgid(domain=SENDER_DOMAIN)
+            msg.set_content(
+                f"Hello,\n\n{row['description']}\n\n"
+                f"Category hint: {row.get('category', '')}, priority: {row.get('priority', '')}\n\nThanks"
+            )
+            messages.append(msg.as_bytes(policy=msg.policy.clone(linesep="\r\n")))
+        return messages
+
+    def run_ingestion(self, mailbox, total, smtp_server):
+        started = time.perf_counter()
+        runs = 0
+        while mailbox.unseen_count():
+            remaining = mailbox.unseen_count()
+            email_monitoring(dispatch=False)
+            runs += 1
+            if mailbox.unseen_count() >= remaining:
+                raise CommandError("email_monitoring made no progress, see the logs for errors")
+        elapsed = time.perf_counter() - started
+
+        tickets = Ticket.objects.filter(email_record__account_key=ACCOUNT_KEY)
+        linked = tickets.filter(duplicate_of__isnull=False).count()
+        comments = EmailTicket.objects.filter(account_key=ACCOUNT_KEY, ticket__isnull=True).count()
+        self.stdout.write(self.style.SUCCESS(
+            f"Ingested {total} email(s) in {elapsed:.2f} s over {runs} run(s): "
+            f"{total / elapsed:.1f} emails/sec"
+        ))
+        self.stdout.write(
+            f"Tickets: {tickets.count()} ({linked} linked duplicates), reply comments: {comments}, "
+            f"mails sent to the SMTP sink (welcome): {len(smtp_server.outbox)}"
+        )
+
+    # Fake ServiceNow numbers, then time the 'Ticket Created' replies
+    def run_replies(self, smtp_server):
+        tickets = list(
+            Ticket.objects.filter(email_record__account_key=ACCOUNT_KEY, servicenow_ticket_number__isnull=True)
+        )
+        for ticket in tickets:
+            ticket.servicenow_ticket_number = f"INC9{ticket.id:06d}"
+        Ticket.objects.bulk_update(tickets, ["servicenow_ticket_number"])
+
+        sent_before = len(smtp_server.outbox)
+        started = time.perf_counter()
+        # what process_ticket_task triggers per created incident, the outbox worker
+        # sends them once the queueing commits
+        send_ticket_replies([ticket.id for ticket in tickets])
+        elapsed = time.perf_counter() - started
+        sent = len(smtp_server.outbox) - sent_before
+        rate = sent / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {sent} repl(ies) in {elapsed:.2f} s: {rate:.1f} replies/sec"
+        ))
+
+    def cleanup(self):
+        emails = EmailTicket.objects.filter(account_key=ACCOUNT_KEY)
+        Ticket.objects.filter(email_record__in=emails).delete()
+        emails.delete()
+        OutboundEmail.objects.filter(account_key=ACCOUNT_KEY).delete()
+        MailboxState.objects.filter(account_key=ACCOUNT_KEY).delete()
+        User.objects.filter(email__iendswith=f"@{SENDER_DOMAIN}").delete()
+        RawEmailBlob.objects.filter(emails__isnull=True).delete()
+        self.stdout.write("Removed the generated tickets, emails and users")
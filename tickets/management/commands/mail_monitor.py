@@ -1,93 +1,80 @@
 import logging
+import threading
 import time
-from django.core.management.base import BaseCommand
-from imapclient import IMAPClient
-from django.conf import settings
-from email import message_from_bytes
-from email.utils import parseaddr
-from tickets.utils.extractmail import decode_header_value, get_email_body
-from tickets.views import email_ticket_create
-from django.contrib.auth import get_user_model
-from account.utils.emailuser import get_or_create_user_by_email
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from dashboard.utils.tasklock import task_lock
+from tickets.utils.mailbox import (
+    get_imap_account_keys,
+    get_mailbox_lock_key,
+    get_mailbox_lock_lease,
+    open_mailbox,
+    poll_mailbox,
+)
 
 logger = logging.getLogger(__name__)
-User = get_user_model()
 
 POLL_INTERVAL = 60  # seconds
 
 class Command(BaseCommand):
-    help = "Monitor inbox, create tickets, and send reply emails"
+    help = "Monitor inboxes, create tickets, and send reply emails"
 
-    account_key = "support"
-    accounts = getattr(settings, "EMAIL_ACCOUNTS", {})
-    config = accounts[account_key]
-    host = settings.EMAIL_IMAP_HOST
-    username = config["EMAIL_HOST_USER"]
-    password = config["EMAIL_HOST_PASSWORD"]
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--account",
+            action="append",
+            dest="accounts",
+            help="EMAIL_ACCOUNTS key to monitor (repeatable). Defaults to every IMAP-enabled account.",
+        )
 
     def handle(self, *args, **options):
-        self.stdout.write(self.style.SUCCESS("Starting mailbox monitor..."))
-
+        account_keys = options["accounts"] or get_imap_account_keys()
+        unknown = set(account_keys) - set(get_imap_account_keys())
+        if unknown:
+            raise CommandError(f"Not IMAP-enabled in EMAIL_ACCOUNTS: {', '.join(sorted(unknown))}")
+
+        self.stdout.write(self.style.SUCCESS(f"Starting mailbox monitor for {', '.join(account_keys)}..."))
+
+        # one thread per mailbox, each with its own connection, cursor and lock
+        threads = [
+            threading.Thread(target=self.monitor, args=(account_key,), name=f"mail-{account_key}", daemon=True)
+            for account_key in account_keys
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def monitor(self, account_key):
         while True:
             try:
-                with IMAPClient(self.host, ssl=True) as client:
-                    client.login(self.username, self.password)
-                    logger.info("Logged in to IMAP as %s", self.username)
-
+                with open_mailbox(account_key) as client:
                     # main polling loop for this connection
                     while True:
-                        client.select_folder("INBOX", readonly=False)
-
-                        uids = client.search(["UNSEEN"])
-                        logger.debug("Found %d unseen messages", len(uids))
-
-                        for uid in uids:
-                            data = client.fetch(uid, ["RFC822"])
-                            raw = data[uid][b"RFC822"]
-                            msg = message_from_bytes(raw)
-
-                            subject = decode_header_value(msg["Subject"])
-                            body = get_email_body(msg)
-                            sender = parseaddr(msg["From"])[1]
-
-                            self.stdout.write("\n" + "=" * 60)
-                            self.stdout.write(f"Processing email UID {uid}")
-                            self.stdout.write(f"From: {sender}")
-                            self.stdout.write(f"Subject: {subject}")
-
-                            user = User.objects.filter(email__iexact=sender).first()
-                            if not user:
-                                user, reset_url = get_or_create_user_by_email(
-                                    sender, True, self.account_key
-                                )
-
-                            ticket, email_ticket = email_ticket_create(
-                                email_uid=uid,
-                                sender=sender,
-                                subject=subject,
-                                body=body,
-                                raw_email=raw.decode("utf8", errors="replace"),
-                                user=User.objects.filter(email__iexact=sender).first(),
-                                account_key=self.account_key,
-                            )
-
-                            # Mark as seen
-                            client.add_flags(uid, [r"\Seen"])
-                            logger.info("Email UID %s marked as seen.", uid)
-                            self.stdout.write("=" * 60 + "\n")
-                            logger.info("Processed email UID %s.", uid)
+                        close_old_connections()
+                        lock_key = get_mailbox_lock_key(account_key)
+                        with task_lock(lock_key, get_mailbox_lock_lease()) as lock:
+                            if lock.acquired:
+                                summary = poll_mailbox(client, account_key)
+                                if summary["messages"]:
+                                    self.stdout.write(
+                                        f"[{account_key}] Processed {summary['messages']} email(s) into "
+                                        f"{summary['tickets']} ticket(s)"
+                                    )
 
                         logger.info(
-                            "Sleeping for POLL_INTERVAL - %s seconds before next check.",
+                            "[%s] Sleeping for POLL_INTERVAL - %s seconds before next check.",
+                            account_key,
                             POLL_INTERVAL,
                         )
                         time.sleep(POLL_INTERVAL)
 
             except Exception as e:
-                self.stderr.write(self.style.ERROR(f"Error: {e}"))
-                logger.error("Exception in monitoring loop: %s", str(e))
+                self.stderr.write(self.style.ERROR(f"[{account_key}] Error: {e}"))
+                logger.error("[%s] Exception in monitoring loop: %s", account_key, str(e))
                 logger.info(
-                    "Sleeping for POLL_INTERVAL - %s seconds after error.",
+                    "[%s] Sleeping for POLL_INTERVAL - %s seconds after error.",
+                    account_key,
                     POLL_INTERVAL,
                 )
                 time.sleep(POLL_INTERVAL)
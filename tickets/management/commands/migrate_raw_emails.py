@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from tickets.models import EmailTicket
+from tickets.utils.rawstore import prune_raw_email_blobs, store_raw_emails
+
+
+class Command(BaseCommand):
+    help = "Move inline EmailTicket.raw_email sources into the compressed raw email store"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the rows and bytes that would be moved.",
+        )
+        parser.add_argument(
+            "--vacuum",
+            action="store_true",
+            help="Delete orphaned raw email blobs and run VACUUM afterwards so SQLite returns the freed space.",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = max(1, options["chunk_size"])
+        pending = EmailTicket.objects.filter(raw_blob__isnull=True, raw_email__isnull=False).exclude(
+            raw_email=""
+        )
+        total = pending.count()
+        self.stdout.write(f"{total} email(s) with an inline raw source")
+        if options["dry_run"]:
+            return
+        if total:
+            self.move(pending, total, chunk_size)
+
+        if options["vacuum"]:
+            pruned = prune_raw_email_blobs()
+            self.stdout.write(f"Deleted {pruned} orphaned raw email blob(s)")
+            if connection.vendor == "sqlite":
+                self.stdout.write("Running VACUUM...")
+                with connection.cursor() as cursor:
+                    cursor.execute("VACUUM")
+
+    def move(self, pending, total, chunk_size):
+        moved = 0
+        raw_bytes = 0
+        last_pk = 0
+        while True:
+            # keyset pagination so every chunk is a cheap indexed range scan
+            rows = list(
+                pending.filter(pk__gt=last_pk).order_by("pk").values_list("pk", "raw_email")[:chunk_size]
+            )
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+
+            with transaction.atomic():
+                blob_ids = store_raw_emails([raw for _, raw in rows])
+                emails = [
+                    EmailTicket(pk=pk, raw_blob_id=blob_id, raw_email=None)
+                    for (pk, _), blob_id in zip(rows, blob_ids)
+                ]
+                EmailTicket.objects.bulk_update(emails, ["raw_blob", "raw_email"])
+
+            moved += len(rows)
+            raw_bytes += sum(len(raw.encode("utf-8")) for _, raw in rows)
+            self.stdout.write(f"Moved {moved}/{total} (up to id {last_pk})")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Moved {moved} raw email(s), {raw_bytes // 1024} KB uncompressed")
+        )
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 from servicenow.models import AssignmentGroup
 
@@ -27,6 +28,7 @@ class Ticket(models.Model):
         ("created", "Created"),
         ("failed", "Failed"),
         ("retrying", "Retrying"),
+        ("linked", "Linked"),
     ]
     PRIORITY_CHOICES = [
         ("critical","Critical"),
@@ -54,35 +56,116 @@ class Ticket(models.Model):
     ticket_creation_status = models.CharField(
         max_length=20, choices=STATUS_CHOICES, default="pending"
     )
-    servicenow_ticket_number = models.CharField(max_length=100, blank=True, null=True)
+    servicenow_ticket_number = models.CharField(
+        max_length=100, blank=True, null=True, db_index=True
+    )
     servicenow_ticket_status = models.CharField(
         max_length=100, blank=True, default="queued"
     )
-    servicenow_sys_id = models.CharField(max_length=100, blank=True, null=True)
+    servicenow_sys_id = models.CharField(max_length=100, blank=True, null=True, db_index=True)
+    servicenow_updated_on = models.DateTimeField(
+        null=True, blank=True, help_text="sys_updated_on of the incident state last applied"
+    )
     assignment_group_id = models.CharField(
         max_length=100, blank=True, null=True
     )  
     sync_attempts = models.IntegerField(default=0)
     last_sync_attempt = models.DateTimeField(null=True, blank=True)
+    # ServiceNow creation claim: the worker holding it until sync_claimed_until owns the ticket
+    sync_claimed_by = models.CharField(max_length=64, blank=True, default="")
+    sync_claimed_until = models.DateTimeField(null=True, blank=True)
+    next_sync_attempt_at = models.DateTimeField(
+        null=True, blank=True, help_text="Earliest retry of a failed ServiceNow creation"
+    )
     error_message = models.TextField(blank=True, null=True)
     request_type = models.CharField(
         max_length=20, choices=[("web", "Web"), ("email", "Email")], default="web"
     )
+    # near-duplicate of an open ticket: shares its ServiceNow incident
+    duplicate_of = models.ForeignKey(
+        "self",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="duplicates",
+    )
+    similarity_score = models.FloatField(null=True, blank=True)
+    embedding = models.BinaryField(
+        null=True, blank=True, editable=False, help_text="float32 text embedding"
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["ticket_creation_status", "next_sync_attempt_at"], name="ticket_sync_due_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"Issue: {self.title} - Ticket: {self.servicenow_ticket_number} - Status: {self.ticket_creation_status} - Category:{self.category}"
 
+# Compressed raw email source, shared by identical messages (sha256 of the source)
+class RawEmailBlob(models.Model):
+    CODEC_CHOICES = [
+        ("zlib", "zlib"),
+        ("zstd", "zstd"),
+    ]
+
+    digest = models.CharField(max_length=64, unique=True)
+    codec = models.CharField(max_length=10, choices=CODEC_CHOICES, default="zlib")
+    data = models.BinaryField()
+    size = models.PositiveIntegerField(default=0, help_text="Uncompressed size in bytes")
+    compressed_size = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.digest[:12]} ({self.codec}, {self.compressed_size}/{self.size} bytes)"
+
+
 # Email ticket model 
 class EmailTicket(models.Model):
     uid = models.CharField(
-        max_length=255, unique=True, help_text="Unique email message id / UID from IMAP"
+        max_length=255, help_text="Unique email message id / UID from IMAP"
+    )
+    account_key = models.CharField(
+        max_length=50, default="support", help_text="EMAIL_ACCOUNTS key of the intake mailbox"
     )
     sender = models.EmailField(blank=True, null=True)
     subject = models.CharField(max_length=255, blank=True, null=True)
     body = models.TextField(blank=True, null=True)
+    # legacy inline source, new emails are stored compressed in raw_blob
     raw_email = models.TextField(blank=True, null=True)
+    raw_blob = models.ForeignKey(
+        RawEmailBlob,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="emails",
+    )
+    attachments = models.JSONField(
+        default=list, blank=True, help_text="Attachment metadata (filename, content type, size)"
+    )
+    message_id = models.CharField(
+        max_length=255, blank=True, default="", db_index=True, help_text="Message-ID header"
+    )
+    in_reply_to = models.CharField(
+        max_length=255, blank=True, default="", help_text="In-Reply-To header"
+    )
     received_at = models.DateTimeField(auto_now_add=True)
     reply_sent = models.BooleanField(default=False)
+    reply_message_id = models.CharField(
+        max_length=255,
+        blank=True,
+        default="",
+        db_index=True,
+        help_text="Message-ID of the 'Ticket Created' reply sent for this email",
+    )
+    reply_error = models.CharField(
+        max_length=255,
+        blank=True,
+        default="",
+        help_text="Why the reply could not be built; clear it to retry",
+    )
 
     # Link to Ticket: one-to-one (email -> ticket)
     ticket = models.OneToOneField(
@@ -91,16 +174,128 @@ class EmailTicket(models.Model):
         related_name="email_record",
         null=True,
         blank=True,
-        help_text="Related Ticket created from this email",
+        help_text="Related Ticket created from this email, empty for replies",
     )
 
     class Meta:
         ordering = ["-received_at"]
         indexes = [
             models.Index(fields=["uid"]),
+            # only emails still waiting for their reply, keeps the sweeper cheap
+            models.Index(
+                fields=["received_at"],
+                condition=models.Q(reply_sent=False, reply_message_id="", reply_error=""),
+                name="email_reply_pending_idx",
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["account_key", "uid"], name="unique_email_uid_per_mailbox"
+            ),
         ]
 
+    # Raw source, decompressed on demand (one query for the blob)
+    def get_raw_email(self):
+        if self.raw_blob_id:
+            from tickets.utils.rawstore import load_raw_email
+
+            return load_raw_email(self.raw_blob)
+        return self.raw_email or ""
+
     def __str__(self):
         # show subject or fallback to uid
         return f"{self.subject or self.uid} - {self.sender or '-'} "
-    
\ No newline at end of file
+
+
+# Follow-up on an existing ticket, e.g. an email reply in the ticket thread
+class TicketComment(models.Model):
+    SOURCE_CHOICES = [
+        ("email", "Email"),
+        ("web", "Web"),
+    ]
+
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name="comments")
+    author = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name="ticket_comments"
+    )
+    body = models.TextField()
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default="email")
+    email_record = models.OneToOneField(
+        EmailTicket,
+        on_delete=models.SET_NULL,
+        related_name="comment",
+        null=True,
+        blank=True,
+        help_text="Reply email this comment was created from",
+    )
+    servicenow_synced = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["created_at"]
+
+    def __str__(self):
+        return f"Comment on ticket #{self.ticket_id} by {self.author or 'System'}"
+
+
+# Outgoing email written in the same transaction as the change that triggers it,
+# sent later by the send_outbound_emails worker
+class OutboundEmail(models.Model):
+    KIND_CHOICES = [
+        ("reply", "Ticket reply"),
+        ("verification", "Email verification"),
+        ("password_reset", "Password reset"),
+        ("welcome", "Welcome"),
+        ("other", "Other"),
+    ]
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("sent", "Sent"),
+        ("failed", "Failed"),
+    ]
+
+    account_key = models.CharField(max_length=50, help_text="EMAIL_ACCOUNTS key used to send")
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default="other")
+    to_email = models.EmailField()
+    subject = models.CharField(max_length=255)
+    text_body = models.TextField()
+    html_body = models.TextField(blank=True, default="")
+    headers = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    email_ticket = models.ForeignKey(
+        EmailTicket,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="outbound_emails",
+        help_text="Email ticket this reply answers",
+    )
+    user = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name="outbound_emails"
+    )
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"], name="outbox_due_idx"),
+            models.Index(fields=["account_key", "sent_at"], name="outbox_account_sent_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} to {self.to_email} ({self.status})"
+
+
+# Per-mailbox polling state: UID cursor of the last processed message
+class MailboxState(models.Model):
+    account_key = models.CharField(max_length=50, unique=True)
+    uid_validity = models.BigIntegerField(null=True, blank=True)
+    last_uid = models.BigIntegerField(default=0)
+    last_polled_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.account_key} (last UID {self.last_uid})"
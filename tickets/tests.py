@@ -1,3 +1,156 @@
-from django.test import TestCase
+import base64
+import numpy as np
+from django.test import SimpleTestCase, TestCase
+from imapclient.response_types import BodyData
+from ai.utils import similarity
+from ai.utils.similarity import find_duplicates, to_embedding_bytes
+from tickets.models import Ticket
+from tickets.utils.imapfetch import _decode_section, _plan_from_bodystructure
 
-# Create your tests here.
+
+# BODYSTRUCTURE leaf of a text part: type, subtype, params, id, description,
+# encoding, size, lines, md5, disposition
+def text_part(subtype, size=100, charset=b"utf-8", encoding=b"7bit", disposition=None):
+    return (b"text", subtype, (b"charset", charset), None, None, encoding, size, 3, None, disposition)
+
+
+# Leaf of a non-text part, the disposition comes right after the md5
+def file_part(ctype, subtype, filename, size=2048):
+    return (
+        ctype, subtype, (b"name", filename), None, None, b"base64", size, None,
+        (b"attachment", (b"filename", filename)),
+    )
+
+
+def multipart(subtype, *parts):
+    return tuple(parts) + (subtype, None, None, None)
+
+
+class BodyStructurePlanTests(SimpleTestCase):
+    def test_single_text_part(self):
+        text, attachments = _plan_from_bodystructure(BodyData.create(text_part(b"plain")))
+        self.assertEqual(text["section"], "1")
+        self.assertEqual(text["subtype"], "plain")
+        self.assertEqual(attachments, [])
+
+    def test_alternative_prefers_plain(self):
+        structure = BodyData.create(multipart(b"alternative", text_part(b"html"), text_part(b"plain")))
+        text, attachments = _plan_from_bodystructure(structure)
+        self.assertEqual(text["section"], "2")
+        self.assertEqual(text["subtype"], "plain")
+        self.assertEqual(attachments, [])
+
+    def test_html_only_falls_back_to_html(self):
+        structure = BodyData.create(multipart(b"alternative", text_part(b"html")))
+        text, _ = _plan_from_bodystructure(structure)
+        self.assertEqual(text["subtype"], "html")
+
+    def test_nested_multipart_with_attachment(self):
+        structure = BodyData.create(
+            multipart(
+                b"mixed",
+                multipart(b"alternative", text_part(b"plain", size=42), text_part(b"html")),
+                file_part(b"application", b"pdf", b"report.pdf", size=5000),
+            )
+        )
+        text, attachments = _plan_from_bodystructure(structure)
+        self.assertEqual(text["section"], "1.1")
+        self.assertEqual(text["size"], 42)
+        self.assertEqual(attachments, [{
+            "filename": "report.pdf",
+            "content_type": "application/pdf",
+            "size": 5000,
+            "section": "2",
+        }])
+
+    def test_text_attachment_is_not_the_body(self):
+        structure = BodyData.create(
+            multipart(
+                b"mixed",
+                text_part(b"plain"),
+                text_part(b"plain", disposition=(b"attachment", (b"filename", b"log.txt"))),
+            )
+        )
+        text, attachments = _plan_from_bodystructure(structure)
+        self.assertEqual(text["section"], "1")
+        self.assertEqual([a["filename"] for a in attachments], ["log.txt"])
+        self.assertEqual(attachments[0]["content_type"], "text/plain")
+
+    def test_attachment_only(self):
+        text, attachments = _plan_from_bodystructure(
+            BodyData.create(file_part(b"image", b"png", b"screen.png"))
+        )
+        self.assertIsNone(text)
+        self.assertEqual(attachments[0]["section"], "1")
+
+
+class DecodeSectionTests(SimpleTestCase):
+    def part(self, encoding, charset="utf-8"):
+        return {"section": "1", "encoding": encoding, "charset": charset}
+
+    def test_base64(self):
+        payload = base64.encodebytes("Drucker defekt, bitte prüfen".encode("utf-8"))
+        self.assertEqual(_decode_section(payload, self.part("base64")), "Drucker defekt, bitte prüfen")
+
+    def test_truncated_base64_drops_the_partial_quantum(self):
+        payload = base64.b64encode(b"VPN is down again")[:-3]
+        self.assertEqual(_decode_section(payload, self.part("base64")), "VPN is down aga")
+
+    def test_invalid_base64_is_empty(self):
+        self.assertEqual(_decode_section(b"@@@@", self.part("base64")), "")
+
+    def test_quoted_printable_with_charset(self):
+        payload = b"Caf=E9 printer=\r\n jammed"
+        self.assertEqual(_decode_section(payload, self.part("quoted-printable", "iso-8859-1")), "Café printer jammed")
+
+    def test_unknown_charset_falls_back_to_utf8(self):
+        self.assertEqual(_decode_section("héllo".encode("utf-8"), self.part("7bit", "x-unknown")), "héllo")
+
+
+def unit(*values):
+    vector = np.zeros(8, dtype=np.float32)
+    vector[:len(values)] = values
+    return vector / np.linalg.norm(vector)
+
+
+class FindDuplicatesTests(TestCase):
+    def setUp(self):
+        # the index is per process and would keep tickets of earlier tests
+        similarity._index = None
+
+    def create_ticket(self, vector, **fields):
+        return Ticket.objects.create(
+            title="VPN down", description="d", category="network", priority="high",
+            embedding=to_embedding_bytes(vector), **fields
+        )
+
+    def test_new_incidents_have_no_parent(self):
+        self.assertEqual(find_duplicates([unit(1), unit(0, 1)], threshold=0.9), [None, None])
+
+    def test_storm_inside_one_batch_links_to_the_first_row(self):
+        matches = find_duplicates([unit(1), unit(0, 1), unit(1, 0.1)], threshold=0.9)
+        self.assertIsNone(matches[0])
+        self.assertIsNone(matches[1])
+        self.assertEqual(matches[2]["batch_row"], 0)
+        self.assertIsNone(matches[2]["ticket_id"])
+
+    def test_matches_a_recent_open_ticket(self):
+        parent = self.create_ticket(unit(1))
+        matches = find_duplicates([unit(1, 0.05), unit(0, 1)], threshold=0.9)
+        self.assertEqual(matches[0]["ticket_id"], parent.id)
+        self.assertGreaterEqual(matches[0]["score"], 0.9)
+        self.assertIsNone(matches[1])
+
+    def test_recent_ticket_wins_over_the_batch(self):
+        parent = self.create_ticket(unit(1))
+        matches = find_duplicates([unit(1), unit(1)], threshold=0.9)
+        self.assertEqual([match["ticket_id"] for match in matches], [parent.id, parent.id])
+
+    def test_closed_and_linked_tickets_are_not_parents(self):
+        closed = self.create_ticket(unit(1), servicenow_ticket_status="Closed")
+        self.create_ticket(unit(0, 1), duplicate_of=closed)
+        self.assertEqual(find_duplicates([unit(1), unit(0, 1)], threshold=0.9), [None, None])
+
+    def test_below_threshold_is_a_new_incident(self):
+        self.create_ticket(unit(1))
+        self.assertEqual(find_duplicates([unit(1, 1)], threshold=0.9), [None])
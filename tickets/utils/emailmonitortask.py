@@ -1,74 +1,35 @@
 import logging
 from celery import shared_task
-from django.contrib.auth import get_user_model
-from django.conf import settings
-from imapclient import IMAPClient
-from email import message_from_bytes
-from email.utils import parseaddr
-from tickets.utils.extractmail import decode_header_value, get_email_body
-from tickets.views import email_ticket_create
-from account.utils.emailuser import get_or_create_user_by_email
+from dashboard.utils.tasklock import singleton_task
+from tickets.utils.mailbox import (
+    MAILBOX_LOCK_KEY, get_imap_account_keys, get_mailbox_lock_lease, open_mailbox, poll_mailbox,
+)
 
 logger = logging.getLogger(__name__)
-User = get_user_model()
 
 
 @shared_task
-def email_monitoring():
-    """ Monitor inbox, create tickets, and send reply emails """
-    account_key = "support"
-    accounts = getattr(settings, "EMAIL_ACCOUNTS", {})
-    config = accounts[account_key]
-    host = settings.EMAIL_IMAP_HOST
-    username = config["EMAIL_HOST_USER"]
-    password = config["EMAIL_HOST_PASSWORD"]
+@singleton_task(name="email_monitoring", lease=60)
+def email_monitoring(dispatch=True):
+    """ Queue one independent monitor task per IMAP-enabled mailbox """
+    account_keys = get_imap_account_keys()
+    logger.info(f"Started the mail monitoring for mailboxes {account_keys}...")
+    for account_key in account_keys:
+        monitor_mailbox.delay(account_key, dispatch=dispatch)
 
-    logger.info("Started the mail monitoring...")
 
+@shared_task
+@singleton_task(key=MAILBOX_LOCK_KEY, lease=get_mailbox_lock_lease)
+def monitor_mailbox(account_key, dispatch=True):
+    """ Monitor one inbox, create tickets, and send reply emails """
     try:
-        with IMAPClient(host, ssl=True) as client:
-            client.login(username, password)
-            logger.info("Logged in to IMAP as %s", username)
-
-            client.select_folder("INBOX", readonly=False)
-            uids = client.search(["UNSEEN"])
-            logger.debug("Found %d unseen messages", len(uids))
-
-            for uid in uids:
-                data = client.fetch(uid, ["RFC822"])
-                raw = data[uid][b"RFC822"]
-                msg = message_from_bytes(raw)
-
-                subject = decode_header_value(msg["Subject"])
-                body = get_email_body(msg)
-                sender = parseaddr(msg["From"])[1]
-
-                logger.debug("\n" + "=" * 60)
-                logger.debug(f"Processing email UID {uid}")
-                logger.debug(f"From: {sender}")
-                logger.debug(f"Subject: {subject}")
-
-                user = User.objects.filter(email__iexact=sender).first()
-                if not user:
-                    user, reset_url = get_or_create_user_by_email(
-                        sender, True, account_key
-                    )
-
-                ticket, email_ticket = email_ticket_create(
-                    email_uid=uid,
-                    sender=sender,
-                    subject=subject,
-                    body=body,
-                    raw_email=raw.decode("utf8", errors="replace"),
-                    user=User.objects.filter(email__iexact=sender).first(),
-                    account_key=account_key,
-                )
-
-                # Mark as seen
-                client.add_flags(uid, [r"\Seen"])
-                logger.info("Email UID %s marked as seen.", uid)
-                logger.info("Processed email UID %s.", uid)
+        with open_mailbox(account_key) as client:
+            summary = poll_mailbox(client, account_key, dispatch=dispatch)
+        logger.info(
+            f"[{account_key}] Mail monitoring finished: {summary['messages']} message(s), "
+            f"{summary['tickets']} ticket(s)"
+        )
+        return summary
 
     except Exception as e:
-        logger.error("Exception in monitoring loop: %s", str(e))
-
+        logger.error("[%s] Exception in monitoring loop: %s", account_key, str(e))
@@ -0,0 +1,276 @@
+import logging
+import time
+from contextlib import contextmanager
+from celery import group
+from django.conf import settings
+from django.db import connection, transaction
+from ai.utils.embeddings import get_embeddings
+from ai.utils.similarity import find_duplicates, to_embedding_bytes
+from ai.views import predict_ticket_batch
+from account.utils.emailuser import resolve_user_ids_by_email
+from servicenow.models import AssignmentGroup
+from servicenow.utils.task import push_ticket_comment_task, queue_servicenow_creation
+from tickets.models import Ticket, EmailTicket
+from tickets.utils.emailthread import insert_comments, match_reply_tickets
+from tickets.utils.imapfetch import fetch_emails
+from tickets.utils.rawstore import store_raw_emails
+from tickets.utils.task import send_ticket_replies
+
+"""Staged pipeline turning a chunk of IMAP messages into tickets.
+
+Stages: fetch -> thread replies -> resolve senders -> classify -> dedupe -> insert -> dispatch.
+Replies to existing tickets skip classification and become comments, near
+duplicates of an open ticket are linked to it instead of reaching ServiceNow.
+Every stage works on the whole chunk so the number of queries, inference
+calls and broker round trips does not grow with the number of messages.
+"""
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATEGORY = "application"
+DEFAULT_PRIORITY = "high"
+
+
+def get_batch_size():
+    return max(1, int(getattr(settings, "EMAIL_BATCH_SIZE", 50)))
+
+
+# Split UIDs into chunks of the configured batch size
+def chunked(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+@contextmanager
+def _timed(timings, stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = round((time.perf_counter() - started) * 1000, 2)
+
+
+# Run the whole pipeline for one chunk of UIDs and mark them as seen
+def process_email_chunk(client, uids, account_key, dispatch=True):
+    timings = {}
+    uids = list(uids)
+
+    with _timed(timings, "fetch"):
+        fetched = fetch_emails(client, uids)
+        existing = set(
+            EmailTicket.objects.filter(
+                account_key=account_key, uid__in=[str(uid) for uid in fetched]
+            ).values_list("uid", flat=True)
+        )
+        emails = [fetched[uid] for uid in uids if uid in fetched and str(uid) not in existing]
+        if existing:
+            logger.debug(f"Skipping {len(existing)} already processed email(s): {sorted(existing)}")
+
+    with _timed(timings, "thread"):
+        reply_tickets = match_reply_tickets(emails)
+        replies = [email for email in emails if email.uid in reply_tickets]
+        emails = [email for email in emails if email.uid not in reply_tickets]
+
+    with _timed(timings, "resolve"):
+        user_ids = resolve_user_ids_by_email(
+            [email.sender for email in emails + replies], account_key
+        )
+
+    with _timed(timings, "classify"):
+        predictions, embeddings = classify_emails(emails)
+
+    with _timed(timings, "dedupe"):
+        duplicates = find_email_duplicates(embeddings)
+
+    with _timed(timings, "insert"):
+        tickets = insert_tickets(
+            emails, predictions, user_ids, account_key,
+            embeddings=embeddings, duplicates=duplicates,
+        )
+        comments = insert_comments(replies, reply_tickets, user_ids, account_key)
+
+    # only mark as seen once the tickets are committed; messages IMAP returned
+    # no data for stay unseen so the next poll retries them
+    missing = [uid for uid in uids if uid not in fetched]
+    if missing:
+        logger.warning(f"[{account_key}] No data for email UIDs {missing}, leaving them unseen")
+    if fetched:
+        client.add_flags([uid for uid in uids if uid in fetched], [r"\Seen"])
+
+    with _timed(timings, "dispatch"):
+        if dispatch:
+            dispatch_tickets(tickets)
+            dispatch_comments(comments)
+
+    total = round(sum(timings.values()), 2)
+    logger.info(
+        f"Email chunk processed: {len(uids)} message(s), {len(tickets)} ticket(s), "
+        f"{len(comments)} comment(s) in {total} ms "
+        + " ".join(f"{stage}={ms}ms" for stage, ms in timings.items())
+    )
+    return {
+        "messages": len(uids),
+        "missing": missing,
+        "tickets": tickets,
+        "comments": comments,
+        "timings": timings,
+        "total_ms": total,
+    }
+
+
+# Classify all emails of the chunk in one batched inference call
+def classify_emails(emails):
+    if not emails:
+        return [], None
+    texts = [f"{email.subject} {email.body}" for email in emails]
+    embeddings = None
+    try:
+        embeddings = get_embeddings(texts)
+        predictions = predict_ticket_batch(texts, embeddings=embeddings)
+    except Exception as e:
+        logger.error(f"Batched ML prediction failed: {e}")
+        return [
+            {
+                "category": DEFAULT_CATEGORY,
+                "category_confidence": 0,
+                "priority": DEFAULT_PRIORITY,
+                "priority_confidence": 0,
+            }
+            for _ in emails
+        ], embeddings
+
+    for prediction in predictions:
+        prediction["category"] = prediction["category"].strip().lower() or DEFAULT_CATEGORY
+        prediction["category_confidence"] = round(prediction["category_confidence"], 4) * 100
+        prediction["priority_confidence"] = round(prediction["priority_confidence"], 4) * 100
+    return predictions, embeddings
+
+
+# Match the chunk against the recent ticket index, None per email without a parent
+def find_email_duplicates(embeddings):
+    if embeddings is None or not len(embeddings):
+        return []
+    if not getattr(settings, "DUPLICATE_DETECTION_ENABLED", True):
+        return [None] * len(embeddings)
+    try:
+        return find_duplicates(embeddings)
+    except Exception as e:
+        logger.error(f"Duplicate detection failed, creating all tickets: {e}")
+        return [None] * len(embeddings)
+
+
+# Create Ticket and EmailTicket rows for the chunk in one transaction
+def insert_tickets(emails, predictions, user_ids, account_key, embeddings=None, duplicates=None):
+    if not emails:
+        return []
+    duplicates = duplicates or [None] * len(emails)
+
+    categories = {prediction["category"] for prediction in predictions}
+    groups = {
+        group.category: group
+        for group in AssignmentGroup.objects.filter(category__in=categories)
+    }
+
+    parent_ids = {match["ticket_id"] for match in duplicates if match and match["ticket_id"]}
+    parents = Ticket.objects.in_bulk(parent_ids) if parent_ids else {}
+
+    tickets = []
+    for index, (email, prediction) in enumerate(zip(emails, predictions)):
+        group_obj = groups.get(prediction["category"])
+        tickets.append(
+            Ticket(
+                title=email.subject[:200] if email.subject else "No subject",
+                description=email.body or "",
+                category=prediction["category"],
+                category_confidence=prediction["category_confidence"],
+                priority=prediction["priority"],
+                priority_confidence=prediction["priority_confidence"],
+                assigned_team=group_obj,
+                assignment_group_id=group_obj.servicenow_group_id if group_obj else None,
+                created_by_id=user_ids.get(email.sender.lower()) if email.sender else None,
+                request_type="email",
+                ticket_creation_status="pending",
+                embedding=(
+                    to_embedding_bytes(embeddings[index]) if embeddings is not None else None
+                ),
+            )
+        )
+        match = duplicates[index]
+        if match:
+            _link_duplicate(tickets[-1], parents.get(match["ticket_id"]), match["score"])
+
+    with transaction.atomic():
+        if connection.features.can_return_rows_from_bulk_insert:
+            tickets = Ticket.objects.bulk_create(tickets)
+        else:
+            for ticket in tickets:
+                ticket.save()
+
+        # duplicates of a ticket created in this same chunk
+        batch_linked = []
+        for ticket, match in zip(tickets, duplicates):
+            if match and match["batch_row"] is not None:
+                ticket.duplicate_of = tickets[match["batch_row"]]
+                batch_linked.append(ticket)
+        if batch_linked:
+            Ticket.objects.bulk_update(batch_linked, ["duplicate_of"])
+
+        blob_ids = store_raw_emails([email.raw_email for email in emails])
+        EmailTicket.objects.bulk_create([
+            EmailTicket(
+                uid=str(email.uid),
+                account_key=account_key,
+                sender=email.sender,
+                subject=email.subject[:255] if email.subject else email.subject,
+                body=email.body,
+                raw_blob_id=blob_id,
+                attachments=email.attachments,
+                message_id=email.message_id,
+                in_reply_to=email.in_reply_to,
+                ticket=ticket,
+            )
+            for email, ticket, blob_id in zip(emails, tickets, blob_ids)
+        ])
+
+    logger.debug(f"Created tickets {[ticket.id for ticket in tickets]} from email chunk")
+    return tickets
+
+
+# Mark a new ticket as a duplicate sharing its parent's ServiceNow incident
+def _link_duplicate(ticket, parent, score):
+    ticket.duplicate_of = parent
+    ticket.similarity_score = round(score, 4)
+    ticket.ticket_creation_status = "linked"
+    if parent is not None:
+        ticket.servicenow_ticket_number = parent.servicenow_ticket_number
+        ticket.servicenow_ticket_status = parent.servicenow_ticket_status
+
+
+# Queue ServiceNow creation for the chunk as batch tasks
+def dispatch_tickets(tickets):
+    if not tickets:
+        return
+    new_ids = [ticket.id for ticket in tickets if not ticket.duplicate_of_id]
+    linked = [ticket.id for ticket in tickets if ticket.duplicate_of_id]
+    if linked:
+        logger.info(f"Tickets {linked} linked to existing incidents, not sent to ServiceNow")
+    # duplicates of an incident that already exists can be answered immediately
+    numbered = [ticket.id for ticket in tickets if ticket.duplicate_of_id and ticket.servicenow_ticket_number]
+    try:
+        if new_ids:
+            queue_servicenow_creation(new_ids)
+        if numbered:
+            send_ticket_replies.delay(numbered)
+    except Exception as e:
+        logger.error(f"Failed to dispatch tasks for tickets {[t.id for t in tickets]}: {e}")
+
+
+# Queue the ServiceNow comment update for every new comment
+def dispatch_comments(comments):
+    if not comments:
+        return
+    try:
+        group(push_ticket_comment_task.s(comment.id) for comment in comments).apply_async()
+    except Exception as e:
+        logger.error(f"Failed to dispatch comments {[c.id for c in comments]}: {e}")
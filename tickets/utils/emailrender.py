@@ -0,0 +1,60 @@
+import logging
+from functools import lru_cache
+from django.conf import settings
+from django.dispatch import receiver
+from django.template import Context
+from django.template.loader import get_template
+from django.utils.autoreload import file_changed
+
+"""Email rendering with the subject, text and HTML templates compiled once per process.
+
+get_email_templates() returns a cached EmailTemplates for a template triple;
+render() and render_many() reuse one Context for every message instead of
+resolving and wrapping the templates on each render_to_string call.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class EmailTemplates:
+    def __init__(self, subject_template, text_template, html_template=None):
+        subject = get_template(subject_template)
+        self.autoescape = subject.backend.engine.autoescape
+        # the compiled django.template.base.Template behind the backend wrapper
+        self.subject = subject.template
+        self.text = get_template(text_template).template
+        self.html = get_template(html_template).template if html_template else None
+
+    # (subject, text body, html body) for one context
+    def render(self, context):
+        return self.render_many([context])[0]
+
+    # (subject, text body, html body) per context, in the same order
+    def render_many(self, contexts):
+        rendered = []
+        context = Context(autoescape=self.autoescape)
+        for values in contexts:
+            with context.push(values):
+                rendered.append((
+                    self.subject.render(context).strip(),
+                    self.text.render(context),
+                    self.html.render(context) if self.html else "",
+                ))
+        return rendered
+
+
+@lru_cache(maxsize=64)
+def get_email_templates(subject_template, text_template, html_template=None):
+    logger.debug(f"Compiling email templates {subject_template}, {text_template}, {html_template}")
+    return EmailTemplates(subject_template, text_template, html_template)
+
+
+def render_email(subject_template, text_template, html_template, context):
+    return get_email_templates(subject_template, text_template, html_template).render(context)
+
+
+# Edited templates are picked up by the dev server without a restart
+@receiver(file_changed, dispatch_uid="email_templates_changed")
+def clear_email_templates(sender, file_path, **kwargs):
+    if settings.DEBUG and file_path.suffix in (".txt", ".html"):
+        get_email_templates.cache_clear()
@@ -0,0 +1,131 @@
+import logging
+import re
+from django.db import connection, transaction
+from django.db.models import Q
+from tickets.models import EmailTicket, Ticket, TicketComment
+from tickets.utils.extractmail import strip_quoted_reply
+from tickets.utils.rawstore import store_raw_emails
+
+"""Utility functions for threading inbound emails onto the tickets they reply to."""
+
+logger = logging.getLogger(__name__)
+
+# ServiceNow incident numbers as used in the "Ticket Created" reply subject
+TICKET_NUMBER_RE = re.compile(r"\b(INC\d{7,})\b", re.IGNORECASE)
+
+
+def find_ticket_numbers(subject):
+    return [number.upper() for number in TICKET_NUMBER_RE.findall(subject or "")]
+
+
+# Map the replies of a chunk to their ticket id: uid -> ticket id
+def match_reply_tickets(emails):
+    by_message_id = _tickets_by_message_id(
+        {message_id for email in emails for message_id in email.thread_ids}
+    )
+    by_number = _tickets_by_number(
+        {number for email in emails for number in find_ticket_numbers(email.subject)}
+    )
+
+    matches = {}
+    for email in emails:
+        ticket_id = next(
+            (by_message_id[mid] for mid in email.thread_ids if mid in by_message_id), None
+        )
+        if ticket_id is None:
+            # a ticket number in the subject only counts for the original requester
+            sender = (email.sender or "").lower()
+            for number in find_ticket_numbers(email.subject):
+                ticket_id = by_number.get(number, {}).get(sender) if sender else None
+                if ticket_id is not None:
+                    break
+        if ticket_id is not None:
+            matches[email.uid] = ticket_id
+    if matches:
+        logger.debug(f"Threaded {len(matches)} email(s) onto existing tickets: {matches}")
+    return matches
+
+
+# Look up the ticket of every known Message-ID in one indexed query
+def _tickets_by_message_id(message_ids):
+    if not message_ids:
+        return {}
+    rows = EmailTicket.objects.filter(
+        Q(message_id__in=message_ids) | Q(reply_message_id__in=message_ids)
+    ).values_list("message_id", "reply_message_id", "ticket_id", "comment__ticket_id")
+
+    tickets = {}
+    for message_id, reply_message_id, ticket_id, comment_ticket_id in rows:
+        ticket_id = ticket_id or comment_ticket_id
+        if ticket_id is None:
+            continue
+        for mid in (message_id, reply_message_id):
+            if mid in message_ids:
+                tickets[mid] = ticket_id
+    return tickets
+
+
+# Look up tickets by ServiceNow number: number -> {requester email: ticket id}.
+# Linked duplicates share the number, so each requester maps to their own ticket.
+def _tickets_by_number(numbers):
+    if not numbers:
+        return {}
+    rows = Ticket.objects.filter(servicenow_ticket_number__in=numbers).values_list(
+        "id", "servicenow_ticket_number", "email_record__sender", "created_by__email"
+    )
+    tickets = {}
+    for ticket_id, number, email_sender, user_email in rows:
+        requesters = tickets.setdefault(number.upper(), {})
+        for value in (email_sender, user_email):
+            if value:
+                requesters.setdefault(value.lower(), ticket_id)
+    return tickets
+
+
+# Store the replies as EmailTicket records and comments on their tickets
+def insert_comments(replies, reply_tickets, user_ids, account_key):
+    if not replies:
+        return []
+
+    with transaction.atomic():
+        blob_ids = store_raw_emails([email.raw_email for email in replies])
+        records = [
+            EmailTicket(
+                uid=str(email.uid),
+                account_key=account_key,
+                sender=email.sender,
+                subject=email.subject[:255] if email.subject else email.subject,
+                body=email.body,
+                raw_blob_id=blob_id,
+                attachments=email.attachments,
+                message_id=email.message_id,
+                in_reply_to=email.in_reply_to,
+            )
+            for email, blob_id in zip(replies, blob_ids)
+        ]
+        if connection.features.can_return_rows_from_bulk_insert:
+            records = EmailTicket.objects.bulk_create(records)
+        else:
+            for record in records:
+                record.save()
+
+        comments = [
+            TicketComment(
+                ticket_id=reply_tickets[email.uid],
+                author_id=user_ids.get(email.sender.lower()) if email.sender else None,
+                body=strip_quoted_reply(email.body),
+                source="email",
+                email_record=record,
+            )
+            for email, record in zip(replies, records)
+        ]
+        if connection.features.can_return_rows_from_bulk_insert:
+            comments = TicketComment.objects.bulk_create(comments)
+        else:
+            for comment in comments:
+                comment.save()
+
+    logger.debug(
+        f"Added {len(comments)} email comment(s) to tickets {sorted(set(reply_tickets.values()))}"
+    )
+    return comments
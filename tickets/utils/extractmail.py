@@ -1,6 +1,8 @@
 import logging
 import re
 from email.header import decode_header
+from html.parser import HTMLParser
+from django.conf import settings
 
 """Utility functions for extracting and decoding email content."""
 
@@ -18,16 +20,98 @@ def decode_header_value(value):
             decoded += part.decode(enc or "utf-8", errors="ignore")
         else:
             decoded += part
+    # unfold long headers, a CRLF inside a Subject breaks the reply headers
+    decoded = re.sub(r"\r?\n[ \t]*", " ", decoded)
     logger.debug(f"Decoded header value: {decoded}")
     return decoded
 
-# Removes HTML tags from the email body to extract plain text.
-def strip_html_tags(html):
+HTML_FEED_SIZE = 16 * 1024
+
+# tags whose content is never shown to the reader
+HTML_SKIP_TAGS = {"head", "style", "script", "title", "noscript", "template", "xml"}
+HTML_BLOCK_TAGS = {
+    "br", "p", "div", "li", "tr", "table", "blockquote", "section", "article",
+    "h1", "h2", "h3", "h4", "h5", "h6", "hr", "pre", "ul", "ol",
+}
+
+
+def get_body_max_chars():
+    return int(getattr(settings, "EMAIL_BODY_MAX_CHARS", 20000))
+
+# Collects visible text from HTML until the character budget is used up.
+class HTMLTextExtractor(HTMLParser):
+    def __init__(self, max_chars):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.parts = []
+        self.length = 0
+        self.skip_depth = 0
+        self.done = False
+        self.pending_space = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "body":
+            # an unclosed <head> must not hide the body
+            self.skip_depth = 0
+        elif tag in HTML_SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in HTML_BLOCK_TAGS:
+            self._newline()
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in HTML_BLOCK_TAGS:
+            self._newline()
+
+    def handle_endtag(self, tag):
+        if tag in HTML_SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in HTML_BLOCK_TAGS:
+            self._newline()
+
+    def handle_data(self, data):
+        if self.skip_depth or self.done:
+            return
+        words = data.split()
+        if not words:
+            self.pending_space = bool(data) and bool(self.parts)
+            return
+        text = " ".join(words)
+        if self.parts and self.parts[-1] != "\n" and (self.pending_space or data[0].isspace()):
+            text = " " + text
+        self.pending_space = data[-1].isspace()
+        self._append(text)
+
+    def _newline(self):
+        if self.parts and self.parts[-1] != "\n" and not self.done:
+            self._append("\n")
+        self.pending_space = False
+
+    def _append(self, text):
+        remaining = self.max_chars - self.length
+        if len(text) >= remaining:
+            text = text[:remaining]
+            self.done = True
+        self.parts.append(text)
+        self.length += len(text)
+
+    def get_text(self):
+        return "".join(self.parts).strip()
+
+# Extracts the visible text of an HTML body, skipping style/script content.
+# The HTML is parsed incrementally and parsing stops once max_chars are collected.
+def strip_html_tags(html, max_chars=None):
     logger.debug("Stripping HTML tags from email body.")
-    clean = re.compile("<.*?>")
-    text = re.sub(clean, "", html)
+    max_chars = get_body_max_chars() if max_chars is None else max_chars
+    parser = HTMLTextExtractor(max_chars)
+    for start in range(0, len(html), HTML_FEED_SIZE):
+        parser.feed(html[start:start + HTML_FEED_SIZE])
+        if parser.done:
+            logger.debug(f"HTML body truncated to {max_chars} characters.")
+            break
+    else:
+        parser.close()
     logger.debug("HTML tags stripped.")
-    return re.sub(r"\s+", " ", text).strip()
+    return parser.get_text()
 
 # Extracts the body of the email, handling both plain text and HTML formats.
 def get_email_body(msg):
@@ -44,3 +128,26 @@ def get_email_body(msg):
         return msg.get_payload(decode=True).decode(errors="ignore")
     logger.debug("Email body extracted.")
     return ""
+
+# Returns the <...> message ids found in a Message-ID, In-Reply-To or References header.
+def parse_message_ids(value):
+    if not value:
+        return []
+    return [
+        message_id[:255]
+        for message_id in re.findall(r"<[^<>\s]+>", str(value))
+    ]
+
+# Drops the quoted history and "On ... wrote:" line from a reply body.
+def strip_quoted_reply(body):
+    if not body:
+        return ""
+    lines = []
+    for line in body.splitlines():
+        stripped = line.strip()
+        if stripped.startswith(">"):
+            continue
+        if re.match(r"^(On .+ wrote:|-----\s*Original Message\s*-----)$", stripped, re.IGNORECASE):
+            break
+        lines.append(line)
+    return "\n".join(lines).strip() or body.strip()
@@ -0,0 +1,277 @@
+import base64
+import binascii
+import logging
+import quopri
+from dataclasses import dataclass, field
+from email import message_from_bytes
+from email.utils import parseaddr
+from django.conf import settings
+from tickets.utils.extractmail import (
+    decode_header_value,
+    get_email_body,
+    parse_message_ids,
+    strip_html_tags,
+)
+
+"""Utility functions for fetching emails from IMAP, either in full or text parts only."""
+
+logger = logging.getLogger(__name__)
+
+FETCH_MODE_FULL = "full"
+FETCH_MODE_BODYSTRUCTURE = "bodystructure"
+
+
+# Parsed email as handed over to the ticket creation
+@dataclass
+class FetchedEmail:
+    uid: int
+    subject: str
+    sender: str
+    body: str
+    raw_email: str
+    attachments: list = field(default_factory=list)
+    message_id: str = ""
+    in_reply_to: str = ""
+    references: list = field(default_factory=list)
+
+    # Message-IDs this email replies to, closest parent first
+    @property
+    def thread_ids(self):
+        ids = [self.in_reply_to] if self.in_reply_to else []
+        ids.extend(reversed(self.references))
+        return list(dict.fromkeys(ids))
+
+
+# Read the fetch mode and size cap from settings
+def get_fetch_mode():
+    mode = getattr(settings, "EMAIL_FETCH_MODE", FETCH_MODE_FULL) or FETCH_MODE_FULL
+    mode = mode.strip().lower()
+    if mode not in (FETCH_MODE_FULL, FETCH_MODE_BODYSTRUCTURE):
+        logger.warning(f"Unknown EMAIL_FETCH_MODE '{mode}', falling back to full fetch.")
+        return FETCH_MODE_FULL
+    return mode
+
+
+def get_body_max_bytes():
+    return int(getattr(settings, "EMAIL_BODY_MAX_BYTES", 256 * 1024))
+
+
+# Fetch and parse a list of UIDs using the configured fetch mode
+def fetch_emails(client, uids, mode=None):
+    uids = list(uids)
+    if not uids:
+        return {}
+    mode = mode or get_fetch_mode()
+    if mode == FETCH_MODE_BODYSTRUCTURE:
+        return _fetch_text_parts(client, uids)
+    return _fetch_full(client, uids)
+
+
+# Full RFC822 download, body extracted by walking all the parts
+def _fetch_full(client, uids):
+    fetched = {}
+    data = client.fetch(uids, ["RFC822"])
+    for uid in uids:
+        item = data.get(uid)
+        if not item or b"RFC822" not in item:
+            logger.warning(f"IMAP returned no RFC822 data for UID {uid}")
+            continue
+        raw = item[b"RFC822"]
+        msg = message_from_bytes(raw)
+        fetched[uid] = FetchedEmail(
+            uid=uid,
+            subject=decode_header_value(msg["Subject"]),
+            sender=parseaddr(msg["From"])[1],
+            body=get_email_body(msg),
+            raw_email=raw.decode("utf8", errors="replace"),
+            attachments=_attachments_from_message(msg),
+            **_thread_headers(msg),
+        )
+    return fetched
+
+
+# BODYSTRUCTURE first, then download only the text section up to the size cap
+def _fetch_text_parts(client, uids):
+    max_bytes = get_body_max_bytes()
+    data = client.fetch(uids, ["BODYSTRUCTURE", "BODY.PEEK[HEADER]"])
+
+    plans = {}
+    by_section = {}
+    for uid in uids:
+        item = data.get(uid)
+        if not item or b"BODYSTRUCTURE" not in item:
+            logger.warning(f"IMAP returned no BODYSTRUCTURE for UID {uid}")
+            continue
+        text_part, attachments = _plan_from_bodystructure(item[b"BODYSTRUCTURE"])
+        plans[uid] = (item.get(b"BODY[HEADER]", b""), text_part, attachments)
+        if text_part:
+            by_section.setdefault(text_part["section"], []).append(uid)
+
+    # one FETCH per distinct section, most messages share "1" or "1.1"
+    sections = {}
+    for section, section_uids in by_section.items():
+        item_name = f"BODY.PEEK[{section}]<0.{max_bytes}>"
+        response_prefix = f"BODY[{section}]".encode()
+        section_data = client.fetch(section_uids, [item_name])
+        for uid in section_uids:
+            for key, value in section_data.get(uid, {}).items():
+                if key.startswith(response_prefix):
+                    sections[uid] = value or b""
+                    break
+
+    fetched = {}
+    for uid, (header_bytes, text_part, attachments) in plans.items():
+        headers = message_from_bytes(header_bytes)
+        body = ""
+        if text_part:
+            body = _decode_section(sections.get(uid, b""), text_part)
+            if text_part["subtype"] == "html":
+                body = strip_html_tags(body)
+            if text_part["size"] > max_bytes:
+                logger.debug(
+                    f"Body of UID {uid} truncated to {max_bytes} of {text_part['size']} bytes"
+                )
+        raw_email = header_bytes.decode("utf8", errors="replace") + body
+        fetched[uid] = FetchedEmail(
+            uid=uid,
+            subject=decode_header_value(headers["Subject"]),
+            sender=parseaddr(headers["From"])[1],
+            body=body,
+            raw_email=raw_email,
+            attachments=attachments,
+            **_thread_headers(headers),
+        )
+        logger.debug(
+            f"Fetched UID {uid} text part only, {len(attachments)} attachment(s) skipped"
+        )
+    return fetched
+
+
+# Walk a BODYSTRUCTURE and pick the text section plus attachment metadata
+def _plan_from_bodystructure(structure):
+    candidates = []
+    attachments = []
+
+    def walk(node, section):
+        if node.is_multipart:
+            for index, child in enumerate(node[0], start=1):
+                walk(child, f"{section}.{index}" if section else str(index))
+            return
+        part = _describe_part(node, section or "1")
+        if part["type"] == "text" and part["subtype"] in ("plain", "html") and not part["is_attachment"]:
+            candidates.append(part)
+        else:
+            attachments.append({
+                "filename": part["filename"],
+                "content_type": f"{part['type']}/{part['subtype']}",
+                "size": part["size"],
+                "section": part["section"],
+            })
+
+    walk(structure, "")
+    # prefer text/plain, fall back to text/html
+    text_part = next((p for p in candidates if p["subtype"] == "plain"), None)
+    if text_part is None and candidates:
+        text_part = candidates[0]
+    return text_part, attachments
+
+
+def _describe_part(node, section):
+    ctype = _to_str(node[0]).lower()
+    subtype = _to_str(node[1]).lower()
+    params = _params_to_dict(node[2])
+    encoding = _to_str(node[5]).lower() if len(node) > 5 else ""
+    size = node[6] if len(node) > 6 and isinstance(node[6], int) else 0
+
+    # disposition position depends on the part type (RFC 3501 section 7.4.2)
+    if ctype == "text":
+        disposition_index = 9
+    elif ctype == "message" and subtype == "rfc822":
+        disposition_index = 11
+    else:
+        disposition_index = 8
+    disposition = node[disposition_index] if len(node) > disposition_index else None
+
+    is_attachment = False
+    filename = params.get("name")
+    if isinstance(disposition, tuple) and disposition:
+        is_attachment = _to_str(disposition[0]).lower() == "attachment"
+        if len(disposition) > 1:
+            filename = _params_to_dict(disposition[1]).get("filename") or filename
+
+    return {
+        "section": section,
+        "type": ctype,
+        "subtype": subtype,
+        "charset": params.get("charset") or "utf-8",
+        "encoding": encoding,
+        "size": size,
+        "filename": decode_header_value(filename) if filename else "",
+        "is_attachment": is_attachment,
+    }
+
+
+# Decode a (possibly truncated) section using its transfer encoding and charset
+def _decode_section(payload, part):
+    if part["encoding"] == "base64":
+        compact = b"".join(payload.split())
+        compact = compact[: len(compact) - len(compact) % 4]
+        try:
+            payload = base64.b64decode(compact)
+        except (binascii.Error, ValueError):
+            logger.warning(f"Invalid base64 body in section {part['section']}")
+            payload = b""
+    elif part["encoding"] == "quoted-printable":
+        payload = quopri.decodestring(payload)
+    try:
+        return payload.decode(part["charset"], errors="ignore")
+    except LookupError:
+        return payload.decode("utf-8", errors="ignore")
+
+
+# Message-ID, In-Reply-To and References used to thread replies
+def _thread_headers(msg):
+    message_ids = parse_message_ids(msg["Message-ID"])
+    in_reply_to = parse_message_ids(msg["In-Reply-To"])
+    return {
+        "message_id": message_ids[0] if message_ids else "",
+        "in_reply_to": in_reply_to[0] if in_reply_to else "",
+        "references": parse_message_ids(msg["References"]),
+    }
+
+
+# Attachment metadata when the full message is already in memory
+def _attachments_from_message(msg):
+    attachments = []
+    if not msg.is_multipart():
+        return attachments
+    for part in msg.walk():
+        if part.is_multipart():
+            continue
+        filename = part.get_filename()
+        if part.get_content_disposition() == "attachment" or filename:
+            payload = part.get_payload(decode=True) or b""
+            attachments.append({
+                "filename": decode_header_value(filename) if filename else "",
+                "content_type": part.get_content_type(),
+                "size": len(payload),
+            })
+    return attachments
+
+
+def _params_to_dict(params):
+    if not isinstance(params, tuple):
+        return {}
+    values = list(params)
+    return {
+        _to_str(values[i]).lower(): _to_str(values[i + 1])
+        for i in range(0, len(values) - 1, 2)
+    }
+
+
+def _to_str(value):
+    if value is None:
+        return ""
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="ignore")
+    return str(value)
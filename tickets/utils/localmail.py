@@ -0,0 +1,400 @@
+import base64
+import logging
+import re
+import socketserver
+import threading
+from email import message_from_bytes
+from email.parser import BytesHeaderParser
+
+"""In-process IMAP and SMTP stand-ins for load tests and local development.
+
+They speak just enough of the protocols for IMAPClient (CAPABILITY, LOGIN,
+SELECT/EXAMINE, UID SEARCH, UID FETCH, UID STORE, NOOP, LOGOUT) and for
+Django's SMTP backend (EHLO/HELO, AUTH PLAIN, MAIL, RCPT, DATA, RSET, QUIT).
+Connections are plain TCP on localhost, there is no TLS.
+"""
+
+logger = logging.getLogger(__name__)
+
+LITERAL_RE = re.compile(rb"\{(\d+)\}\r\n$")
+PARTIAL_RE = re.compile(r"^BODY(?:\.PEEK)?\[([^\]]*)\](?:<(\d+)\.(\d+)>)?$", re.IGNORECASE)
+
+
+# Messages of one mailbox, shared by all IMAP connections
+class LocalMailbox:
+    def __init__(self, uid_validity=1):
+        self.uid_validity = uid_validity
+        self.messages = {}  # uid -> {"raw": bytes, "flags": set}
+        self.next_uid = 1
+        self.lock = threading.Lock()
+
+    def append(self, raw):
+        with self.lock:
+            uid = self.next_uid
+            self.next_uid += 1
+            self.messages[uid] = {"raw": raw, "flags": set()}
+            return uid
+
+    def uids(self):
+        with self.lock:
+            return sorted(self.messages)
+
+    def unseen_count(self):
+        with self.lock:
+            return sum(1 for message in self.messages.values() if "\\Seen" not in message["flags"])
+
+
+class LocalIMAPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, mailbox=None, host="127.0.0.1", port=0):
+        self.mailbox = mailbox or LocalMailbox()
+        super().__init__((host, port), IMAPHandler)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="local-imap", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class IMAPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.mailbox = self.server.mailbox
+        self.send(b"* OK [CAPABILITY IMAP4rev1 UIDPLUS] local IMAP stand-in ready")
+        while True:
+            line = self.read_command()
+            if line is None:
+                return
+            tag, _, rest = line.partition(" ")
+            command, _, args = rest.partition(" ")
+            command = command.upper()
+            if command == "UID":
+                command, _, args = args.partition(" ")
+                command = "UID " + command.upper()
+            try:
+                if not self.dispatch(tag, command, args.strip()):
+                    return
+            except Exception as e:
+                logger.exception(f"Local IMAP failed on {command}")
+                self.send(f"{tag} BAD {e}".encode())
+
+    # One command line, with any {n} literals inlined as quoted strings
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        while True:
+            match = LITERAL_RE.search(line)
+            if not match:
+                break
+            self.send(b"+ go ahead")
+            literal = self.rfile.read(int(match.group(1)))
+            line = line[: match.start()] + b'"' + literal.replace(b'"', b'\\"') + b'"' + self.rfile.readline()
+        return line.rstrip(b"\r\n").decode("utf-8", errors="replace")
+
+    def send(self, data):
+        self.wfile.write(data + b"\r\n")
+
+    def dispatch(self, tag, command, args):
+        if command == "CAPABILITY":
+            self.send(b"* CAPABILITY IMAP4rev1 UIDPLUS")
+        elif command in ("LOGIN", "NOOP", "CHECK", "CLOSE", "UNSELECT"):
+            pass
+        elif command in ("SELECT", "EXAMINE"):
+            uids = self.mailbox.uids()
+            self.send(b"* FLAGS (\\Answered \\Flagged \\Deleted \\Seen \\Draft)")
+            self.send(f"* {len(uids)} EXISTS".encode())
+            self.send(b"* 0 RECENT")
+            self.send(f"* OK [UIDVALIDITY {self.mailbox.uid_validity}] UIDs valid".encode())
+            self.send(f"* OK [UIDNEXT {self.mailbox.next_uid}] next UID".encode())
+            mode = "READ-ONLY" if command == "EXAMINE" else "READ-WRITE"
+            self.send(f"{tag} OK [{mode}] {command} completed".encode())
+            return True
+        elif command == "UID SEARCH":
+            self.send(("* SEARCH " + " ".join(map(str, self.search(args)))).strip().encode())
+        elif command == "UID FETCH":
+            uid_set, _, items = args.partition(" ")
+            self.fetch(uid_set, items)
+        elif command == "UID STORE":
+            uid_set, _, rest = args.partition(" ")
+            action, _, flags = rest.partition(" ")
+            self.store(uid_set, action.upper(), flags)
+        elif command == "LOGOUT":
+            self.send(b"* BYE logging out")
+            self.send(f"{tag} OK LOGOUT completed".encode())
+            return False
+        else:
+            self.send(f"{tag} BAD unsupported command {command}".encode())
+            return True
+        self.send(f"{tag} OK {command} completed".encode())
+        return True
+
+    # Supports the criteria the poller uses: ALL, UNSEEN, SEEN and UID <set>
+    def search(self, args):
+        tokens = args.replace("(", " ").replace(")", " ").split()
+        if tokens[:1] and tokens[0].upper() == "CHARSET":
+            tokens = tokens[2:]
+        with self.mailbox.lock:
+            candidates = sorted(self.mailbox.messages)
+            selected = []
+            for uid in candidates:
+                flags = self.mailbox.messages[uid]["flags"]
+                matched = True
+                index = 0
+                while index < len(tokens):
+                    token = tokens[index].upper()
+                    if token == "UNSEEN":
+                        matched &= "\\Seen" not in flags
+                    elif token == "SEEN":
+                        matched &= "\\Seen" in flags
+                    elif token == "UID" and index + 1 < len(tokens):
+                        index += 1
+                        matched &= uid in self.expand(tokens[index], candidates)
+                    index += 1
+                if matched:
+                    selected.append(uid)
+        return selected
+
+    def fetch(self, uid_set, items):
+        items = items.strip()
+        if items.startswith("(") and items.endswith(")"):
+            items = items[1:-1]
+        names = re.findall(r"BODY(?:\.PEEK)?\[[^\]]*\](?:<[\d.]+>)?|[A-Z0-9.]+", items, re.IGNORECASE)
+        existing = self.mailbox.uids()
+        positions = {uid: seq for seq, uid in enumerate(existing, start=1)}
+        for uid in sorted(self.expand(uid_set, existing)):
+            message = self.mailbox.messages.get(uid)
+            if message is None:
+                continue
+            parts = [b"UID " + str(uid).encode()]
+            for name in names:
+                parts.append(self.fetch_item(name, message))
+            self.wfile.write(f"* {positions[uid]} FETCH (".encode() + b" ".join(p for p in parts if p) + b")\r\n")
+
+    def fetch_item(self, name, message):
+        upper = name.upper()
+        raw = message["raw"]
+        if upper == "UID":
+            return b""
+        if upper == "FLAGS":
+            return f"FLAGS ({' '.join(sorted(message['flags']))})".encode()
+        if upper in ("RFC822", "BODY[]", "BODY.PEEK[]"):
+            if not upper.startswith("BODY.PEEK"):
+                message["flags"].add("\\Seen")
+            key = b"RFC822" if upper == "RFC822" else b"BODY[]"
+            return key + self.literal(raw)
+        if upper == "RFC822.SIZE":
+            return f"RFC822.SIZE {len(raw)}".encode()
+        if upper == "BODYSTRUCTURE":
+            return b"BODYSTRUCTURE " + bodystructure(message_from_bytes(raw))
+        match = PARTIAL_RE.match(name)
+        if match:
+            section, start, length = match.groups()
+            data = section_bytes(raw, section.upper())
+            key = f"BODY[{section.upper()}]"
+            if start is not None:
+                data = data[int(start): int(start) + int(length)]
+                key += f"<{start}>"
+            return key.encode() + self.literal(data)
+        return b""
+
+    def store(self, uid_set, action, flags):
+        flags = set(flags.strip("()").split())
+        with self.mailbox.lock:
+            for uid in self.expand(uid_set, sorted(self.mailbox.messages)):
+                message = self.mailbox.messages[uid]
+                if action.startswith("+FLAGS"):
+                    message["flags"] |= flags
+                elif action.startswith("-FLAGS"):
+                    message["flags"] -= flags
+                else:
+                    message["flags"] = set(flags)
+
+    @staticmethod
+    def literal(data):
+        return b" {" + str(len(data)).encode() + b"}\r\n" + data
+
+    # "1,3:5,7:*" -> set of existing UIDs
+    @staticmethod
+    def expand(uid_set, existing):
+        highest = max(existing) if existing else 0
+        selected = set()
+        for part in uid_set.split(","):
+            if ":" in part:
+                low, high = part.split(":", 1)
+                low = highest if low == "*" else int(low)
+                high = highest if high == "*" else int(high)
+                low, high = min(low, high), max(low, high)
+                selected.update(uid for uid in existing if low <= uid <= high)
+            elif part == "*":
+                selected.add(highest)
+            elif part:
+                selected.add(int(part))
+        return selected
+
+
+# Header or numbered MIME part of a raw message, enough for BODY[HEADER] and BODY[1.2]
+def section_bytes(raw, section):
+    if section == "HEADER":
+        head, sep, _ = raw.partition(b"\r\n\r\n")
+        return head + sep
+    if section in ("", "TEXT"):
+        return raw.partition(b"\r\n\r\n")[2] if section == "TEXT" else raw
+    part = message_from_bytes(raw)
+    for index in section.split("."):
+        if part.is_multipart():
+            part = part.get_payload()[int(index) - 1]
+        elif index != "1":
+            return b""
+    payload = part.get_payload(decode=False)
+    if isinstance(payload, list):
+        return part.as_bytes()
+    return payload.encode("utf-8", errors="replace") if isinstance(payload, str) else payload
+
+
+# RFC 3501 BODYSTRUCTURE for the message parts
+def bodystructure(part):
+    def quote(value):
+        if value is None:
+            return "NIL"
+        return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+    if part.is_multipart():
+        children = b"".join(bodystructure(child) for child in part.get_payload())
+        return b"(" + children + f" {quote(part.get_content_subtype().upper())})".encode()
+
+    maintype = part.get_content_maintype().upper()
+    subtype = part.get_content_subtype().upper()
+    params = [(key, value) for key, value in part.get_params(header="content-type")[1:]]
+    params_str = "(" + " ".join(f"{quote(k.upper())} {quote(v)}" for k, v in params) + ")" if params else "NIL"
+    payload = part.get_payload(decode=False)
+    size = len(payload.encode("utf-8", errors="replace")) if isinstance(payload, str) else 0
+    encoding = quote((part.get("Content-Transfer-Encoding") or "7BIT").upper())
+    disposition = part.get_content_disposition()
+    filename = part.get_filename()
+    if disposition:
+        disp_params = f'("FILENAME" {quote(filename)})' if filename else "NIL"
+        disposition_str = f"({quote(disposition.upper())} {disp_params})"
+    else:
+        disposition_str = "NIL"
+
+    fields = f"{quote(maintype)} {quote(subtype)} {params_str} NIL NIL {encoding} {size}"
+    if maintype == "TEXT":
+        fields += f" {len(payload.splitlines()) if isinstance(payload, str) else 0}"
+    fields += f" NIL {disposition_str} NIL NIL"
+    return f"({fields})".encode()
+
+
+# Messages received by the SMTP sink
+class LocalOutbox:
+    def __init__(self):
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def add(self, sender, recipients, data):
+        with self.lock:
+            self.messages.append({"from": sender, "to": recipients, "data": data})
+
+    def __len__(self):
+        with self.lock:
+            return len(self.messages)
+
+    def headers(self):
+        with self.lock:
+            return [BytesHeaderParser().parsebytes(m["data"]) for m in self.messages]
+
+
+class LocalSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, outbox=None, host="127.0.0.1", port=0, rejected_recipients=()):
+        self.outbox = outbox or LocalOutbox()
+        # addresses answered with 550, to exercise partial failures
+        self.rejected_recipients = {address.lower() for address in rejected_recipients}
+        super().__init__((host, port), SMTPHandler)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="local-smtp", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.reset()
+        self.reply(220, "localhost local SMTP sink ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, args = line.decode("utf-8", errors="replace").strip().partition(" ")
+            command = command.upper()
+            if command == "EHLO":
+                self.wfile.write(b"250-localhost\r\n250-AUTH PLAIN\r\n250-8BITMIME\r\n250 SMTPUTF8\r\n")
+            elif command == "HELO":
+                self.reply(250, "localhost")
+            elif command == "AUTH":
+                mechanism, _, initial = args.partition(" ")
+                if mechanism.upper() != "PLAIN":
+                    self.reply(504, "only AUTH PLAIN is supported")
+                    continue
+                if not initial:
+                    self.reply(334, "")
+                    initial = self.rfile.readline().decode().strip()
+                base64.b64decode(initial)
+                self.reply(235, "authenticated")
+            elif command == "MAIL":
+                self.reset()
+                self.sender = args.partition(":")[2].strip().strip("<>")
+                self.reply(250, "OK")
+            elif command == "RCPT":
+                recipient = args.partition(":")[2].strip().strip("<>")
+                if recipient.lower() in self.server.rejected_recipients:
+                    self.reply(550, "mailbox unavailable")
+                    continue
+                self.recipients.append(recipient)
+                self.reply(250, "OK")
+            elif command == "DATA":
+                self.reply(354, "end data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b".\r\n", b".\n"):
+                        break
+                    lines.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                self.server.outbox.add(self.sender, self.recipients, b"".join(lines))
+                self.reset()
+                self.reply(250, "OK queued")
+            elif command in ("RSET", "NOOP"):
+                self.reset()
+                self.reply(250, "OK")
+            elif command == "QUIT":
+                self.reply(221, "bye")
+                return
+            else:
+                self.reply(502, "command not implemented")
+
+    def reset(self):
+        self.sender = None
+        self.recipients = []
+
+    def reply(self, code, text):
+        self.wfile.write(f"{code} {text}\r\n".encode())
@@ -0,0 +1,104 @@
+import logging
+from contextlib import contextmanager
+from django.conf import settings
+from django.utils import timezone
+from imapclient import IMAPClient
+from dashboard.utils.tasklock import extend_current_lock
+from tickets.models import MailboxState
+from tickets.utils.emailpipeline import chunked, get_batch_size, process_email_chunk
+
+"""Utility functions for polling the IMAP intake mailboxes in EMAIL_ACCOUNTS."""
+
+logger = logging.getLogger(__name__)
+
+# Task lock key of one mailbox, shared by the celery task and the mail_monitor command
+MAILBOX_LOCK_KEY = "monitor_mailbox:{account_key}"
+
+
+# Keys of every EMAIL_ACCOUNTS entry with IMAP intake enabled
+def get_imap_account_keys():
+    accounts = getattr(settings, "EMAIL_ACCOUNTS", {})
+    return [key for key, config in accounts.items() if config.get("IMAP_ENABLED")]
+
+
+def get_mailbox_lock_key(account_key):
+    return MAILBOX_LOCK_KEY.format(account_key=account_key)
+
+
+def get_mailbox_lock_lease():
+    return int(getattr(settings, "EMAIL_MAILBOX_LOCK_SECONDS", 600))
+
+
+# IMAP connection settings of one mailbox, falling back to the global ones
+def get_imap_config(account_key):
+    accounts = getattr(settings, "EMAIL_ACCOUNTS", {})
+    if account_key not in accounts:
+        raise ValueError(
+            f"Email account '{account_key}' is not configured in settings.EMAIL_ACCOUNTS"
+        )
+    config = accounts[account_key]
+    port = config.get("IMAP_PORT") or settings.EMAIL_IMAP_PORT
+    ssl = config.get("IMAP_SSL")
+    return {
+        "host": config.get("IMAP_HOST") or settings.EMAIL_IMAP_HOST,
+        "port": int(port) if port else None,
+        "ssl": getattr(settings, "EMAIL_IMAP_SSL", True) if ssl is None else ssl,
+        "folder": config.get("IMAP_FOLDER") or getattr(settings, "EMAIL_IMAP_FOLDER", "INBOX"),
+        "username": config["EMAIL_HOST_USER"],
+        "password": config["EMAIL_HOST_PASSWORD"],
+    }
+
+
+# Open and log in an IMAP connection for one mailbox
+@contextmanager
+def open_mailbox(account_key):
+    config = get_imap_config(account_key)
+    with IMAPClient(config["host"], port=config["port"], ssl=config["ssl"]) as client:
+        client.login(config["username"], config["password"])
+        logger.info(f"[{account_key}] Logged in to IMAP as {config['username']}")
+        yield client
+
+
+# Process the unseen messages above the mailbox UID cursor in chunks
+def poll_mailbox(client, account_key, dispatch=True):
+    config = get_imap_config(account_key)
+    state, _ = MailboxState.objects.get_or_create(account_key=account_key)
+
+    select_info = client.select_folder(config["folder"], readonly=False)
+    uid_validity = select_info.get(b"UIDVALIDITY")
+    if uid_validity is not None and uid_validity != state.uid_validity:
+        # UIDs were renumbered by the server, restart the cursor
+        logger.info(f"[{account_key}] UIDVALIDITY changed to {uid_validity}, resetting cursor.")
+        state.uid_validity = uid_validity
+        state.last_uid = 0
+        state.save(update_fields=["uid_validity", "last_uid"])
+
+    # "n:*" always matches the highest UID, so filter on the cursor again
+    uids = sorted(
+        uid
+        for uid in client.search(["UNSEEN", "UID", f"{state.last_uid + 1}:*"])
+        if uid > state.last_uid
+    )
+    logger.debug(f"[{account_key}] Found {len(uids)} unseen messages")
+
+    summary = {"account_key": account_key, "messages": 0, "missing": 0, "tickets": 0, "comments": 0}
+    cursor = state.last_uid
+    held = False
+    for chunk in chunked(uids, get_batch_size()):
+        result = process_email_chunk(client, chunk, account_key, dispatch=dispatch)
+        if result["missing"] and not held:
+            # stop below the lowest unfetched UID so the next poll retries it
+            cursor = max(cursor, min(result["missing"]) - 1)
+            held = True
+        elif not held:
+            cursor = max(chunk)
+        MailboxState.objects.filter(pk=state.pk).update(last_uid=cursor)
+        extend_current_lock()
+        summary["messages"] += result["messages"]
+        summary["missing"] += len(result["missing"])
+        summary["tickets"] += len(result["tickets"])
+        summary["comments"] += len(result["comments"])
+        logger.info(f"[{account_key}] Processed email UIDs {chunk}.")
+
+    MailboxState.objects.filter(pk=state.pk).update(last_polled_at=timezone.now())
+    return summary
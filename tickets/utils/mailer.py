@@ -1,8 +1,9 @@
 import logging
+import smtplib
 from django.conf import settings
-from django.template.loader import render_to_string
 from django.core.mail import EmailMultiAlternatives, get_connection
-from tickets.models import EmailTicket
+from django.core.mail.message import make_msgid
+from tickets.utils.emailrender import render_email
 
 """Utility functions for sending emails using different email tickets configured in Django settings."""
 
@@ -26,8 +27,12 @@ def get_smtp_connection(account_key):
         fail_silently=False,
     )
 
-#send replay email for email ticket submission
-def send_email_reply(
+def get_send_chunk_size():
+    return max(1, int(getattr(settings, "EMAIL_SEND_CHUNK_SIZE", 100)))
+
+
+# build the "Ticket Created" reply for an email ticket, returns (message, Message-ID)
+def build_email_reply(
     account_key,
     ticket_number,
     to_email,
@@ -36,40 +41,65 @@ def send_email_reply(
     email_template_txt="email/replay_email.txt",
     email_template_html="email/replay_email.html",
 ):
+    if account_key not in settings.EMAIL_ACCOUNTS:
+        raise ValueError(f"Email account '{account_key}' is not configured.")
+
     email_subject = f"Re: {subject} - Ticket Created: {ticket_number}"
-    logger.debug(
-        f"Preparing to send reply email for ticket {ticket_number} to {email_subject}"
-    )
     context = {
         "ticket_number": ticket_number,
         "subject": email_subject,
     }
+    subject, text_body, html_body = render_email(
+        subject_template, email_template_txt, email_template_html, context
+    )
+    cfg = settings.EMAIL_ACCOUNTS[account_key]
+    # replies to this message carry the id in In-Reply-To / References
+    message_id = make_msgid(domain=(cfg["EMAIL_HOST_USER"] or "").rpartition("@")[2] or None)
 
-    if account_key not in settings.EMAIL_ACCOUNTS:
-        raise ValueError(f"Email account '{account_key}' is not configured.")
+    msg = EmailMultiAlternatives(
+        subject,
+        text_body,
+        cfg["EMAIL_HOST_USER"],
+        [to_email],
+        headers={"Message-ID": message_id},
+    )
+    msg.attach_alternative(html_body, "text/html")
+    return msg, message_id
 
-    subject = render_to_string(subject_template, context).strip()
-    text_body = render_to_string(email_template_txt, context)
-    html_body = render_to_string(email_template_html, context)
-    cfg = settings.EMAIL_ACCOUNTS[account_key]
 
-    connection = get_smtp_connection(account_key)
-    try:
-        msg = EmailMultiAlternatives(
-            subject,
-            text_body,
-            cfg["EMAIL_HOST_USER"],
-            [to_email],
-            connection=connection,
-        )
-        msg.attach_alternative(html_body, "text/html")
-        msg.send(fail_silently=False)
-    except Exception as e:
-        logger.error(
-            f"Failed to send reply email to {to_email} for ticket {ticket_number}: {str(e)}"
-        )
-        raise
+# send many messages of one account over one SMTP connection per chunk.
+# Returns one entry per message: None when sent, else the error text.
+def send_messages_batched(account_key, messages, chunk_size=None):
+    chunk_size = chunk_size or get_send_chunk_size()
+    results = []
+    for start in range(0, len(messages), chunk_size):
+        chunk = messages[start:start + chunk_size]
+        chunk_results = []
+        connection = get_smtp_connection(account_key)
+        try:
+            connection.open()
+            for msg in chunk:
+                msg.connection = connection
+                try:
+                    # one message per call so a rejected recipient only fails its own message
+                    sent = connection.send_messages([msg])
+                    chunk_results.append(None if sent else "not sent")
+                except smtplib.SMTPServerDisconnected as e:
+                    chunk_results.append(str(e))
+                    connection.close()
+                    connection.open()
+                except smtplib.SMTPException as e:
+                    chunk_results.append(str(e))
+        except Exception as e:
+            logger.error(f"[{account_key}] SMTP connection failed: {e}")
+            chunk_results.extend(str(e) for _ in chunk[len(chunk_results):])
+        finally:
+            connection.close()
+        results.extend(chunk_results)
 
-    EmailTicket.objects.update(reply_sent=True)
+    failed = sum(1 for result in results if result)
     logger.info(
-        f"Reply email sent successfully to {to_email} for ticket {ticket_number}.")
+        f"[{account_key}] Sent {len(results) - failed} of {len(messages)} email(s), {failed} failed"
+    )
+    return results
+
@@ -0,0 +1,201 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.utils import timezone
+from tickets.models import EmailTicket, OutboundEmail
+from tickets.utils.mailer import send_messages_batched
+
+"""Transactional outbox for outgoing email.
+
+Callers write OutboundEmail rows inside their own transaction and the
+send_outbound_emails worker drains them in batches: one SMTP connection per
+account and chunk, per-row status, exponential backoff and a per-account
+sending rate.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def get_outbox_batch_size():
+    return max(1, int(getattr(settings, "EMAIL_OUTBOX_BATCH_SIZE", 200)))
+
+
+def get_max_attempts():
+    return max(1, int(getattr(settings, "EMAIL_OUTBOX_MAX_ATTEMPTS", 5)))
+
+
+# Messages per minute an account may send, EMAIL_ACCOUNTS[key]["SEND_RATE_PER_MINUTE"] wins
+def get_account_rate_limit(account_key):
+    config = getattr(settings, "EMAIL_ACCOUNTS", {}).get(account_key, {})
+    rate = config.get("SEND_RATE_PER_MINUTE") or getattr(settings, "EMAIL_OUTBOX_RATE_PER_MINUTE", 60)
+    return max(1, int(rate))
+
+
+# 1, 2, 4, 8 ... minutes, capped at one hour
+def get_retry_delay(attempts):
+    base = int(getattr(settings, "EMAIL_OUTBOX_RETRY_SECONDS", 60))
+    return timedelta(seconds=min(base * 2 ** max(0, attempts - 1), 3600))
+
+
+# Add one message to the outbox, sent once the surrounding transaction commits
+def enqueue_email(account_key, kind, to_email, subject, text_body, html_body="",
+                  headers=None, email_ticket=None, user=None):
+    return enqueue_emails([
+        OutboundEmail(
+            account_key=account_key,
+            kind=kind,
+            to_email=to_email,
+            subject=subject,
+            text_body=text_body,
+            html_body=html_body or "",
+            headers=headers or {},
+            email_ticket=email_ticket,
+            user=user,
+        )
+    ])[0]
+
+
+def enqueue_emails(outbound_emails):
+    if not outbound_emails:
+        return []
+    for outbound in outbound_emails:
+        if outbound.account_key not in settings.EMAIL_ACCOUNTS:
+            raise ValueError(f"Email account '{outbound.account_key}' is not configured.")
+    created = OutboundEmail.objects.bulk_create(outbound_emails)
+    account_keys = sorted({outbound.account_key for outbound in created})
+    transaction.on_commit(lambda: _kick_sender(account_keys))
+    logger.debug(f"Queued {len(created)} outbound email(s)")
+    return created
+
+
+# Drain the accounts that just got rows, the periodic run covers all of them
+def _kick_sender(account_keys=None):
+    from tickets.utils.task import send_outbound_emails
+
+    try:
+        send_outbound_emails.delay(account_keys)
+    except Exception as e:
+        # the periodic run picks the rows up
+        logger.warning(f"Could not queue the outbound email sender: {e}")
+
+
+# Send due outbox rows until none are left or every account hit its rate limit,
+# only the rows of `account_keys` when given
+def drain_outbox(batch_size=None, account_keys=None):
+    batch_size = batch_size or get_outbox_batch_size()
+    totals = {"sent": 0, "retried": 0, "failed": 0, "deferred": 0}
+    deferred_accounts = set()
+    pending = OutboundEmail.objects.filter(status="pending")
+    if account_keys is not None:
+        pending = pending.filter(account_key__in=list(account_keys))
+
+    while True:
+        now = timezone.now()
+        due = list(
+            pending.filter(next_attempt_at__lte=now)
+            .exclude(account_key__in=deferred_accounts)
+            .order_by("next_attempt_at", "id")[:batch_size]
+        )
+        if not due:
+            break
+
+        by_account = {}
+        for outbound in due:
+            by_account.setdefault(outbound.account_key, []).append(outbound)
+
+        for account_key, rows in by_account.items():
+            allowed = _remaining_rate(account_key, now)
+            if allowed < len(rows):
+                deferred_accounts.add(account_key)
+                totals["deferred"] += len(rows) - allowed
+                rows = rows[:allowed]
+            if rows:
+                for key, count in _send_rows(account_key, rows).items():
+                    totals[key] += count
+
+    if any(totals.values()):
+        logger.info(
+            f"Outbox drained: {totals['sent']} sent, {totals['retried']} to retry, "
+            f"{totals['failed']} failed, {totals['deferred']} rate limited"
+        )
+    return totals
+
+
+def _remaining_rate(account_key, now):
+    sent_last_minute = OutboundEmail.objects.filter(
+        account_key=account_key, sent_at__gte=now - timedelta(minutes=1)
+    ).count()
+    return max(0, get_account_rate_limit(account_key) - sent_last_minute)
+
+
+def _build_message(outbound):
+    cfg = settings.EMAIL_ACCOUNTS[outbound.account_key]
+    msg = EmailMultiAlternatives(
+        outbound.subject,
+        outbound.text_body,
+        cfg["EMAIL_HOST_USER"],
+        [outbound.to_email],
+        headers=outbound.headers or None,
+    )
+    if outbound.html_body:
+        msg.attach_alternative(outbound.html_body, "text/html")
+    return msg
+
+
+# Send one account's rows and record the outcome of every row
+def _send_rows(account_key, rows):
+    counts = {"sent": 0, "retried": 0, "failed": 0}
+    now = timezone.now()
+    messages = []
+    sendable = []
+    for outbound in rows:
+        try:
+            messages.append(_build_message(outbound))
+            sendable.append(outbound)
+        except Exception as e:
+            _mark_failure(outbound, str(e), now, permanent=True)
+            counts["failed"] += 1
+
+    results = send_messages_batched(account_key, messages) if messages else []
+    for outbound, error in zip(sendable, results):
+        outbound.attempts += 1
+        if error is None:
+            outbound.status = "sent"
+            outbound.sent_at = timezone.now()
+            outbound.last_error = ""
+            counts["sent"] += 1
+        elif outbound.attempts >= get_max_attempts():
+            _mark_failure(outbound, error, now, permanent=True)
+            counts["failed"] += 1
+        else:
+            _mark_failure(outbound, error, now)
+            counts["retried"] += 1
+
+    OutboundEmail.objects.bulk_update(
+        rows, ["status", "attempts", "next_attempt_at", "last_error", "sent_at"]
+    )
+    _after_sent([outbound for outbound in rows if outbound.status == "sent"])
+    return counts
+
+
+def _mark_failure(outbound, error, now, permanent=False):
+    outbound.last_error = error[:2000]
+    if permanent:
+        outbound.status = "failed"
+        logger.error(f"Outbound email {outbound.id} to {outbound.to_email} failed: {error}")
+    else:
+        outbound.next_attempt_at = now + get_retry_delay(outbound.attempts)
+        logger.warning(
+            f"Outbound email {outbound.id} to {outbound.to_email} failed "
+            f"(attempt {outbound.attempts}), retrying at {outbound.next_attempt_at}: {error}"
+        )
+
+
+# State the rest of the app derives from a sent message
+def _after_sent(sent):
+    reply_ids = [outbound.email_ticket_id for outbound in sent
+                 if outbound.kind == "reply" and outbound.email_ticket_id]
+    if reply_ids:
+        EmailTicket.objects.filter(id__in=reply_ids).update(reply_sent=True)
@@ -0,0 +1,111 @@
+import hashlib
+import logging
+import zlib
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from tickets.models import RawEmailBlob
+
+try:
+    import zstandard
+except ImportError:  # optional, zlib is used when it is missing
+    zstandard = None
+
+"""Compressed, content-addressed storage for raw email sources."""
+
+logger = logging.getLogger(__name__)
+
+CODEC_ZLIB = "zlib"
+CODEC_ZSTD = "zstd"
+
+
+# Codec for new blobs, zstd only when the zstandard package is installed
+def get_codec():
+    codec = (getattr(settings, "EMAIL_RAW_CODEC", CODEC_ZLIB) or CODEC_ZLIB).strip().lower()
+    if codec == CODEC_ZSTD and zstandard is None:
+        logger.warning("EMAIL_RAW_CODEC is 'zstd' but zstandard is not installed, using zlib.")
+        return CODEC_ZLIB
+    if codec not in (CODEC_ZLIB, CODEC_ZSTD):
+        logger.warning(f"Unknown EMAIL_RAW_CODEC '{codec}', using zlib.")
+        return CODEC_ZLIB
+    return codec
+
+
+def get_compression_level(codec):
+    level = getattr(settings, "EMAIL_RAW_COMPRESSION_LEVEL", None)
+    if level is not None:
+        return int(level)
+    return 3 if codec == CODEC_ZSTD else 6
+
+
+def compress(data, codec):
+    level = get_compression_level(codec)
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return zlib.compress(data, level)
+
+
+def decompress(data, codec):
+    data = bytes(data)
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd compressed raw emails")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+# Store raw emails and return their blob ids in the same order (None for empty input).
+# Identical sources share one blob; existing digests are looked up in one query.
+def store_raw_emails(raw_emails):
+    encoded = [raw.encode("utf-8") if raw else None for raw in raw_emails]
+    digests = [hashlib.sha256(data).hexdigest() if data else None for data in encoded]
+    wanted = {digest for digest in digests if digest}
+    if not wanted:
+        return [None] * len(encoded)
+
+    blob_ids = dict(
+        RawEmailBlob.objects.filter(digest__in=wanted).values_list("digest", "id")
+    )
+    codec = get_codec()
+    new_blobs = {}
+    for digest, data in zip(digests, encoded):
+        if digest and digest not in blob_ids and digest not in new_blobs:
+            compressed = compress(data, codec)
+            new_blobs[digest] = RawEmailBlob(
+                digest=digest,
+                codec=codec,
+                data=compressed,
+                size=len(data),
+                compressed_size=len(compressed),
+            )
+    if new_blobs:
+        # another worker may store the same digest concurrently
+        RawEmailBlob.objects.bulk_create(new_blobs.values(), ignore_conflicts=True)
+        blob_ids.update(
+            RawEmailBlob.objects.filter(digest__in=new_blobs).values_list("digest", "id")
+        )
+    return [blob_ids.get(digest) if digest else None for digest in digests]
+
+
+def load_raw_email(blob):
+    return decompress(blob.data, blob.codec).decode("utf-8", errors="replace")
+
+
+# Delete blobs no email refers to any more. Blobs younger than `grace` are kept,
+# their email row may not be written yet. Returns the number deleted.
+def prune_raw_email_blobs(grace=timedelta(hours=1), chunk_size=1000):
+    orphans = RawEmailBlob.objects.filter(
+        emails__isnull=True, created_at__lt=timezone.now() - grace
+    )
+    deleted = 0
+    last_id = 0
+    while True:
+        ids = list(orphans.filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:chunk_size])
+        if not ids:
+            break
+        last_id = ids[-1]
+        # re-checked in the delete, an email may have reused the digest meanwhile
+        deleted += RawEmailBlob.objects.filter(id__in=ids, emails__isnull=True).delete()[0]
+    if deleted:
+        logger.info(f"Pruned {deleted} orphaned raw email blob(s)")
+    return deleted
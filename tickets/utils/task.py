@@ -1,26 +1,120 @@
 import logging
 from celery import shared_task
-from tickets.utils.mailer import send_email_reply
-from tickets.models import Ticket
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
 from django.db.models import Q
+from django.utils import timezone
+from dashboard.utils.tasklock import singleton_task
+from tickets.utils.mailer import build_email_reply
+from tickets.utils.outbox import drain_outbox, enqueue_emails, get_outbox_batch_size
+from tickets.utils.rawstore import prune_raw_email_blobs
+from tickets.models import EmailTicket, OutboundEmail
 
 
 logger = logging.getLogger(__name__)
 
+
+def get_reply_sweep_grace():
+    return max(0, int(getattr(settings, "EMAIL_REPLY_SWEEP_GRACE_SECONDS", 300)))
+
+
+# Emails waiting for their 'Ticket Created' reply, served by the partial index
+def _pending_reply_emails():
+    return EmailTicket.objects.filter(
+        reply_sent=False,
+        reply_message_id="",
+        reply_error="",
+        ticket__servicenow_ticket_number__isnull=False,
+    ).select_related("ticket")
+
+
+# Build the replies and put them in the outbox, returns the number queued
+def queue_email_replies(emails):
+    outbound = []
+    for email in emails:
+        try:
+            msg, message_id = build_email_reply(
+                email.account_key, email.ticket.servicenow_ticket_number, email.sender, email.subject
+            )
+        except Exception as e:
+            logger.error(f"Cannot build reply for Ticket #{email.ticket_id}: {e}")
+            # out of the pending set, otherwise it blocks the head of the sweeper's queue
+            EmailTicket.objects.filter(id=email.id, reply_message_id="").update(reply_error=str(e)[:255])
+            continue
+        outbound.append(
+            OutboundEmail(
+                account_key=email.account_key,
+                kind="reply",
+                to_email=email.sender,
+                subject=msg.subject,
+                text_body=msg.body,
+                html_body=msg.alternatives[0][0] if msg.alternatives else "",
+                headers={"Message-ID": message_id},
+                email_ticket=email,
+            )
+        )
+
+    with transaction.atomic():
+        claimed = []
+        for item in outbound:
+            # the event task and the sweeper may see the same email, the first claim wins
+            if EmailTicket.objects.filter(id=item.email_ticket_id, reply_message_id="").update(
+                reply_message_id=item.headers["Message-ID"]
+            ):
+                claimed.append(item)
+        enqueue_emails(claimed)
+    return len(claimed)
+
+
 @shared_task
+def send_ticket_replies(ticket_ids):
+    """
+    Queue the 'Ticket Created' reply for tickets that just got their ServiceNow
+    number, including near-duplicates linked to them.
+    """
+    emails = list(
+        _pending_reply_emails().filter(
+            Q(ticket_id__in=ticket_ids) | Q(ticket__duplicate_of_id__in=ticket_ids)
+        )
+    )
+    if not emails:
+        return 0
+    queued = queue_email_replies(emails)
+    logger.info(f"Queued {queued} email replies for tickets {ticket_ids}")
+    return queued
+
+
+@shared_task
+@singleton_task(name="send_email_replay_with_ticket", lease=600)
 def send_email_replay_with_ticket():
-    tickets = Ticket.objects.exclude(Q(servicenow_ticket_number__isnull=True)| Q(email_record__reply_sent=True))
-    account_key = "support"
-    if tickets is not None:
-        for ticket in tickets:
-            email = getattr(ticket, 'email_record', None)
-            if email is not None:
-                logger.debug(f"Sending email reply to {email.sender} with ticket number.")
-                ticket_number = ticket.servicenow_ticket_number
-                if ticket_number:
-                    send_email_reply(account_key, ticket_number, email.sender, email.subject)
-                    logger.debug(f"Email reply sent to {email.sender} for Ticket #{ticket.id}")
-    else:
+    """
+    Sweep up replies the per-ticket trigger missed (broker outage, crash between
+    the ServiceNow call and queueing). Emails younger than EMAIL_REPLY_SWEEP_GRACE_SECONDS
+    are left to that trigger.
+    """
+    cutoff = timezone.now() - timedelta(seconds=get_reply_sweep_grace())
+    emails = list(
+        _pending_reply_emails()
+        .filter(received_at__lte=cutoff)
+        .order_by("received_at")[:get_outbox_batch_size()]
+    )
+    if not emails:
         logger.debug("All email replay are sent")
+        return
+    queued = queue_email_replies(emails)
+    logger.info(f"Sweeper queued {queued} straggling email replies")
 
 
+@shared_task
+@singleton_task(name="send_outbound_emails", lease=600)
+def send_outbound_emails(account_keys=None):
+    """ Drain the outgoing email outbox, optionally only some accounts """
+    return drain_outbox(account_keys=account_keys)
+
+
+@shared_task
+@singleton_task(name="prune_raw_email_blobs", lease=1800)
+def prune_raw_email_blobs_task():
+    """ Delete raw email blobs left behind by deleted emails """
+    return prune_raw_email_blobs()
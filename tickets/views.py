@@ -2,18 +2,16 @@ import logging
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
-from .models import Ticket, EmailTicket
+from .models import Ticket
 from django.core.paginator import Paginator
 from django.utils import timezone
 from django.db.models import Q
 from .forms import TicketForm, TicketAdminEditForm
-from django.db import transaction
 from django.http import JsonResponse
 from django.contrib import messages
 from django.core.exceptions import PermissionDenied
 from django.views.decorators.http import require_POST
 from django.core.exceptions import ValidationError
-from tickets.utils.task  import send_email_replay_with_ticket
 from ai.views import predict_category, predict_category_confidence, predict_priority, predict_priority_confidence
 from servicenow.utils.task import process_ticket_task
 from servicenow.models import AssignmentGroup
@@ -74,77 +72,6 @@ def ticket_create(request):
 
     return render(request, "tickets/submit_issues.html", {"form": form})
 
-# create ticket from email
-def email_ticket_create(email_uid, sender, subject, body, raw_email, user, account_key):
-    logger.info("Email ticket view accessed.")
-
-    # check if email ticket with uid already exists
-    email_ticket = EmailTicket.objects.filter(uid=email_uid).first()
-    if email_ticket and email_ticket.ticket:
-        logger.debug(f"Email ticket with UID {email_uid} already exists.")
-        return email_ticket.ticket, email_ticket
-
-    # create the ticket if not exists
-    ai_input_txt = subject + " " + body
-    predicted_category = predict_category(ai_input_txt).strip().lower()
-    predicted_category_confidence_value = predict_category_confidence(ai_input_txt)
-    if predicted_category_confidence_value is not None:
-        predicted_category_confidence=round(predicted_category_confidence_value,4)*100
-    predicted_priority = predict_priority(ai_input_txt)
-    predicted_priority_confidence_value = predict_priority_confidence(ai_input_txt)
-    if predicted_priority_confidence_value is not None:
-        predicted_priority_confidence=round(predicted_priority_confidence_value,4)*100
-    logger.info(f"Predicted category: {predicted_category}, Predicted category confidence: {predicted_category_confidence}, Predicted priority: {predicted_priority}, Predicted priority confidence: {predicted_priority_confidence}")
-
-    group = AssignmentGroup.objects.filter(category=predicted_category.lower()).first()
-    if group:
-        assigned_team = group
-
-    logger.debug(f"Creating ticket for email UID {email_uid} from sender {sender}")
-    with transaction.atomic():
-        ticket = Ticket.objects.create(
-            title=subject[:200] if subject else "No subject",
-            description=body or "",
-            category=predicted_category or "Application",
-            category_confidence=predicted_category_confidence,
-            priority=predicted_priority,
-            priority_confidence=predicted_priority_confidence,
-            assigned_team = assigned_team,
-            assignment_group_id = group.servicenow_group_id,
-            created_by=user,  
-            request_type="email",
-            ticket_creation_status = "pending",
-        )
-    logger.debug(f"Ticket #{ticket.id} created for email UID {email_uid}")
-
-    logger.debug(f"Creating EmailTicket for UID {email_uid}")
-    email_ticket, created = EmailTicket.objects.get_or_create(
-        uid=email_uid,
-        defaults={
-            "sender": sender,
-            "subject": subject,
-            "body": body,
-            "raw_email": raw_email,
-            "ticket": ticket,
-            "received_at": timezone.now(),
-        },
-    )
-    logger.debug(f"EmailTicket for UID {email_uid} created.")
-
-    logger.debug(f"Linking EmailTicket UID {email_uid} to Ticket #{ticket.id}")
-    if not created and email_ticket.ticket is None:
-        email_ticket.ticket = ticket
-        email_ticket.save(update_fields=["ticket"])
-        logger.debug(f"Linked EmailTicket UID {email_uid} to Ticket #{ticket.id}")
-
-    try:
-        process_ticket_task.delay(ticket.id)
-        send_email_replay_with_ticket.delay()
-    except Exception: 
-        error = ticket.error_message
-        logger.error(f"Error: {error}")
-    return ticket, email_ticket
-
 # Ticket processing view - shows status while syncing
 @login_required
 def ticket_processing(request, ticket_id):
@@ -265,7 +192,13 @@ def ticket_detail(request, ticket_id):
     if not request.user.is_staff and ticket not in user_tickets:
         raise PermissionDenied("You do not have permission to view this ticket.")
 
-    return render(request, "tickets/ticket_detail.html", {"ticket": ticket})
+    comments = ticket.comments.select_related("author", "email_record")
+    duplicates = ticket.duplicates.only("id") if request.user.is_staff else []
+    return render(
+        request,
+        "tickets/ticket_detail.html",
+        {"ticket": ticket, "comments": comments, "duplicates": duplicates},
+    )
 
 # Admin ticket edit view
 @staff_member_required